@@ -0,0 +1,205 @@
+"""
+Aggregations used to build the zoom levels of a multivec file.
+
+Every zoom level halves the number of bins of the previous one, so an
+aggregation combines pairs of adjacent rows. The rows are kept in an
+intermediate state (e.g. sums and counts for the mean) that is only
+turned into the stored values at the end, so that the aggregate of a
+bin is computed over all of the base bins it covers.
+"""
+
+import numpy as np
+
+
+def _pairs(state):
+    return (state[0::2], state[1::2])
+
+
+def _nan_add(a, b):
+    """
+    Add arrays, ignoring NaN values. NaN + NaN stays NaN.
+    """
+    both_empty = np.isnan(a) & np.isnan(b)
+    total = np.nan_to_num(a) + np.nan_to_num(b)
+    total[both_empty] = np.nan
+    return total
+
+
+class Aggregation:
+    """
+    A vectorized, NaN-aware reducer of pairs of adjacent rows.
+
+    Parameters
+    ----------
+    name: str
+    width: int
+        The number of state columns for each column of the data
+    init: function
+        Create the state of the base resolution from its values
+    reduce: function
+        Combine the state of the even and odd rows
+    finalize: function
+        Turn the state into the values that are stored
+    """
+
+    def __init__(self, name, width, init, reduce, finalize):
+        self.name = name
+        self.width = width
+        self.init = init
+        self.reduce = reduce
+        self.finalize = finalize
+
+
+def _init_mean(values):
+    return np.concatenate((values, (~np.isnan(values)).astype(values.dtype)), axis=1)
+
+
+def _reduce_mean(a, b):
+    num_cols = a.shape[1] // 2
+    return np.concatenate(
+        (_nan_add(a[:, :num_cols], b[:, :num_cols]), a[:, num_cols:] + b[:, num_cols:]),
+        axis=1,
+    )
+
+
+def _finalize_mean(state):
+    num_cols = state.shape[1] // 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return state[:, :num_cols] / state[:, num_cols:]
+
+
+AGGREGATIONS = {
+    "sum": Aggregation("sum", 1, lambda x: x, _nan_add, lambda x: x),
+    "mean": Aggregation("mean", 2, _init_mean, _reduce_mean, _finalize_mean),
+    "max": Aggregation("max", 1, lambda x: x, np.fmax, lambda x: x),
+    "min": Aggregation("min", 1, lambda x: x, np.fmin, lambda x: x),
+    "count": Aggregation(
+        "count", 1, lambda x: (~np.isnan(x)).astype(x.dtype), np.add, lambda x: x
+    ),
+}
+
+
+class Pyramid:
+    """
+    Aggregate the rows of a multivec with one or more statistics.
+
+    With several statistics, the stored values hold the columns of each
+    statistic side by side, in the order of the names.
+
+    Parameters
+    ----------
+    agg: str, [str, ...] or lambda
+        The names of built-in aggregations (see AGGREGATIONS) or a function
+        that takes an array with an even number of rows and returns the
+        aggregate of each pair of rows. A function is given the last row
+        of an odd-length level together with a row of NaN values.
+    """
+
+    def __init__(self, agg):
+        if callable(agg):
+            self.names = None
+            self.aggregations = None
+            self.agg = agg
+            return
+
+        self.names = [agg] if isinstance(agg, str) else list(agg)
+        for name in self.names:
+            if name not in AGGREGATIONS:
+                raise ValueError(
+                    "Unknown aggregation {}, expected one of {}".format(
+                        name, ", ".join(AGGREGATIONS)
+                    )
+                )
+        self.aggregations = [AGGREGATIONS[name] for name in self.names]
+
+    def num_columns(self, num_cols):
+        """
+        The number of stored columns for data with num_cols columns.
+        """
+        if self.aggregations is None:
+            return num_cols
+        return num_cols * len(self.aggregations)
+
+    def _split(self, state):
+        # the state columns of each of the aggregations
+        num_cols = state.shape[1] // sum(a.width for a in self.aggregations)
+        start = 0
+        for aggregation in self.aggregations:
+            end = start + aggregation.width * num_cols
+            yield (aggregation, state[:, start:end])
+            start = end
+
+    def init(self, values):
+        """
+        The state of the rows of the base resolution.
+        """
+        if self.aggregations is None:
+            return values
+        return np.concatenate(
+            [aggregation.init(values) for aggregation in self.aggregations], axis=1
+        )
+
+    def reduce(self, state):
+        """
+        Aggregate pairs of adjacent rows of a state with an even number of rows.
+        """
+        if self.aggregations is None:
+            return np.asarray(self.agg(state), dtype=state.dtype)
+        return np.concatenate(
+            [aggregation.reduce(*_pairs(s)) for (aggregation, s) in self._split(state)],
+            axis=1,
+        )
+
+    def reduce_last(self, state):
+        """
+        Aggregate the single last row of an odd-length level.
+        """
+        if self.aggregations is None:
+            padded = np.concatenate((state, np.full_like(state, np.nan)))
+            return np.asarray(self.agg(padded), dtype=state.dtype)
+        # a bin that covers a single bin of the previous level
+        return state
+
+    def finalize(self, state):
+        """
+        The values that are stored for a state.
+        """
+        if self.aggregations is None:
+            return state
+        return np.concatenate(
+            [aggregation.finalize(s) for (aggregation, s) in self._split(state)], axis=1
+        )
+
+
+class SummaryPyramid(Pyramid):
+    """
+    Aggregate rows that already hold the stored values of every statistic
+    side by side, e.g. a zoom level read from the zoom-level summaries of
+    the input files, into the coarser zoom levels.
+
+    Sums, counts, maxima and minima are combined as they are. Means are
+    averaged over the non-empty rows, regardless of how many bases each
+    row covers.
+
+    Parameters
+    ----------
+    agg: str or [str, ...]
+        The names of built-in aggregations, see AGGREGATIONS
+    """
+
+    def __init__(self, agg):
+        if callable(agg):
+            raise ValueError("Only built-in aggregations can be aggregated from stored values")
+        super().__init__(agg)
+
+    def init(self, values):
+        num_cols = values.shape[1] // len(self.aggregations)
+        state = []
+        for (index, aggregation) in enumerate(self.aggregations):
+            stored = values[:, index * num_cols : (index + 1) * num_cols]
+            # the counts are added up, an empty row has none
+            if aggregation.name == "count":
+                state += [np.nan_to_num(stored)]
+            else:
+                state += [aggregation.init(stored)]
+        return np.concatenate(state, axis=1)
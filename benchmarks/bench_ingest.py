@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the interval ingestion throughput of the per-interval loop that
+bigwigs_to_multivec used to run with the vectorized convert.read_window.
+
+    python benchmarks/bench_ingest.py [chrom_size [density]]
+"""
+
+import argparse
+import math
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pyBigWig
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+import convert  # noqa: E402
+from synthetic import make_bigwig  # noqa: E402
+
+
+def legacy_read_window(bw, chrom, start_bin, end_bin, starting_resolution, out):
+    """
+    The per-interval ingestion loop used before the vectorized path.
+    """
+    for interval in bw.intervals(chrom):
+        (interval_start, interval_end, value) = interval
+
+        fixed_interval_start = interval_start // starting_resolution
+        fixed_interval_end = math.ceil(interval_end / starting_resolution)
+
+        out[fixed_interval_start:fixed_interval_end] = np.full(
+            (fixed_interval_end - fixed_interval_start), value
+        )
+
+
+def measure(read, bw, chrom, size, resolution):
+    num_bins = math.ceil(size / resolution)
+    out = np.zeros(num_bins, dtype=np.float32)
+
+    start_time = time.perf_counter()
+    read(bw, chrom, 0, num_bins, resolution, out)
+    return time.perf_counter() - start_time
+
+
+def bench(chrom_size=10000000, density=0.8, resolutions=(1, 10, 1000)):
+    with tempfile.TemporaryDirectory() as td:
+        path = op.join(td, "bench.bw")
+        num_intervals = make_bigwig(path, [("chr1", chrom_size)], density)
+        print(num_intervals, "intervals on chr1 of", chrom_size, "bp")
+
+        bw = pyBigWig.open(path)
+        for resolution in resolutions:
+            before = measure(legacy_read_window, bw, "chr1", chrom_size, resolution)
+            after = measure(convert.read_window, bw, "chr1", chrom_size, resolution)
+            print(
+                "resolution {:>6}: before {:>12,.0f} intervals/sec, "
+                "after {:>12,.0f} intervals/sec ({:.1f}x)".format(
+                    resolution,
+                    num_intervals / before,
+                    num_intervals / after,
+                    before / after,
+                )
+            )
+        bw.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the interval ingestion throughput before and after vectorization."
+    )
+    parser.add_argument(
+        "chrom_size", nargs="?", type=int, default=10000000,
+        help="the size of the synthetic chromosome (default: 10000000)"
+    )
+    parser.add_argument(
+        "density", nargs="?", type=float, default=0.8,
+        help="the fraction of the chromosome covered by intervals (default: 0.8)"
+    )
+    args = parser.parse_args()
+    bench(args.chrom_size, args.density)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Compare storage layouts of the multivec output: file size, conversion
+time and the latency of reading random tiles.
+
+    python benchmarks/bench_storage.py [num_tracks [chrom_size]]
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import h5py
+import numpy as np
+
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+import convert  # noqa: E402
+from synthetic import make_bigwig  # noqa: E402
+
+TILE_SIZE = 256
+
+DTYPES = ["f4", "f2"]
+CODECS = [
+    ("gzip", 4, False),
+    ("gzip", 4, True),
+    ("gzip", 9, True),
+    ("lzf", None, False),
+    ("lzf", None, True),
+    (None, None, False),
+]
+CHUNK_ROWS = [None, TILE_SIZE]
+
+
+def read_random_tiles(path, num_tiles=200, seed=0):
+    """
+    The mean latency in milliseconds of reading one tile
+    at a random resolution and position, with the file open.
+    """
+    rng = np.random.default_rng(seed)
+
+    with h5py.File(path, "r") as f:
+        datasets = [
+            f["resolutions"][res]["values"][chrom]
+            for res in f["resolutions"]
+            for chrom in f["resolutions"][res]["values"]
+        ]
+        start_time = time.perf_counter()
+        for i in range(num_tiles):
+            dataset = datasets[rng.integers(len(datasets))]
+            num_tiles_in_dataset = max(1, len(dataset) // TILE_SIZE)
+            x = rng.integers(num_tiles_in_dataset)
+            dataset[x * TILE_SIZE : (x + 1) * TILE_SIZE]
+
+    return (time.perf_counter() - start_time) / num_tiles * 1000
+
+
+def bench(num_tracks=8, chrom_size=5000000):
+    with tempfile.TemporaryDirectory() as td:
+        chromsizes = [("chr1", chrom_size), ("chr2", chrom_size // 2)]
+        input_files = []
+        for i in range(num_tracks):
+            input_files += [op.join(td, "{}.bw".format(i))]
+            make_bigwig(input_files[-1], chromsizes, density=0.5, seed=i)
+        print(num_tracks, "tracks,", sum(size for (_, size) in chromsizes), "bp")
+
+        print(
+            "{:>5} {:>6} {:>6} {:>8} {:>10} {:>12} {:>9} {:>13}".format(
+                "dtype", "codec", "level", "shuffle", "chunk rows",
+                "size (MB)", "time (s)", "tile read (ms)"
+            )
+        )
+        for dtype, (compression, level, shuffle), chunk_rows in itertools.product(
+            DTYPES, CODECS, CHUNK_ROWS
+        ):
+            output_file = op.join(td, "out.multires.mv5")
+
+            start_time = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                convert.bigwigs_to_multivec(
+                    input_files,
+                    output_file,
+                    starting_resolution=1,
+                    dtype=dtype,
+                    compression=compression,
+                    compression_opts=level,
+                    shuffle=shuffle,
+                    chunk_rows=chunk_rows,
+                    header_index=None,
+                )
+            conversion_time = time.perf_counter() - start_time
+
+            print(
+                "{:>5} {:>6} {:>6} {:>8} {:>10} {:>12.2f} {:>9.2f} {:>13.3f}".format(
+                    dtype,
+                    str(compression),
+                    str(level or "-"),
+                    str(shuffle),
+                    str(chunk_rows or "auto"),
+                    os.path.getsize(output_file) / 1e6,
+                    conversion_time,
+                    read_random_tiles(output_file),
+                )
+            )
+            os.remove(output_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the storage layouts of the output on synthetic tracks."
+    )
+    parser.add_argument(
+        "num_tracks", nargs="?", type=int, default=8,
+        help="the number of tracks (default: 8)"
+    )
+    parser.add_argument(
+        "chrom_size", nargs="?", type=int, default=5000000,
+        help="the size of the first chromosome, the second one is half as large "
+        "(default: 5000000)"
+    )
+    args = parser.parse_args()
+    bench(args.num_tracks, args.chrom_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Compare the latency of reading tiles from the HDF5 output and from the
+flat output, uncompressed (memory-mapped) and compressed with zlib.
+
+    python benchmarks/bench_tiles.py [--tracks N] [--genome hg38] [--scale 0.01] ...
+
+The outputs are built from the same synthetic values, so every backend
+returns the same tiles. Every reader is opened fresh and reads the same
+random tiles twice: the first pass decompresses the chunks or blocks, the
+second one finds them in the cache of the reader. The files are in the
+page cache of the operating system for both passes.
+"""
+
+import argparse
+import contextlib
+import io
+import math
+import os
+import os.path as op
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+BENCHMARKS_DIR = op.dirname(op.abspath(__file__))
+sys.path.insert(0, op.dirname(BENCHMARKS_DIR))
+
+import flatfile  # noqa: E402
+import multivec as cmv  # noqa: E402
+import reader  # noqa: E402
+from synthetic import genome  # noqa: E402
+
+
+def make_arrays(chromsizes, num_tracks, starting_resolution, density, mean_length, seed=0):
+    """
+    Arrays of runs of equal values, like the values of synthetic tracks.
+    """
+    rng = np.random.default_rng(seed)
+    run_length = max(1, mean_length // starting_resolution)
+    array_data = {}
+    for (chrom, size) in chromsizes:
+        num_rows = math.ceil(size / starting_resolution)
+        runs = rng.random((num_rows // run_length + 1, num_tracks), dtype=np.float32)
+        runs[runs > density] = np.nan
+        array_data[chrom] = np.repeat(runs * 10, run_length, axis=0)[:num_rows]
+    return array_data
+
+
+def size_on_disk(path):
+    if op.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return op.getsize(path)
+
+
+def random_tiles(tileset_info, num_tiles, seed=0):
+    """
+    Random (zoom, x) tiles inside the genome, with as many at every zoom level.
+    """
+    rng = np.random.default_rng(seed)
+    resolutions = tileset_info["resolutions"]
+    tiles = []
+    for i in range(num_tiles):
+        zoom = i % len(resolutions)
+        tile_width = resolutions[zoom] * tileset_info["tile_size"]
+        tiles += [(zoom, int(rng.integers(math.ceil(tileset_info["max_pos"][0] / tile_width))))]
+    return tiles
+
+
+def time_tiles(tile_reader, tiles):
+    """
+    The latency in microseconds of reading every tile into a contiguous
+    array, e.g. to send it to a client.
+    """
+    latencies = []
+    for (zoom, x) in tiles:
+        start_time = time.perf_counter()
+        np.ascontiguousarray(tile_reader.tile(zoom, x))
+        latencies += [(time.perf_counter() - start_time) * 1e6]
+    return np.array(latencies)
+
+
+def bench(args):
+    chromsizes = genome(args.genome, args.scale, args.chroms)
+    array_data = make_arrays(
+        chromsizes, args.tracks, args.starting_resolution, args.density, args.mean_length
+    )
+    print(
+        "{} tracks, {} chromosomes, {} bp at {} bp".format(
+            args.tracks, len(chromsizes), sum(size for (_, size) in chromsizes),
+            args.starting_resolution,
+        )
+    )
+
+    with tempfile.TemporaryDirectory() as td:
+        outputs = [("hdf5 (gzip)", op.join(td, "out.multires.mv5"))]
+        with contextlib.redirect_stdout(io.StringIO()):
+            cmv.create_multivec_multires(
+                array_data,
+                chromsizes,
+                "sum",
+                starting_resolution=args.starting_resolution,
+                tile_size=args.tile_size,
+                output_file=outputs[0][1],
+            ).close()
+
+        for compression in (None, "zlib"):
+            path = op.join(td, "out-{}.mvflat".format(compression or "raw"))
+            start_time = time.perf_counter()
+            flatfile.convert_multires(outputs[0][1], path, compression=compression)
+            print(
+                "Converted to flat ({}) in {:.2f} s".format(
+                    compression or "uncompressed", time.perf_counter() - start_time
+                )
+            )
+            outputs += [("flat ({})".format(compression or "mmap"), path)]
+
+        print(
+            "{:<14} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+                "backend", "size (MB)", "open (ms)", "p50 (us)", "p99 (us)",
+                "warm p50", "warm p99"
+            )
+        )
+        tiles = None
+        for (name, path) in outputs:
+            start_time = time.perf_counter()
+            tile_reader = reader.FlatReader(path) if flatfile.is_flat(path) \
+                else reader.MultivecReader(path)
+            open_time = (time.perf_counter() - start_time) * 1000
+            if tiles is None:
+                tiles = random_tiles(tile_reader.tileset_info(), args.tiles)
+
+            cold = time_tiles(tile_reader, tiles)
+            warm = time_tiles(tile_reader, tiles)
+            tile_reader.close()
+
+            print(
+                "{:<14} {:>10.2f} {:>10.2f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+                    name,
+                    size_on_disk(path) / 1e6,
+                    open_time,
+                    np.percentile(cold, 50),
+                    np.percentile(cold, 99),
+                    np.percentile(warm, 50),
+                    np.percentile(warm, 99),
+                )
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the latency of tile reads from the HDF5 and flat outputs."
+    )
+    parser.add_argument("--tracks", type=int, default=16, help="the number of tracks (default: 16)")
+    parser.add_argument(
+        "--genome", choices=["hg38", "small"], default="hg38",
+        help="the chromosome set (default: hg38)"
+    )
+    parser.add_argument(
+        "--scale", type=float, default=0.01,
+        help="a factor applied to the chromosome sizes (default: 0.01)"
+    )
+    parser.add_argument(
+        "--chroms", type=int, default=None,
+        help="only use the first CHROMS chromosomes"
+    )
+    parser.add_argument(
+        "--starting-resolution", type=int, default=10,
+        help="the resolution of the base level (default: 10)"
+    )
+    parser.add_argument(
+        "--tile-size", type=int, default=256,
+        help="the number of bins of a tile (default: 256)"
+    )
+    parser.add_argument(
+        "--density", type=float, default=0.5,
+        help="the fraction of bins with values (default: 0.5)"
+    )
+    parser.add_argument(
+        "--mean-length", type=int, default=50,
+        help="the mean length of a run of equal values in bp (default: 50)"
+    )
+    parser.add_argument(
+        "--tiles", type=int, default=2000,
+        help="the number of random tiles read from every output (default: 2000)"
+    )
+    bench(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
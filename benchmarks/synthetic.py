@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+Generate synthetic BigWig files for benchmarking the conversion pipeline.
+"""
+
+import os.path as op
+
+import numpy as np
+import pyBigWig
+
+# The sizes of the main chromosomes of hg38.
+HG38_CHROMSIZES = [
+    ("chr1", 248956422), ("chr2", 242193529), ("chr3", 198295559),
+    ("chr4", 190214555), ("chr5", 181538259), ("chr6", 170805979),
+    ("chr7", 159345973), ("chr8", 145138636), ("chr9", 138394717),
+    ("chr10", 133797422), ("chr11", 135086622), ("chr12", 133275309),
+    ("chr13", 114364328), ("chr14", 107043718), ("chr15", 101991189),
+    ("chr16", 90338345), ("chr17", 83257441), ("chr18", 80373285),
+    ("chr19", 58617616), ("chr20", 64444167), ("chr21", 46709983),
+    ("chr22", 50818468), ("chrX", 156040895), ("chrY", 57227415),
+]
+
+# The size of the regions that are left empty as a whole for sparse tracks.
+SPARSE_BLOCK_SIZE = 100000
+
+
+def genome(name="hg38", scale=1.0, num_chroms=None):
+    """
+    The chromosome sizes of a synthetic genome.
+
+    Parameters
+    ----------
+    name: str (default 'hg38')
+        'hg38' for the main chromosomes of hg38, or 'small' for
+        two chromosomes of 5 and 2.5 Mb
+    scale: float (default 1.0)
+        A factor applied to every chromosome size
+    num_chroms: int (default: all)
+        Only keep the first num_chroms chromosomes
+    """
+    if name == "hg38":
+        chromsizes = HG38_CHROMSIZES
+    elif name == "small":
+        chromsizes = [("chr1", 5000000), ("chr2", 2500000)]
+    else:
+        raise ValueError("Unknown genome: {}".format(name))
+
+    return [
+        (chrom, max(1, int(size * scale)))
+        for (chrom, size) in chromsizes[:num_chroms]
+    ]
+
+
+def make_intervals(size, density=1.0, mean_length=20, seed=0, sparsity=0.0):
+    """
+    Create sorted, non-overlapping intervals on a chromosome of `size` bases.
+
+    Parameters
+    ----------
+    size: int
+        The size of the chromosome in base pairs
+    density: float (default 1.0)
+        The fraction of the chromosome covered by intervals
+    mean_length: int (default 20)
+        The average length of an interval in base pairs
+    seed: int (default 0)
+        The seed of the random generator
+    sparsity: float (default 0.0)
+        The fraction of regions of SPARSE_BLOCK_SIZE bases without any
+        intervals, like the gaps and unmappable regions of real tracks
+
+    Returns
+    -------
+    (starts, ends, values): numpy arrays
+    """
+    rng = np.random.default_rng(seed)
+
+    # Draw more intervals than needed and cut them at the chromosome end.
+    num_intervals = int(size / mean_length) + 1
+    lengths = rng.integers(1, 2 * mean_length, num_intervals)
+    if density < 1.0:
+        gap_mean = mean_length * (1 - density) / max(density, 1e-9)
+        gaps = rng.geometric(1 / (gap_mean + 1), num_intervals) - 1
+    else:
+        gaps = np.zeros(num_intervals, dtype=np.int64)
+
+    ends = np.cumsum(gaps + lengths)
+    starts = ends - lengths
+    keep = starts < size
+    starts, ends = starts[keep], np.minimum(ends[keep], size)
+    values = rng.random(len(starts)).astype(np.float64) * 10
+
+    if sparsity > 0:
+        empty_blocks = rng.random(size // SPARSE_BLOCK_SIZE + 1) < sparsity
+        keep = ~empty_blocks[starts // SPARSE_BLOCK_SIZE]
+        starts, ends, values = starts[keep], ends[keep], values[keep]
+
+    return (starts, ends, values)
+
+
+def make_bigwig(path, chromsizes, density=1.0, mean_length=20, seed=0, sparsity=0.0):
+    """
+    Write a synthetic bigwig file.
+
+    Parameters
+    ----------
+    path: output file path
+    chromsizes: [('chrom_key', size),...]
+    density: float (default 1.0)
+        The fraction of each chromosome covered by intervals
+    mean_length: int (default 20)
+        The average length of an interval in base pairs
+    seed: int (default 0)
+        The seed of the random generator
+    sparsity: float (default 0.0)
+        The fraction of empty regions, see make_intervals
+
+    Returns
+    -------
+    The total number of intervals written.
+    """
+    bw = pyBigWig.open(path, "w")
+    bw.addHeader(list(chromsizes), maxZooms=10)
+
+    num_intervals = 0
+    for (chrom_index, (chrom, size)) in enumerate(chromsizes):
+        (starts, ends, values) = make_intervals(
+            size, density, mean_length, seed * 1000 + chrom_index, sparsity
+        )
+        if len(starts) == 0:
+            continue
+        bw.addEntries(
+            [chrom] * len(starts),
+            starts.tolist(),
+            ends=ends.tolist(),
+            values=values.tolist()
+        )
+        num_intervals += len(starts)
+
+    bw.close()
+    return num_intervals
+
+
+def make_tracks(directory, num_tracks, chromsizes, density=1.0, mean_length=20,
+                sparsity=0.0, seed=0):
+    """
+    Write num_tracks synthetic bigwig files with different seeds.
+
+    Returns
+    -------
+    (paths, total number of intervals)
+    """
+    paths = []
+    num_intervals = 0
+    for track in range(num_tracks):
+        paths += [op.join(directory, "track{}.bw".format(track))]
+        num_intervals += make_bigwig(
+            paths[-1], chromsizes, density, mean_length, seed + track, sparsity
+        )
+    return (paths, num_intervals)
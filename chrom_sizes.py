@@ -0,0 +1,208 @@
+"""
+The chromosomes of a conversion, given by a chromosome sizes file or the
+name of a UCSC assembly instead of the headers of the input files.
+
+Assemblies with many scaffolds (e.g. alternative contigs or draft
+genomes) are sorted in natural order, see utils.natural_key, and their
+tiny contigs can be dropped, or bucketed: laid out one after another in
+a single pseudo-chromosome, so that the output doesn't have datasets for
+every one of them at every resolution.
+"""
+
+import hashlib
+import math
+import os
+import os.path as op
+import re
+
+import numpy as np
+
+import fetch
+import utils
+
+# The downloaded chromosome sizes files, shared by all conversions.
+DEFAULT_CACHE_DIR = op.join(op.dirname(fetch.DEFAULT_CACHE_DIR), "chromsizes")
+
+# The chromosome sizes of a UCSC assembly.
+UCSC_URL = "https://hgdownload.soe.ucsc.edu/goldenPath/{0}/bigZips/{0}.chrom.sizes"
+
+# The name of an assembly, e.g. hg38 or mm10.
+ASSEMBLY_NAME = re.compile(r"^[A-Za-z][A-Za-z0-9_.-]*$")
+
+# The default name of the pseudo-chromosome of the bucketed contigs.
+DEFAULT_BUCKET_NAME = "chrUn_bucket"
+
+
+def read_chromsizes(path):
+    """
+    Read a chromosome sizes file, with the name and the size of a
+    chromosome on every line, separated by tabs or spaces. Empty lines
+    and lines that start with '#' are skipped.
+
+    Returns
+    -------
+    [(chrom, size), ...] in the order of the file
+
+    Raises
+    ------
+    ValueError if a line can't be read or a chromosome is repeated
+    """
+    chromsizes = []
+    seen = set()
+    with open(path) as f:
+        for (line_number, line) in enumerate(f, 1):
+            fields = line.split()
+            if not fields or fields[0].startswith("#"):
+                continue
+            try:
+                (chrom, size) = (fields[0], int(fields[1]))
+            except (IndexError, ValueError):
+                raise ValueError("{}:{}: expected a chromosome and its size".format(path, line_number))
+            if size <= 0:
+                raise ValueError("{}:{}: the size of {} is not positive".format(path, line_number, chrom))
+            if chrom in seen:
+                raise ValueError("{}:{}: chromosome {} is repeated".format(path, line_number, chrom))
+            seen.add(chrom)
+            chromsizes += [(chrom, size)]
+    return chromsizes
+
+
+def download(url, cache_dir=DEFAULT_CACHE_DIR, name=None):
+    """
+    The path of a chromosome sizes file in the cache, which is downloaded
+    first if it isn't in the cache.
+
+    Parameters
+    ----------
+    url: str
+    cache_dir: str (default DEFAULT_CACHE_DIR)
+    name: str
+        The name of the file in the cache (default: named after the URL)
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    name = name or hashlib.sha1(url.encode()).hexdigest() + ".chrom.sizes"
+    path = op.join(cache_dir, name)
+    if op.exists(path):
+        return path
+
+    temp_path = "{}.{}.part".format(path, os.getpid())
+    try:
+        fetch.Session().download(url, temp_path)
+        os.replace(temp_path, path)
+    finally:
+        if op.exists(temp_path):
+            os.remove(temp_path)
+    return path
+
+
+def load_chromsizes(source, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    The chromosome sizes of a file, a URL or a UCSC assembly.
+
+    Parameters
+    ----------
+    source: str
+        The path or the http(s) URL of a chromosome sizes file, or the
+        name of a UCSC assembly, e.g. hg38
+    cache_dir: str (default DEFAULT_CACHE_DIR)
+        The cache of the downloaded files
+
+    Returns
+    -------
+    [(chrom, size), ...] in the order of the file, e.g. the order of the
+    chromosomes of a HiGlass assembly, or in natural order for a UCSC
+    assembly, whose files are sorted by size
+
+    Raises
+    ------
+    ValueError if the source is neither, or its file can't be read
+    IOError if it can't be downloaded
+    """
+    if op.exists(source):
+        return read_chromsizes(source)
+    if fetch.is_url(source):
+        return read_chromsizes(download(source, cache_dir))
+    if ASSEMBLY_NAME.match(source):
+        path = download(UCSC_URL.format(source), cache_dir, source + ".chrom.sizes")
+        return sorted(read_chromsizes(path), key=utils.sort_by_chrom)
+    raise ValueError("{} is not a chromosome sizes file, URL or assembly".format(source))
+
+
+def filter_contigs(chromsizes, min_size, bucket=None, starting_resolution=1):
+    """
+    Drop or bucket the contigs smaller than min_size.
+
+    Parameters
+    ----------
+    chromsizes: [(chrom, size), ...]
+    min_size: int
+        The size in base pairs below which a contig is small
+    bucket: str (default None)
+        The name of the pseudo-chromosome that the small contigs are laid
+        out in, one after another in their order. Every contig starts at
+        a bin of the starting resolution. None drops the small contigs.
+    starting_resolution: int (default 1)
+
+    Returns
+    -------
+    ([(chrom, size), ...], [(contig, bucket, start, size), ...]): the
+    chromosomes, with the bucket at the end if there is one, and the
+    contigs of the bucket with their start in it, see write_contigs
+    """
+    kept = [(chrom, size) for (chrom, size) in chromsizes if size >= min_size]
+    small = [(chrom, size) for (chrom, size) in chromsizes if size < min_size]
+    if bucket is None or not small:
+        return (kept, [])
+    if bucket in dict(chromsizes):
+        raise ValueError("The bucket {} is already a chromosome".format(bucket))
+
+    contigs = []
+    start = 0
+    for (contig, size) in small:
+        contigs += [(contig, bucket, start, size)]
+        start += math.ceil(size / starting_resolution) * starting_resolution
+    (_, _, last_start, last_size) = contigs[-1]
+    return (kept + [(bucket, last_start + last_size)], contigs)
+
+
+def write_contigs(f, contigs):
+    """
+    (Re)write the contigs that are laid out in the chromosomes of a
+    multires file, in the group 'contigs' with the datasets 'name',
+    'chrom' (the chromosome of the contig), 'start' (the position of the
+    contig in the chromosome) and 'length'.
+
+    Parameters
+    ----------
+    f: h5py.File
+    contigs: [('contig', 'chrom_key', start, size), ...]
+    """
+    if "contigs" in f:
+        del f["contigs"]
+    group = f.create_group("contigs")
+
+    names, chroms, starts, lengths = zip(*contigs)
+    for (name, data) in (("name", names), ("chrom", chroms)):
+        group.create_dataset(name, data=np.array(data, dtype="S"), compression="gzip")
+    for (name, data) in (("start", starts), ("length", lengths)):
+        group.create_dataset(name, data=np.array(data, dtype=np.int64), compression="gzip")
+
+
+def read_contigs(f):
+    """
+    The contigs that are laid out in the chromosomes of a multires
+    file, see write_contigs.
+
+    Returns
+    -------
+    [('contig', 'chrom_key', start, size), ...], empty if there are none
+    """
+    if "contigs" not in f:
+        return []
+    group = f["contigs"]
+    return list(zip(
+        [name.decode() for name in group["name"][:]],
+        [chrom.decode() for chrom in group["chrom"][:]],
+        group["start"][:].tolist(),
+        group["length"][:].tolist(),
+    ))
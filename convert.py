@@ -2,227 +2,1477 @@
 
 import sys
 import os
+import functools
 import os.path as op
 import pyBigWig
 import math
 import h5py
 import tempfile
-from statistics import mean
+import time
+import argparse
+import contextlib
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import multivec as cmv
+import flatfile
+import chrom_sizes
 import utils
+import planner
+import instrument
+import fetch
+from progress import Progress
+from header_index import HeaderIndex, DEFAULT_INDEX_PATH
+from options import ConversionOptions, DEFAULT_WINDOW_SIZE
 
-IS_DEBUG = False
+# The tile size of the output files.
+TILE_SIZE = 256
 
-test_input_files_1 = ["sample_data/2_treat.bw"]
-test_input_files_2 = ["sample_data/1_treat.bw", "sample_data/2_treat.bw"]
-test_input_files_3 = [
-    "sample_data/6_treat.bw", 
-    "sample_data/2_treat.bw", 
-    "sample_data/1_treat.bw"
-]
-test_input_files_58 = ["sample_output/" + str(i + 1) + "_cistrome_db.bw" for i in range(5)]
-
-def bigwigs_to_multivec(
-    input_files,
-    output_file=None,
-    starting_resolution=1
-):
+def bigwigs_to_multivec(input_files, output_file=None, options=None, **kwargs):
     """
     Convert a bigwig file to a multivec file.
 
     Parameters
     ----------
-    input_files: array of file paths
-    output_file: output file path
-    starting_resolution: int (default 1)
-        The starting resolution of the input data
+    input_files: array of file paths or http(s) URLs
+    output_file: output file path (default: see default_output_file)
+    options: ConversionOptions (default None)
+        The options of the conversion, see options.ConversionOptions
+    **kwargs:
+        Options of the conversion that are given one by one, e.g.
+        starting_resolution=10, instead of or on top of options
+
+    Raises
+    ------
+    ValueError if the options can't be combined, see ConversionOptions.check
     """
-    
+    options = ConversionOptions() if options is None else options
+    options = options.replace(**kwargs)
+
     utils.set_time()
 
     ## Handling Errors.
     # None input file.
-    if len(input_files) is 0:
+    if len(input_files) == 0:
         print("No input file suggested.")
         return
     print(len(input_files), "files prepared.")
     
+    instrument.info(
+        input_files=input_files,
+        starting_resolution=options.starting_resolution,
+        workers=options.workers,
+        dtype=options.dtype,
+        compression=options.compression,
+        aggregation=options.aggregation,
+        batch_size=options.batch_size,
+        chrom_workers=options.chrom_workers,
+        chroms=options.chroms,
+        regions=options.regions,
+        update=options.update
+    )
+
+    # The path of an output file, before anything is downloaded.
+    if output_file is None:
+        output_file = default_output_file(input_files[0], options.backend)
+    print("output_file:", output_file, utils.get_time_duration())
+
     # Not a bigwig file.
-    for in_file in input_files:
-        bw = pyBigWig.open(in_file)
-        if not bw.isBigWig(): 
-            print("Input files are not in a BigWig format:", in_file)
-            bw.close()
+    with instrument.stage("validate"):
+        index = HeaderIndex(options.header_index)
+        local_files = fetch_inputs(
+            input_files, index, options.download_dir, options.download_cache_size,
+            options.download_threads
+        )
+        index.save()
+        if local_files is None:
             return
-        bw.close()
 
-    # Define const variables.
-    EMPTY_VALUE = np.nan
-    
+    # The input files are read from the download cache and named after their URLs.
+    (input_names, input_files) = (input_files, local_files)
+
+    instrument.info(input_bytes=sum(index.get(in_file).get("size", 0) for in_file in input_files))
+
     ## Convert
-    # Store data in a cache file.
-    with tempfile.TemporaryDirectory() as td:
-        print("temporary dir:", td)
-
-        temp_file = op.join(td, "temp.mv5")
-        f_out = h5py.File(temp_file, "w")
-        
-        # Store largest sizes of individual chromosomes.
-        # Expect to be identical, but make sure.
-        chromsizes = []
-        for in_file in input_files:
-            bw = pyBigWig.open(in_file)
-            _chromsizes = bw.chroms() # dictionary
-            if len(chromsizes) is 0:
-                chromsizes = _chromsizes
-            else:
-                for (k, v) in _chromsizes.items():
-                    if k not in chromsizes:
-                        chromsizes[k] = v
-                    elif k in chromsizes and chromsizes[k] < v:
-                        chromsizes[k] = v
-            bw.close()
+    with instrument.stage("chromsizes"):
+        chromsizes = merge_chromsizes(input_files, index)
+        input_chroms = set(chrom for (chrom, _) in chromsizes)
+
+        if options.assembly is not None:
+            try:
+                assembly_chromsizes = chrom_sizes.load_chromsizes(options.assembly)
+            except (IOError, ValueError) as ex:
+                print("Can not read the chromosome sizes of {}: {}".format(options.assembly, ex))
+                return
+            sizes = dict(assembly_chromsizes)
+            skipped = [chrom for (chrom, _) in chromsizes if chrom not in sizes]
+            if skipped:
+                print("Skipping {} chromosomes that are not in {}: {}".format(
+                    len(skipped), options.assembly,
+                    ", ".join(skipped[:10]) + (", ..." if len(skipped) > 10 else "")
+                ))
+            chromsizes = assembly_chromsizes
 
-        # Convert dict to a list of tuples to input to multivec function.
-        chromsizes = sorted([(k, v) for k, v in chromsizes.items()], key=utils.sort_by_chrom)
-        
-        # TODO: Remove this line when tested with a single chromosome.
-        if IS_DEBUG:
-            # chromsizes = [("chr1", 248956422)]
-            chromsizes=[("chr9", 138394717)]
-            
-        # Init a variable.
-        raw_data = { 
-            chrom: np.zeros(
-                (
-                    len(input_files), 
-                    math.ceil(size / starting_resolution)
+        # The small contigs that are dropped or laid out in a bucket.
+        contigs = []
+        if options.min_contig_size is not None:
+            try:
+                (chromsizes, contigs) = chrom_sizes.filter_contigs(
+                    chromsizes, options.min_contig_size, options.bucket_contigs,
+                    options.starting_resolution
                 )
-            ) for (chrom, size) in chromsizes
-        }
-        # Create caches using name and size
-        for (chrom, size) in chromsizes:
-            f_out.create_dataset(
-                chrom,
-                (
-                    math.ceil(size / starting_resolution),
-                    len(input_files),
-                ),
-                fillvalue=EMPTY_VALUE,
-                compression="gzip"
+            except ValueError as ex:
+                print(ex)
+                return
+            if not chromsizes:
+                print("All chromosomes are smaller than", options.min_contig_size)
+                return
+            if contigs:
+                print("Bucketed", len(contigs), "contigs in", options.bucket_contigs)
+
+    # Values that can't be stored in the output type become infinite.
+    max_value = max(
+        [abs(index.get(in_file)[key]) for in_file in input_files for key in ("min", "max")
+         if index.get(in_file)[key] is not None],
+        default=0
+    )
+    if max_value > np.finfo(options.dtype).max:
+        print("Warning: values up to {} exceed the range of {} ({})".format(
+            max_value, options.dtype, np.finfo(options.dtype).max
+        ))
+    
+    # Only convert some of the chromosomes or regions.
+    bins = {}
+    if options.chroms is not None or options.regions is not None:
+        try:
+            (chromsizes, bins) = select_chromsizes(
+                chromsizes, options.chroms, options.regions, options.starting_resolution
             )
-        
-        print("Data initialized.", utils.get_time_duration())
-
-        for file_index, cur_in_file in enumerate(input_files):
-            bw = pyBigWig.open(cur_in_file)
-            
-            for (chrom, size) in bw.chroms().items():
-                
-                for interval in bw.intervals(chrom):
-                    (interval_start, interval_end, value) = interval
-                    
-                    fixed_interval_start = interval_start // starting_resolution
-                    fixed_interval_end = math.ceil(interval_end / starting_resolution)
-                    
-                    raw_data[chrom][file_index][
-                        fixed_interval_start : fixed_interval_end
-                    ] = np.full((fixed_interval_end - fixed_interval_start), value)
+        except ValueError as ex:
+            print(ex)
+            return
+        contigs = [contig for contig in contigs if contig[1] in dict(chromsizes)]
+        print("Converting", len(chromsizes), "chromosomes", utils.get_time_duration())
 
-            bw.close()
-            print("File processed:", cur_in_file, utils.get_time_duration())
-        
-        # Store raw data to a cache file.
-        # Use chunk for h5py to enhance performance.
-        # https://stackoverflow.com/a/27713489
-        is_chunck = False   # TODO: chunck not working with non-one resolution.
-        chunck_size = 100000000
-        for (chrom, size) in chromsizes:
-            if is_chunck:
-                cur_size = 0
-                while cur_size < size:
-                    next_size = cur_size + chunck_size if cur_size + chunck_size < size else size
-                    f_out[chrom][cur_size : next_size] = raw_data[chrom].T[cur_size : next_size]
-                    cur_size = next_size
+    # The resolutions of the output.
+    resolutions = cmv.get_resolutions(chromsizes, options.starting_resolution, TILE_SIZE)
+    if options.update:
+        names = options.aggregation
+        names = [names] if isinstance(names, str) else list(names)
+        try:
+            resolutions = check_update(output_file, input_names, names)
+        except (IOError, ValueError) as ex:
+            print("Can not update {}: {}".format(output_file, ex))
+            return
+
+    # The zoom levels that can be read from the zoom-level summaries.
+    zoom_resolutions = []
+    if options.zoom_summaries is not None or options.preview:
+        zoom_resolutions = get_zoom_summary_resolutions(
+            input_files, resolutions, options.zoom_summaries or 0, index
+        )
+        print("Zoom levels from summaries:", zoom_resolutions)
+        if options.preview and not zoom_resolutions:
+            print("No zoom-level summaries available for a preview.")
+            return
+
+    # Fit the conversion into the memory budget.
+    if options.max_memory is not None or options.dry_run:
+        settings = dict(
+            window_size=options.window_size,
+            batch_size=options.batch_size,
+            chunk_rows=options.chunk_rows,
+            starting_resolution=options.starting_resolution,
+            dtype=options.dtype,
+            aggregation=options.aggregation,
+            workers=options.workers,
+            chrom_workers=options.chrom_workers,
+            tile_size=TILE_SIZE,
+            values_block_size=VALUES_BLOCK_SIZE,
+            row_stats=options.row_stats,
+            base_memory=planner.current_rss()
+        )
+        if options.max_memory is not None:
+            try:
+                estimate = planner.plan_conversion(
+                    chromsizes, len(input_files), options.max_memory, **settings
+                )
+            except ValueError as ex:
+                print(ex)
+                return
+        else:
+            estimate = planner.estimate_conversion(chromsizes, len(input_files), **settings)
+        planner.print_estimate(estimate)
+
+        if options.dry_run:
+            return
+        try:
+            options = options.replace(
+                window_size=estimate["window_size"],
+                batch_size=estimate["batch_size"],
+                chunk_rows=estimate["chunk_rows"],
+                workers=estimate["workers"],
+                chrom_workers=estimate["chrom_workers"]
+            )
+        except ValueError as ex:
+            print("The memory budget is too small:", ex)
+            return
+
+    # Continue an interrupted conversion with the same parameters.
+    progress = None
+    if options.resume:
+        progress = Progress(output_file, {
+            "input_files": input_names,
+            "starting_resolution": options.starting_resolution,
+            "dtype": options.dtype,
+            "compression": options.compression,
+            "compression_opts": options.compression_opts,
+            "shuffle": options.shuffle,
+            "chunk_rows": options.chunk_rows,
+            "aggregation": options.aggregation,
+            "zoom_summaries": options.zoom_summaries,
+            "preview": options.preview,
+            "batch_size": options.batch_size,
+            "chroms": options.chroms,
+            "regions": options.regions,
+            "assembly": options.assembly,
+            "min_contig_size": options.min_contig_size,
+            "bucket_contigs": options.bucket_contigs,
+        })
+
+    # Override the output file if it existts.
+    if op.isfile(output_file) and progress is None and not options.update:
+        os.remove(output_file)
+
+    # Read one window of one chromosome across all input files at a time.
+    # The windows are written straight to the base resolution of the output.
+    # With regions, only the windows of the regions are read and
+    # they are passed on with their start bins.
+    # The worker pool and the open input files are released even if the
+    # conversion fails.
+    with contextlib.ExitStack() as stack:
+        if options.chrom_workers > 1:
+            # Every chromosome is read by the process that converts it.
+            chrom_values = lambda files, chrom, size: functools.partial(
+                read_chrom_values, files, chrom, size, options.starting_resolution,
+                options.window_size, bins.get(chrom)
+            )
+        else:
+            if options.workers > 1:
+                pool = stack.enter_context(ProcessPoolExecutor(options.workers))
+                windows = lambda files, chrom, size: iter_chrom_windows_parallel(
+                    pool, files, chrom, size, options.starting_resolution, options.window_size,
+                    bins=bins.get(chrom)
+                )
+            elif options.batch_size is not None:
+                # Only the files of the current batch are open.
+                windows = lambda files, chrom, size: iter_file_windows(
+                    files, chrom, size, options.starting_resolution, options.window_size,
+                    bins.get(chrom)
+                )
+            else:
+                bws = open_bigwigs(stack, input_files)
+                windows = lambda files, chrom, size: iter_chrom_windows(
+                    bws, chrom, size, options.starting_resolution, options.window_size,
+                    bins.get(chrom)
+                )
+            if options.regions is not None:
+                chrom_values = windows
             else:
-                f_out[chrom][0 : math.ceil(size / starting_resolution)] = raw_data[chrom].T
+                chrom_values = lambda files, chrom, size: window_values(windows(files, chrom, size))
 
-        print("Cache file saved", f_out[chrom].shape, utils.get_time_duration())
-        f_out.close()
+        # The contigs of the bucket are read one after another, in this process
+        # unless the bucket is converted by a chromosome worker.
+        if contigs:
+            contig_values = chrom_values
+            def chrom_values(files, chrom, size):
+                if chrom != options.bucket_contigs:
+                    return contig_values(files, chrom, size)
+                source = functools.partial(
+                    read_bucket_values, files, contigs, options.starting_resolution,
+                    options.window_size
+                )
+                return source if options.chrom_workers > 1 else source()
 
-        tf = temp_file
-        f_in = h5py.File(tf, "r")
+        column_batches = None
+        if options.batch_size is not None:
+            batches = [
+                input_files[start : start + options.batch_size]
+                for start in range(0, len(input_files), options.batch_size)
+            ]
+            column_batches = [len(batch) for batch in batches]
+            print(len(batches), "batches of up to", options.batch_size, "files.")
 
-        # The path of an output file.
-        if output_file is None:
-            output_file = op.splitext([input_files[0]][0])[0] + ".multires.mv5"
-        print("output_file:", output_file, utils.get_time_duration())
+            array_data = {
+                chrom: [chrom_values(batch, chrom, size) for batch in batches]
+                for (chrom, size) in chromsizes
+                if chrom in input_chroms or chrom == options.bucket_contigs
+            }
+        else:
+            array_data = {
+                chrom: chrom_values(input_files, chrom, size)
+                for (chrom, size) in chromsizes
+                if chrom in input_chroms or chrom == options.bucket_contigs
+            }
 
-        # Override the output file if it existts.
-        if op.exists(output_file):
-            os.remove(output_file)
-        
-        cmv.create_multivec_multires(
-            f_in,
+        # Read the finest zoom level that the zoom-level summaries of the
+        # input files can fill, the coarser ones are aggregated from it.
+        zoom_data = {}
+        if zoom_resolutions:
+            zoom_bws = open_bigwigs(stack, input_files)
+            names = options.aggregation
+            names = [names] if isinstance(names, str) else list(names)
+            zoom_data[zoom_resolutions[0]] = {
+                chrom: window_values(iter_zoom_windows(
+                    zoom_bws, chrom, size, zoom_resolutions[0],
+                    options.starting_resolution, names, options.window_size
+                )) for (chrom, size) in chromsizes
+            }
+        if options.preview:
+            array_data = {}
+
+        f_out = cmv.create_multivec_multires(
+            array_data,
             chromsizes=chromsizes,
-            agg=lambda x: np.nansum(x.T.reshape((x.shape[1], -1, 2)), axis=2).T, # Default aggregation lamda.
-            starting_resolution=starting_resolution,
-            tile_size=256,
-            output_file=output_file
+            agg=options.aggregation,
+            starting_resolution=options.starting_resolution,
+            tile_size=TILE_SIZE,
+            output_file=output_file,
+            row_infos=[in_file.encode() for in_file in input_names],
+            compression_threads=options.compression_threads,
+            dtype=options.dtype,
+            compression=options.compression,
+            compression_opts=options.compression_opts,
+            shuffle=options.shuffle,
+            chunk_rows=options.chunk_rows,
+            zoom_data=zoom_data,
+            progress=progress,
+            column_batches=column_batches,
+            chrom_workers=options.chrom_workers,
+            row_offsets=options.regions is not None,
+            update=options.update,
+            row_stats=options.row_stats,
+            backend=options.backend,
+            contigs=contigs
         )
-        print("Done Converting.", utils.get_time_duration())
+        f_out.close()
 
-def convert():
-    ## Test.
-    # Simplest version of conversion.
-    if False:
-        output_file = op.splitext(["sample_data/debug2.bw"][0])[0] + ".multires.mv5"
-        
-        f = h5py.File('/tmp/blah.h5', 'w')
-        f.create_dataset('chr1', (10000, 200), fillvalue=np.nan, compression='gzip')
-        f['chr1'][0 : 10000] = np.random.random_sample((10000, 200))
-        print("Cache file saved", f['chr1'][0 : 10000].shape)
-        cmv.create_multivec_multires(
-            f,
-            chromsizes=[('chr1', 10000)],
-            agg=lambda x: np.nansum(x.T.reshape((x.shape[1], -1, 2)), axis=2).T, # Default aggregation lamda.
-            starting_resolution=1,
-            tile_size=256,
-            output_file=output_file
+    if progress is not None:
+        progress.finish()
+
+    instrument.info(output_bytes=output_size(output_file))
+    print("Done Converting.", utils.get_time_duration())
+
+def open_bigwigs(stack, paths):
+    """
+    Open bigwig files that are closed when the contextlib.ExitStack closes.
+    """
+    bws = []
+    for path in paths:
+        bw = pyBigWig.open(path)
+        stack.callback(bw.close)
+        bws += [bw]
+    return bws
+
+def default_output_file(input_file, backend="hdf5"):
+    """
+    The output file of a conversion that isn't given one: the first input
+    file with the extension of the backend, or the name of the file of a
+    URL in the working directory.
+    """
+    if fetch.is_url(input_file):
+        input_file = op.basename(urllib.parse.urlsplit(input_file).path) or "output"
+    return op.splitext(input_file)[0] + (".multires.mvflat" if backend == "flat" else ".multires.mv5")
+
+def output_size(path):
+    """
+    The size of an output file, or of the files of a flat output directory.
+    """
+    if op.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return op.getsize(path)
+
+def get_zoom_summary_resolutions(input_files, resolutions, min_resolution=0, index=None):
+    """
+    The resolutions that can be read from the zoom-level summaries of all
+    of the input files: those of at least min_resolution for which every
+    file has a zoom level of at most half the resolution. The summaries
+    of a bin are only read from a zoom level that fits in it at least
+    twice, otherwise they are computed from the base data of the file,
+    which is slower than reading the base data once for a conversion.
+    """
+    index = index or HeaderIndex(None)
+
+    finest_zoom_level = 0
+    for in_file in input_files:
+        zoom_levels = index.get(in_file)["zoom_levels"]
+        if not zoom_levels:
+            return []
+        finest_zoom_level = max(finest_zoom_level, zoom_levels[0])
+
+    return [
+        resolution for resolution in resolutions
+        if resolution >= max(2 * finest_zoom_level, min_resolution)
+    ]
+
+def iter_zoom_windows(
+    bws,
+    chrom,
+    size,
+    resolution,
+    starting_resolution=1,
+    aggregations=("sum",),
+    window_size=DEFAULT_WINDOW_SIZE
+):
+    """
+    Read the zoom-level summaries of a chromosome from multiple bigwig
+    files one window at a time.
+
+    Parameters
+    ----------
+    bws: array of opened pyBigWig files
+    chrom, size: see iter_chrom_windows
+    resolution: int
+        The number of base pairs in each bin
+    starting_resolution: int (default 1)
+        The number of base pairs in each bin of the base resolution
+    aggregations: [str, ...]
+        The names of the aggregations, see read_zoom_window
+    window_size: int (default 1000000)
+        The maximum number of bins in each window
+
+    Yields
+    ------
+    (start_bin, window): the index of the first bin of the window and an
+        array of shape (number of bins, len(aggregations) * len(bws)) with
+        the columns of each aggregation side by side.
+    """
+    num_bins = math.ceil(size / resolution)
+
+    for start_bin in range(0, num_bins, window_size):
+        end_bin = min(start_bin + window_size, num_bins)
+        window = np.full(
+            (end_bin - start_bin, len(aggregations) * len(bws)), np.nan, dtype=np.float32
         )
-        f.close()
+
+        with instrument.stage("zoom-summaries/" + chrom) as counters:
+            for file_index, bw in enumerate(bws):
+                read_zoom_window(
+                    bw, chrom, start_bin, end_bin, resolution, starting_resolution, aggregations,
+                    window[:, file_index :: len(bws)]
+                )
+            counters["bins"] += window.size
+
+        yield (start_bin, window)
+
+def read_zoom_window(
+    bw, chrom, start_bin, end_bin, resolution, starting_resolution, aggregations, out
+):
+    """
+    Fill the columns of `out` with the zoom-level summaries of every
+    aggregation of the bins [start_bin, end_bin) of a chromosome in a
+    single bigwig file.
+
+    All of the aggregations are approximate: the records of a zoom level
+    don't line up with the bins, so a bin gets the summaries of the
+    records that overlap it, which can reach beyond it. 'sum' and 'count'
+    are estimated from the mean and the covered fraction of each bin, in
+    units of bins of the starting resolution. The summaries of every
+    type are read once for all of the aggregations.
+    """
+    chrom_size = bw.chroms(chrom)
+    if chrom_size is None:
         return
-    ######
-    
-    # Check arguments.
-    if len(sys.argv) <= 1:
-        print("The path of an input file is not suggested.")
+
+    start = start_bin * resolution
+    end = min(end_bin * resolution, chrom_size)
+    if start >= end:
+        return
+
+    # The whole bins, then the bin that is cut by the end of the chromosome.
+    num_whole_bins = (end - start) // resolution
+    ranges = []
+    if num_whole_bins > 0:
+        ranges += [(start, start + num_whole_bins * resolution, num_whole_bins)]
+    if start + num_whole_bins * resolution < end:
+        ranges += [(start + num_whole_bins * resolution, end, 1)]
+
+    position = 0
+    for (range_start, range_end, num_bins) in ranges:
+        summaries = {}
+
+        def stats(summary_type):
+            if summary_type not in summaries:
+                values = bw.stats(chrom, range_start, range_end, type=summary_type, nBins=num_bins)
+                summaries[summary_type] = np.array(
+                    [np.nan if v is None else v for v in values], dtype=np.float64
+                )
+            return summaries[summary_type]
+
+        for (index, aggregation) in enumerate(aggregations):
+            if aggregation in ("sum", "count"):
+                bases = (range_end - range_start) / num_bins
+                covered = np.nan_to_num(stats("coverage")) * bases
+                values = stats("mean") * covered if aggregation == "sum" else covered
+                values = values / starting_resolution
+            else:
+                values = stats(aggregation)
+            out[position : position + num_bins, index] = values
+
+        position += num_bins
+
+def read_chrom_values(
+    input_files,
+    chrom,
+    size,
+    starting_resolution=1,
+    window_size=DEFAULT_WINDOW_SIZE,
+    bins=None
+):
+    """
+    The values of a chromosome in all input files, one window at a time,
+    see iter_file_windows. This is the source of a chromosome that is
+    converted in another process. With bins, the windows of the bins are
+    returned with their start bins.
+    """
+    windows = iter_file_windows(input_files, chrom, size, starting_resolution, window_size, bins)
+    return windows if bins is not None else window_values(windows)
+
+def read_bucket_values(
+    input_files,
+    contigs,
+    starting_resolution=1,
+    window_size=DEFAULT_WINDOW_SIZE
+):
+    """
+    The values of the contigs of a bucket in all input files, one after
+    another (see chrom_sizes.filter_contigs), in windows of up to
+    window_size bins. The windows of the small contigs are joined, and
+    the files are opened once for all of them.
+    """
+    bws = [pyBigWig.open(in_file) for in_file in input_files]
+    try:
+        (windows, num_bins) = ([], 0)
+        for (contig, _, _, size) in contigs:
+            for window in window_values(
+                iter_chrom_windows(bws, contig, size, starting_resolution, window_size)
+            ):
+                if num_bins + len(window) > window_size and windows:
+                    yield np.concatenate(windows)
+                    (windows, num_bins) = ([], 0)
+                windows += [window]
+                num_bins += len(window)
+        if windows:
+            yield np.concatenate(windows)
+    finally:
+        for bw in bws:
+            bw.close()
+
+def window_values(windows):
+    """
+    Drop the start bins of the windows yielded by iter_chrom_windows.
+    """
+    for (start_bin, window) in windows:
+        yield window
+
+def append_tracks(
+    multires_file,
+    input_files,
+    window_size=DEFAULT_WINDOW_SIZE,
+    workers=1,
+    compression_threads=None,
+    header_index=DEFAULT_INDEX_PATH,
+    download_dir=fetch.DEFAULT_CACHE_DIR,
+    download_cache_size=fetch.DEFAULT_CACHE_BYTES,
+    download_threads=fetch.DEFAULT_THREADS
+):
+    """
+    Add bigwig files as new rows to an existing multires multivec file.
+
+    Only the new files are read and aggregated. Chromosomes are merged
+    with the ones of the file like the chromosomes of the input files.
+
+    Parameters
+    ----------
+    multires_file: the path of a file created by bigwigs_to_multivec
+    input_files: array of file paths or http(s) URLs
+    window_size, workers, compression_threads, header_index, download_dir,
+    download_cache_size, download_threads: see options.ConversionOptions
+    """
+    utils.set_time()
+
+    if len(input_files) == 0:
+        print("No input file suggested.")
+        return
+    print(len(input_files), "files prepared.")
+
+    instrument.info(input_files=input_files, multires_file=multires_file, workers=workers)
+
+    with instrument.stage("validate"):
+        index = HeaderIndex(header_index)
+        local_files = fetch_inputs(
+            input_files, index, download_dir, download_cache_size, download_threads
+        )
+        index.save()
+        if local_files is None:
+            return
+    (input_names, input_files) = (input_files, local_files)
+
+    with instrument.stage("chromsizes"):
+        chromsizes = merge_chromsizes(input_files, index)
+
+    with contextlib.ExitStack() as stack:
+        f_out = stack.enter_context(h5py.File(multires_file, "r+"))
+        starting_resolution = min(int(r) for r in f_out["resolutions"])
+
+        if workers > 1:
+            pool = stack.enter_context(ProcessPoolExecutor(workers))
+            windows = lambda chrom, size: iter_chrom_windows_parallel(
+                pool, input_files, chrom, size, starting_resolution, window_size
+            )
+        else:
+            bws = open_bigwigs(stack, input_files)
+            windows = lambda chrom, size: iter_chrom_windows(
+                bws, chrom, size, starting_resolution, window_size
+            )
+
+        cmv.append_multivec_columns(
+            f_out,
+            {chrom: window_values(windows(chrom, size)) for (chrom, size) in chromsizes},
+            chromsizes,
+            row_infos=[in_file.encode() for in_file in input_names],
+            compression_threads=compression_threads,
+            sort_key=utils.sort_by_chrom
+        )
+
+    print("Done Appending.", utils.get_time_duration())
+
+def parse_regions(text):
+    """
+    Parse regions given as comma-separated 'chrom:start-end' or 'chrom'
+    (the whole chromosome), or as the path of a BED file.
+
+    Returns
+    -------
+    [(chrom, start, end), ...] in base pairs, with None for the end of
+    a whole chromosome
+    """
+    if op.exists(text):
+        with open(text) as f:
+            lines = [
+                line.split()[:3] for line in f
+                if line.strip() and not line.startswith(("#", "track", "browser"))
+            ]
+        return [(parts[0], int(parts[1]), int(parts[2])) for parts in lines]
+
+    regions = []
+    for region in text.split(","):
+        region = region.strip()
+        if ":" not in region:
+            regions += [(region, 0, None)]
+            continue
+        (chrom, span) = region.rsplit(":", 1)
+        (start, end) = span.replace(",", "").split("-")
+        regions += [(chrom, int(start), int(end))]
+    return regions
+
+def select_chromsizes(chromsizes, chroms=None, regions=None, starting_resolution=1):
+    """
+    The chromosomes that are converted and the bins of their regions.
+
+    Parameters
+    ----------
+    chromsizes: [(chrom, size), ...]
+    chroms: [str, ...]
+    regions: [(chrom, start, end), ...], see parse_regions
+    starting_resolution: int
+
+    Returns
+    -------
+    ([(chrom, size), ...], {chrom: [(start_bin, end_bin), ...]})
+    The chromosomes keep their order. The bins of the regions of each
+    chromosome are sorted and overlapping ones are merged.
+
+    Raises
+    ------
+    ValueError if a chromosome is not in any input file or a region is empty
+    """
+    sizes = dict(chromsizes)
+    selected = set()
+    bins = {}
+
+    for chrom in chroms or []:
+        if chrom not in sizes:
+            raise ValueError("Chromosome {} is not in the input files".format(chrom))
+        selected.add(chrom)
+
+    for (chrom, start, end) in regions or []:
+        if chrom not in sizes:
+            raise ValueError("Chromosome {} is not in the input files".format(chrom))
+        end = sizes[chrom] if end is None else min(end, sizes[chrom])
+        if not 0 <= start < end:
+            raise ValueError("The region {}:{}-{} is empty".format(chrom, start, end))
+        bins.setdefault(chrom, []).append(
+            (start // starting_resolution, math.ceil(end / starting_resolution))
+        )
+    if chroms is not None and regions is not None:
+        bins = {chrom: ranges for (chrom, ranges) in bins.items() if chrom in selected}
+    selected = set(bins) if regions is not None else selected
+
+    for (chrom, ranges) in bins.items():
+        merged = []
+        for (start_bin, end_bin) in sorted(ranges):
+            if merged and start_bin <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end_bin))
+            else:
+                merged += [(start_bin, end_bin)]
+        bins[chrom] = merged
+
+    chromsizes = [(chrom, size) for (chrom, size) in chromsizes if chrom in selected]
+    if len(chromsizes) == 0:
+        raise ValueError("No chromosomes were selected")
+    return (chromsizes, bins)
+
+def check_update(output_file, input_names, aggregations):
+    """
+    Check that the chromosomes of an existing output file can be rewritten
+    from the input files.
+
+    Returns
+    -------
+    The resolutions of the file
+
+    Raises
+    ------
+    ValueError if the file has other aggregations or another number of rows
+    """
+    with h5py.File(output_file, "r") as f:
+        resolutions = sorted(int(r) for r in f["resolutions"])
+        stored = [
+            name.decode() if isinstance(name, bytes) else str(name)
+            for name in f["info"].attrs.get("aggregations", ["sum"])
+        ]
+        if stored != aggregations:
+            raise ValueError("it stores the aggregations {}".format(", ".join(stored)))
+
+        row_infos = f["resolutions"][str(resolutions[0])].attrs.get("row_infos")
+        if row_infos is not None:
+            names = [name.decode() if isinstance(name, bytes) else str(name) for name in row_infos]
+            names = names[: len(names) // len(stored)]
+            if len(names) != len(input_names):
+                raise ValueError("it has {} rows, not {}".format(len(names), len(input_names)))
+            if names != list(input_names):
+                print("Warning: the input files are not the ones the file was converted from")
+    return resolutions
+
+def fetch_inputs(
+    input_files,
+    index,
+    download_dir=fetch.DEFAULT_CACHE_DIR,
+    download_cache_size=fetch.DEFAULT_CACHE_BYTES,
+    download_threads=fetch.DEFAULT_THREADS
+):
+    """
+    Download the input files that are URLs and check that all input files
+    are bigwig files. Every file is checked as soon as it is available,
+    while the next ones are downloading.
+
+    Parameters
+    ----------
+    input_files: array of file paths or http(s) URLs
+    index: header_index.HeaderIndex
+    download_dir, download_cache_size, download_threads: see options.ConversionOptions
+
+    Returns
+    -------
+    The local path of every input file, or None if a file could not be
+    downloaded or is not a bigwig file
+    """
+    fetcher = fetch.Fetcher(download_dir, download_cache_size, download_threads)
+    local_files = []
+    try:
+        for (in_file, local_file) in zip(input_files, fetcher.paths(input_files)):
+            if not index.get(local_file)["is_bigwig"]:
+                print("Input files are not in a BigWig format:", in_file)
+                return None
+            local_files += [local_file]
+    except IOError as ex:
+        print("Can not download an input file:", ex)
+        return None
+    finally:
+        fetcher.close()
+
+    num_urls = sum(fetch.is_url(in_file) for in_file in input_files)
+    if num_urls > 0:
+        print("Downloaded", num_urls, "input files.", utils.get_time_duration())
+        # every input file is read until the end of the conversion
+        pinned_bytes = fetcher.cache.pinned_bytes()
+        if pinned_bytes > download_cache_size:
+            print("Warning: the downloaded input files take {}, more than the download cache "
+                  "size of {}. They are removed by later conversions.".format(
+                      planner.format_size(pinned_bytes), planner.format_size(download_cache_size)
+                  ))
+    return local_files
+
+def merge_chromsizes(input_files, index=None):
+    """
+    The largest size of each chromosome across bigwig files.
+
+    Parameters
+    ----------
+    input_files: array of file paths
+    index: header_index.HeaderIndex
+        The headers of the input files (default: read them from the files)
+
+    Returns
+    -------
+    [('chrom_key', size),...] sorted by the chromosome order
+    """
+    # Store largest sizes of individual chromosomes.
+    # Expect to be identical, but make sure.
+    index = index or HeaderIndex(None)
+
+    chromsizes = {}
+    for in_file in input_files:
+        _chromsizes = index.get(in_file)["chroms"] # [[chrom, size], ...]
+        for (k, v) in _chromsizes:
+            if k not in chromsizes:
+                chromsizes[k] = v
+            elif k in chromsizes and chromsizes[k] < v:
+                chromsizes[k] = v
+
+    # Convert dict to a list of tuples to input to multivec function.
+    return sorted([(k, v) for k, v in chromsizes.items()], key=utils.sort_by_chrom)
+
+def window_ranges(num_bins, window_size, bins=None):
+    """
+    The (start_bin, end_bin) of every window of a chromosome, or of its
+    ranges of bins [(start_bin, end_bin), ...] if they are given.
+    """
+    windows = []
+    for (range_start, range_end) in bins if bins is not None else [(0, num_bins)]:
+        range_end = min(range_end, num_bins)
+        for start_bin in range(range_start, range_end, window_size):
+            windows += [(start_bin, min(start_bin + window_size, range_end))]
+    return windows
+
+def iter_chrom_windows(
+    bws,
+    chrom,
+    size,
+    starting_resolution=1,
+    window_size=DEFAULT_WINDOW_SIZE,
+    bins=None
+):
+    """
+    Read a chromosome from multiple bigwig files one window at a time.
+
+    Parameters
+    ----------
+    bws: array of opened pyBigWig files
+    chrom: chromosome name
+    size: int
+        The size of the chromosome in base pairs
+    starting_resolution: int (default 1)
+        The number of base pairs in each bin
+    window_size: int (default 1000000)
+        The maximum number of bins in each window
+    bins: [(start_bin, end_bin), ...] (default None)
+        Only read these ranges of bins, in this order
+
+    Yields
+    ------
+    (start_bin, window): the index of the first bin of the window and
+        an array of shape (number of bins, len(bws)). Bins that are not
+        covered in a file are NaN.
+    """
+    num_bins = math.ceil(size / starting_resolution)
+
+    for (start_bin, end_bin) in window_ranges(num_bins, window_size, bins):
+        window = np.full((end_bin - start_bin, len(bws)), np.nan, dtype=np.float32)
+
+        for file_index, bw in enumerate(bws):
+            with instrument.stage("decode/chrom/" + chrom) as counters, \
+                    instrument.stage("decode/file/{}".format(file_index)) as file_counters:
+                bases = read_window(
+                    bw, chrom, start_bin, end_bin, starting_resolution, window[:, file_index]
+                )
+                counters["bases"] += bases
+                file_counters["bases"] += bases
+
+        yield (start_bin, window)
+
+def iter_file_windows(
+    input_files,
+    chrom,
+    size,
+    starting_resolution=1,
+    window_size=DEFAULT_WINDOW_SIZE,
+    bins=None
+):
+    """
+    Like iter_chrom_windows, but the files are only open
+    while the chromosome is being read.
+    """
+    bws = [pyBigWig.open(in_file) for in_file in input_files]
+    try:
+        for window in iter_chrom_windows(
+            bws, chrom, size, starting_resolution, window_size, bins
+        ):
+            yield window
+    finally:
+        for bw in bws:
+            bw.close()
+
+def iter_chrom_windows_parallel(
+    pool,
+    input_files,
+    chrom,
+    size,
+    starting_resolution=1,
+    window_size=DEFAULT_WINDOW_SIZE,
+    buffer_dir=None,
+    bins=None
+):
+    """
+    Read a chromosome from multiple bigwig files one window at a time,
+    decoding each (file, window) pair in a process pool.
+
+    The workers write their bins straight into one of two memory-mapped
+    buffers in `buffer_dir`, so that the next window is decoded while the
+    current one is being consumed. A yielded window is only valid until
+    the next one is requested.
+
+    Parameters
+    ----------
+    pool: concurrent.futures.ProcessPoolExecutor
+    input_files: array of file paths
+    chrom, size, starting_resolution, window_size, bins: see iter_chrom_windows
+    buffer_dir: the directory of the memory-mapped buffers
+        (default: the system temporary directory)
+
+    Yields
+    ------
+    (start_bin, window): see iter_chrom_windows
+    """
+    num_bins = math.ceil(size / starting_resolution)
+    shape = (min(window_size, num_bins), len(input_files))
+
+    buffers = []
+    for buffer_index in range(2):
+        (fd, path) = tempfile.mkstemp(suffix=".buffer", dir=buffer_dir)
+        os.close(fd)
+        buffers += [(path, np.memmap(path, dtype=np.float32, mode="w+", shape=shape))]
+
+    def submit(start_bin, end_bin, buffer_index):
+        (path, window) = buffers[buffer_index]
+        window[: end_bin - start_bin] = np.nan
+        jobs = [
+            pool.submit(
+                _read_window_job,
+                path, shape, file_index, in_file, chrom, start_bin, end_bin, starting_resolution
+            ) for file_index, in_file in enumerate(input_files)
+        ]
+        return (start_bin, end_bin, buffer_index, jobs)
+
+    try:
+        ranges = window_ranges(num_bins, window_size, bins)
+        pending = submit(*ranges[0], 0) if ranges else None
+        for window_index in range(len(ranges)):
+            (start_bin, end_bin, buffer_index, jobs) = pending
+            with instrument.stage("decode/wait"):
+                for file_index, job in enumerate(jobs):
+                    (wall, cpu, bases) = job.result()
+                    for name in ("decode/chrom/" + chrom, "decode/file/{}".format(file_index)):
+                        instrument.add(name, calls=1, wall=wall, cpu=cpu, bases=bases)
+
+            # Decode the next window while this one is consumed.
+            if window_index + 1 < len(ranges):
+                pending = submit(*ranges[window_index + 1], 1 - buffer_index)
+
+            yield (start_bin, buffers[buffer_index][1][: end_bin - start_bin])
+    finally:
+        for (path, window) in buffers:
+            del window
+            os.remove(path)
+
+# Opened input files of a worker process, by path.
+_worker_bigwigs = {}
+
+def _read_window_job(
+    buffer_path, shape, file_index, in_file, chrom, start_bin, end_bin, starting_resolution
+):
+    """
+    Decode one window of one input file into a column of a memory-mapped buffer.
+
+    Returns
+    -------
+    (wall time, CPU time, number of bases decoded)
+    """
+    start_wall = time.perf_counter()
+    start_cpu = time.process_time()
+
+    if in_file not in _worker_bigwigs:
+        _worker_bigwigs[in_file] = pyBigWig.open(in_file)
+
+    window = np.memmap(buffer_path, dtype=np.float32, mode="r+", shape=shape)
+    bases = read_window(
+        _worker_bigwigs[in_file],
+        chrom,
+        start_bin,
+        end_bin,
+        starting_resolution,
+        window[: end_bin - start_bin, file_index]
+    )
+    window.flush()
+    del window
+
+    return (time.perf_counter() - start_wall, time.process_time() - start_cpu, bases)
+
+# The maximum number of bases decoded from a bigwig file at once.
+VALUES_BLOCK_SIZE = 4194304
+
+def read_window(bw, chrom, start_bin, end_bin, starting_resolution, out):
+    """
+    Fill `out` with the values of the bins [start_bin, end_bin) of a chromosome
+    in a single bigwig file. Bins that are not covered by any interval are
+    left untouched.
+
+    With a starting resolution larger than one, the value of a bin is the mean
+    of the intervals overlapping it, weighted by the number of covered bases.
+
+    Returns the number of bases that were decoded.
+    """
+    chrom_size = bw.chroms(chrom)
+    if chrom_size is None:
+        return 0
+
+    # Decode whole bins only, in blocks of at most VALUES_BLOCK_SIZE bases.
+    decoded = 0
+    block_bins = max(1, VALUES_BLOCK_SIZE // starting_resolution)
+    for block_start in range(start_bin, end_bin, block_bins):
+        block_end = min(block_start + block_bins, end_bin)
+
+        start = block_start * starting_resolution
+        end = min(block_end * starting_resolution, chrom_size)
+        if start >= end:
+            break
+
+        values = bw.values(chrom, start, end, numpy=True)
+        decoded += end - start
+        block_out = out[block_start - start_bin : block_end - start_bin]
+
+        if starting_resolution == 1:
+            # One bin per base, so the values can be copied as they are.
+            covered = ~np.isnan(values)
+            block_out[: end - start][covered] = values[covered]
+            continue
+
+        values = bin_values(values, starting_resolution)
+        covered = ~np.isnan(values)
+        block_out[: len(values)][covered] = values[covered]
+
+    return decoded
+
+def bin_values(values, resolution):
+    """
+    Aggregate per-base values into bins of `resolution` bases.
+
+    Parameters
+    ----------
+    values: array of per-base values, NaN where a base is not covered
+    resolution: int
+        The number of bases in each bin
+
+    Returns
+    -------
+    An array with the mean of the covered bases in each bin, or NaN if a
+    bin is not covered at all. A trailing partial bin is aggregated over
+    the bases it has.
+    """
+    num_bins = math.ceil(len(values) / resolution)
+    padded = np.full(num_bins * resolution, np.nan, dtype=values.dtype)
+    padded[: len(values)] = values
+    padded = padded.reshape((num_bins, resolution))
+
+    covered = ~np.isnan(padded)
+    coverage = covered.sum(axis=1)
+    sums = np.where(covered, padded, 0).sum(axis=1, dtype=np.float64)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(coverage > 0, sums / coverage, np.nan)
+
+def convert():
+    if len(sys.argv) > 1 and sys.argv[1] == "append":
+        append()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        index_headers()
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "flat":
+        flat()
         return
 
+    parser = argparse.ArgumentParser(
+        description="Convert multiple BigWig files to a single multivec file.",
+        epilog="Use 'convert.py append' to add BigWig files to an existing multivec file "
+        "and 'convert.py index' to index the headers of BigWig files ahead of a conversion. "
+        "'convert.py flat' converts a multivec file to a flat output."
+    )
+    parser.add_argument(
+        "input_list",
+        help="a file with the path or URL of one BigWig file per line"
+    )
+    parser.add_argument(
+        "starting_resolution", nargs="?", type=int, default=1,
+        help="the starting resolution of the input data (default: 1)"
+    )
+    parser.add_argument(
+        "output_file", nargs="?", default=None,
+        help="the path of the output multivec file"
+    )
+    parser.add_argument(
+        "--window-size", type=int, default=DEFAULT_WINDOW_SIZE,
+        help="the number of bins read from all input files at once"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="the number of processes that decode the input files"
+    )
+    parser.add_argument(
+        "--chrom-workers", type=int, default=1,
+        help="the number of chromosomes converted at once in their own processes"
+    )
+    parser.add_argument(
+        "--compression-threads", type=int, default=None,
+        help="the number of threads that compress the output (default: the number of CPUs)"
+    )
+    parser.add_argument(
+        "--dtype", choices=["f2", "f4", "f8"], default="f4",
+        help="the type of the stored values (default: f4)"
+    )
+    parser.add_argument(
+        "--compression", choices=["gzip", "lzf", "none"], default="gzip",
+        help="the codec of the stored values (default: gzip)"
+    )
+    parser.add_argument(
+        "--compression-level", type=int, default=None,
+        help="the gzip compression level (default: 4)"
+    )
+    parser.add_argument(
+        "--shuffle", action="store_true",
+        help="apply the byte shuffle filter before compression"
+    )
+    parser.add_argument(
+        "--chunk-rows", type=int, default=None,
+        help="the number of rows in a chunk of the output (default: a multiple of the tile size)"
+    )
+    parser.add_argument(
+        "--aggregation", default="sum",
+        help="the aggregation of adjacent bins (sum, mean, max, min or count), "
+        "or a comma-separated list of them to store side by side (default: sum)"
+    )
+    parser.add_argument(
+        "--zoom-summaries", type=int, nargs="?", const=0, default=None,
+        metavar="MIN_RESOLUTION",
+        help="fill the zoom levels of at least MIN_RESOLUTION bp (default: all possible) "
+        "from the zoom-level summaries of the input files"
+    )
+    parser.add_argument(
+        "--preview", action="store_true",
+        help="only fill the zoom levels that can be read from the zoom-level summaries"
+    )
+    parser.add_argument(
+        "--resume", action="store_true",
+        help="record the progress next to the output file and continue an interrupted conversion"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=None,
+        help="convert the input files in batches of this many files to bound the memory usage"
+    )
+    parser.add_argument(
+        "--chroms", default=None,
+        help="only convert these chromosomes, separated by commas"
+    )
+    parser.add_argument(
+        "--regions", default=None,
+        help="only convert these regions: comma-separated chrom:start-end, or a BED file"
+    )
+    parser.add_argument(
+        "--update", action="store_true",
+        help="rewrite the chromosomes in the existing output file instead of creating a new one"
+    )
+    parser.add_argument(
+        "--row-stats", action="store_true",
+        help="store the value ranges and quantiles of the rows at every resolution"
+    )
+    parser.add_argument(
+        "--backend", choices=["hdf5", "flat"], default="hdf5",
+        help="the output format: a multires HDF5 file, or a directory of flat binary files "
+        "that tiles are memory-mapped from (default: hdf5)"
+    )
+    parser.add_argument(
+        "--assembly", default=None, metavar="CHROMSIZES",
+        help="the chromosomes of the output: a chromosome sizes file or its URL, in its order, "
+        "or the name of a UCSC assembly (e.g. hg38), in natural order "
+        "(default: the chromosomes of the input files)"
+    )
+    parser.add_argument(
+        "--min-contig-size", type=int, default=None, metavar="N",
+        help="drop the chromosomes smaller than N bp, or bucket them with --bucket-contigs"
+    )
+    parser.add_argument(
+        "--bucket-contigs", nargs="?", const=chrom_sizes.DEFAULT_BUCKET_NAME, default=None,
+        metavar="NAME",
+        help="lay out the chromosomes smaller than --min-contig-size one after another "
+        "in a single chromosome (default name: %(const)s)"
+    )
+    parser.add_argument(
+        "--max-memory", type=planner.parse_size, default=None, metavar="SIZE",
+        help="the memory budget (e.g. 8G) that the window size, batch size and chunk rows are fitted to"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true",
+        help="only print the estimated memory, temporary disk space, output size and resolution levels"
+    )
+    add_header_index_arguments(parser)
+    add_download_arguments(parser)
+    add_report_arguments(parser)
+    args = parser.parse_args()
+
     # Get input files.
+    input_files = read_input_list(args.input_list)
+    if input_files is None:
+        return
+
     try:
-        input_path = open(sys.argv[1], "r")
-    except IOError:
-        print("There is no such file:", sys.argv[1])
+        options = ConversionOptions(
+            starting_resolution=args.starting_resolution,
+            window_size=args.window_size,
+            workers=args.workers,
+            compression_threads=args.compression_threads,
+            dtype=args.dtype,
+            compression=None if args.compression == "none" else args.compression,
+            compression_opts=args.compression_level,
+            shuffle=args.shuffle,
+            chunk_rows=args.chunk_rows,
+            aggregation=args.aggregation.split(","),
+            zoom_summaries=args.zoom_summaries,
+            preview=args.preview,
+            resume=args.resume,
+            batch_size=args.batch_size,
+            header_index=None if args.no_header_index else args.header_index,
+            max_memory=args.max_memory,
+            dry_run=args.dry_run,
+            chrom_workers=args.chrom_workers,
+            download_dir=args.download_dir,
+            download_cache_size=args.download_cache_size,
+            download_threads=args.download_threads,
+            chroms=args.chroms.split(",") if args.chroms else None,
+            regions=parse_regions(args.regions) if args.regions else None,
+            update=args.update,
+            row_stats=args.row_stats,
+            backend=args.backend,
+            assembly=args.assembly,
+            min_contig_size=args.min_contig_size,
+            bucket_contigs=args.bucket_contigs
+        )
+    except ValueError as ex:
+        parser.error(ex)
+
+    start_report(args)
+    bigwigs_to_multivec(input_files, args.output_file, options)
+    instrument.finish(args.report)
+
+def append():
+    parser = argparse.ArgumentParser(
+        prog="convert.py append",
+        description="Add BigWig files as new rows to an existing multires multivec file."
+    )
+    parser.add_argument(
+        "multires_file",
+        help="a multivec file created by convert.py"
+    )
+    parser.add_argument(
+        "input_list",
+        help="a file with the path or URL of one BigWig file per line"
+    )
+    parser.add_argument(
+        "--window-size", type=int, default=DEFAULT_WINDOW_SIZE,
+        help="the number of bins read from all input files at once"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="the number of processes that decode the input files"
+    )
+    parser.add_argument(
+        "--compression-threads", type=int, default=None,
+        help="the number of threads that compress the output (default: the number of CPUs)"
+    )
+    add_header_index_arguments(parser)
+    add_download_arguments(parser)
+    add_report_arguments(parser)
+    args = parser.parse_args(sys.argv[2:])
+
+    input_files = read_input_list(args.input_list)
+    if input_files is None:
         return
 
-    input_files = []
-    with input_path:
-        for line in input_path.readlines():
-            input_files += [line[:-1]]  # Remove newlines.
-    
-    # Get starting resolution.
-    resolution = int(sys.argv[2]) if len(sys.argv) >= 3 else None
+    start_report(args)
+    append_tracks(
+        args.multires_file,
+        input_files,
+        window_size=args.window_size,
+        workers=args.workers,
+        compression_threads=args.compression_threads,
+        header_index=None if args.no_header_index else args.header_index,
+        download_dir=args.download_dir,
+        download_cache_size=args.download_cache_size,
+        download_threads=args.download_threads
+    )
+    instrument.finish(args.report)
+
+def index_headers():
+    parser = argparse.ArgumentParser(
+        prog="convert.py index",
+        description="Add the headers of BigWig files to the header index ahead of a conversion."
+    )
+    parser.add_argument(
+        "input_list",
+        help="a file with the path or URL of one BigWig file per line"
+    )
+    add_header_index_arguments(parser)
+    add_download_arguments(parser)
+    args = parser.parse_args(sys.argv[2:])
+
+    input_files = read_input_list(args.input_list)
+    if input_files is None:
+        return
+
+    header_index = HeaderIndex(None if args.no_header_index else args.header_index)
+    fetcher = fetch.Fetcher(args.download_dir, args.download_cache_size, args.download_threads)
+    try:
+        for (in_file, local_file) in zip(input_files, fetcher.paths(input_files)):
+            entry = header_index.get(local_file)
+            if not entry["is_bigwig"]:
+                print("Not in a BigWig format:", in_file)
+                continue
+            print(in_file, len(entry["chroms"]), "chromosomes")
+    except IOError as ex:
+        print("Can not download an input file:", ex)
+    finally:
+        fetcher.close()
+    header_index.save()
+
+def flat():
+    parser = argparse.ArgumentParser(
+        prog="convert.py flat",
+        description="Convert a multires multivec file to a directory of flat binary files "
+        "that tiles can be memory-mapped from."
+    )
+    parser.add_argument(
+        "multires_file",
+        help="a multivec file created by convert.py"
+    )
+    parser.add_argument(
+        "output_dir", nargs="?", default=None,
+        help="the flat output (default: the multivec file with the extension .mvflat)"
+    )
+    parser.add_argument(
+        "--compression", choices=["zlib", "none"], default="none",
+        help="the compression of the blocks of tile size rows (default: none)"
+    )
+    parser.add_argument(
+        "--compression-level", type=int, default=None,
+        help="the zlib compression level (default: 4)"
+    )
+    parser.add_argument(
+        "--compression-threads", type=int, default=None,
+        help="the number of threads that compress the output (default: the number of CPUs)"
+    )
+    add_report_arguments(parser)
+    args = parser.parse_args(sys.argv[2:])
+
+    output_dir = args.output_dir or op.splitext(args.multires_file)[0] + ".mvflat"
+    utils.set_time()
+    start_report(args)
+    try:
+        flatfile.convert_multires(
+            args.multires_file,
+            output_dir,
+            compression=None if args.compression == "none" else args.compression,
+            compression_opts=args.compression_level,
+            compression_threads=args.compression_threads,
+        )
+    except ValueError as ex:
+        print("Can not convert {}: {}".format(args.multires_file, ex))
+        return
+    print("Flat output:", output_dir, utils.get_time_duration())
+    instrument.finish(args.report)
 
-    # Get output file path.
-    output_file = sys.argv[3] if len(sys.argv) >= 4 else None
+def add_header_index_arguments(parser):
+    parser.add_argument(
+        "--header-index", default=DEFAULT_INDEX_PATH,
+        help="the index of the headers of the input files (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--no-header-index", action="store_true",
+        help="read the headers of the input files without storing them"
+    )
 
-    bigwigs_to_multivec(
-        input_files=input_files, 
-        output_file=output_file,
-        starting_resolution=resolution
+def add_download_arguments(parser):
+    parser.add_argument(
+        "--download-dir", default=fetch.DEFAULT_CACHE_DIR,
+        help="the cache of the input files given as URLs (default: %(default)s)"
     )
+    parser.add_argument(
+        "--download-cache-size", type=planner.parse_size, default=fetch.DEFAULT_CACHE_BYTES,
+        metavar="SIZE",
+        help="the size of the download cache, e.g. 20G (default: 50G)"
+    )
+    parser.add_argument(
+        "--download-threads", type=int, default=fetch.DEFAULT_THREADS,
+        help="the number of input files downloaded at once (default: %(default)s)"
+    )
+
+def add_report_arguments(parser):
+    parser.add_argument(
+        "--report", default=None, metavar="PATH",
+        help="write the wall time, CPU time, bytes and peak memory of each stage to a JSON file"
+    )
+    parser.add_argument(
+        "--profile", default=None, metavar="PATH",
+        help="profile the conversion with cProfile and write the statistics to a file"
+    )
+    parser.add_argument(
+        "--trace-memory", action="store_true",
+        help="add the peak memory and largest allocations traced by tracemalloc to the report"
+    )
+
+def start_report(args):
+    """
+    Start recording the performance report requested on the command line.
+    """
+    if args.report is not None or args.profile is not None or args.trace_memory:
+        instrument.start(profile=args.profile, trace_memory=args.trace_memory)
+
+def read_input_list(input_list):
+    """
+    Read the paths of the input files, one per line. Empty lines and
+    lines that start with '#' are skipped.
+    """
+    try:
+        input_path = open(input_list, "r")
+    except IOError:
+        print("There is no such file:", input_list)
+        return None
+
+    input_files = []
+    with input_path:
+        for line in input_path.readlines():
+            if line.strip() and not line.startswith("#"):
+                input_files += [line.strip()]  # Remove newlines.
+    return input_files
 
 if __name__ == "__main__":
 	convert()
\ No newline at end of file
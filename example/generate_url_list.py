@@ -1,41 +1,58 @@
-import urllib.request, json
+import argparse
+import os.path as op
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
-# Download:
-# wget -i input_urls.txt
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+import fetch  # noqa: E402
+
+# The URLs can be passed to convert.py as they are, it downloads them.
+
+DEFAULT_API = "http://dc2.cistrome.org/api/main_filter_ng"
+BIGWIG_URL = "http://dbtoolkit.cistrome.org/api_bigwig?sid={}"
+
+def request(api=DEFAULT_API, threads=fetch.DEFAULT_THREADS, output_dir="./sample_input"):
 
-def request():
-    
     """
     Get the list of BigWig file urls by looking into all Cistrome DB Browser pages.
+
+    The pages after the first one are requested concurrently in a pool
+    of threads that keep their connections open.
     """
 
     allqc = True
     factors = "H3K27ac" # or "all"
     keyword = "h3k27ac" # or ""
-    default_url = "http://dc2.cistrome.org/api/main_filter_ng?allqc={}&cellinfos=all&completed=false&curated=false&factors={}&keyword={}&page={}&peakqc=false&run=false&species=Homo+sapiens"
+    default_url = api + "?allqc={}&cellinfos=all&completed=false&curated=false&factors={}&keyword={}&page={}&peakqc=false&run=false&species=Homo+sapiens"
     limit_num = 99999
-    
-    num_pages = -1
+
     url_list = []
     id_list = []
+    session = fetch.Session()
 
     # Get metadata (e.g., number of pages)
-    with urllib.request.urlopen(default_url.format(allqc, factors, keyword, 1)) as url:
-        json_result = json.loads(url.read().decode())
-        num_pages = json_result["num_pages"]
+    json_result = session.get_json(default_url.format(allqc, factors, keyword, 1))
+    num_pages = json_result["num_pages"]
     print("Total num of pages:", num_pages)
-    
-    # Get lists
-    done_processing = False
-    for p in range(num_pages):
+
+    def get_page(p):
+        if p == 0:
+            return json_result
         try:
-            with urllib.request.urlopen(default_url.format(allqc, factors, keyword, p + 1)) as url:
-                json_result = json.loads(url.read().decode())
-                datasets = json_result["datasets"]
+            return session.get_json(default_url.format(allqc, factors, keyword, p + 1))
+        except (IOError, ValueError):
+            print("Error requesting", default_url.format(allqc, factors, keyword, p + 1))
+            return None
 
-                for d in datasets:
+    # Get lists, in the order of the pages
+    done_processing = False
+    with ThreadPoolExecutor(threads) as pool:
+        for (p, page) in enumerate(pool.map(get_page, range(num_pages))):
+            if page is not None:
+                for d in page["datasets"]:
                     cid = d["id"]
-                    new_url = "http://dbtoolkit.cistrome.org/api_bigwig?sid={}".format(cid)
+                    new_url = BIGWIG_URL.format(cid)
                     if new_url not in url_list:
                         url_list += [new_url]
                         id_list += [cid]
@@ -43,28 +60,41 @@ def request():
                             done_processing = True
                     if done_processing:
                         break
-        except:
-            print("Error requesting", default_url.format(allqc, factors, keyword, p + 1))
-        
-        if(p % 100 is 1):
-            print("Done processing page", p)
-
-        if done_processing:
-            print("Done processing.")
-            break
-    
+
+            if p % 100 == 1:
+                print("Done processing page", p)
+
+            if done_processing:
+                print("Done processing.")
+                pool.shutdown(cancel_futures=True)
+                break
+
     # Write input urls.
-    with open('./sample_input/input_urls.txt', 'w') as f_out:
-        # Write parameters.
-        f_out.writelines("allqc={}\tfactors={}\tkeyword={}\tlimit_num={}\n".format(allqc, factors, keyword, limit_num))
+    with open(op.join(output_dir, 'input_urls.txt'), 'w') as f_out:
+        # Write parameters, as a comment that convert.py skips.
+        f_out.writelines("# allqc={}\tfactors={}\tkeyword={}\tlimit_num={}\n".format(allqc, factors, keyword, limit_num))
 
         for u in url_list:
             f_out.writelines(u + "\n")
-    
+
     # Write input urls.
-    with open('./sample_input/input_list.txt', 'w') as f_out:
+    with open(op.join(output_dir, 'input_list.txt'), 'w') as f_out:
         for cid in id_list:
             f_out.writelines("api_bigwig?sid={}\n".format(cid))
 
 if __name__ == "__main__":
-	request()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="List the BigWig files of the Cistrome DB.")
+    parser.add_argument(
+        "--api", default=DEFAULT_API,
+        help="the URL of the filter API (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--threads", type=int, default=fetch.DEFAULT_THREADS,
+        help="the number of pages requested at once (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--output-dir", default="./sample_input",
+        help="the directory of input_urls.txt and input_list.txt (default: %(default)s)"
+    )
+    args = parser.parse_args()
+    request(args.api, args.threads, args.output_dir)
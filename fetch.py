@@ -0,0 +1,289 @@
+"""
+Download remote input files (e.g. the bigwig URLs of the Cistrome DB
+API) into a bounded on-disk cache, so that a conversion can take a list
+of URLs instead of local paths.
+
+The downloads run in a thread pool in the order of the input files, so
+that the next files are fetched while the ones before them are being
+read. Every thread keeps one connection per host open between requests.
+
+A conversion reads all of its input files until it ends, so they are all
+kept: the size of the cache only bounds the files that are kept between
+conversions, not the input files of a single one.
+"""
+
+import hashlib
+import http.client
+import json
+import os
+import os.path as op
+import shutil
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import instrument
+
+# The default location of the downloaded files, shared by all conversions.
+DEFAULT_CACHE_DIR = op.join(
+    os.environ.get("XDG_CACHE_HOME", op.join(op.expanduser("~"), ".cache")),
+    "bigwigs-to-multivec",
+    "downloads",
+)
+
+# The default size of the cache. Files of older conversions are removed
+# once it is exceeded.
+DEFAULT_CACHE_BYTES = 50 * 2 ** 30
+
+# The default number of files that are downloaded at once.
+DEFAULT_THREADS = 8
+
+# The number of redirects that are followed for a URL.
+MAX_REDIRECTS = 5
+
+# The number of times a request is sent again after a connection error.
+RETRIES = 3
+
+# The number of bytes that are read from a response at once.
+READ_SIZE = 1 << 20
+
+
+def is_url(path):
+    """
+    Whether an input file is a URL that has to be downloaded.
+    """
+    return urllib.parse.urlsplit(path).scheme in ("http", "https")
+
+
+class Session:
+    """
+    Send GET requests over connections that are kept open, one for every
+    host and thread.
+
+    Parameters
+    ----------
+    timeout: float (default 60)
+        The timeout of the connections in seconds
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self, scheme, netloc, new=False):
+        connections = self.local.__dict__.setdefault("connections", {})
+        key = (scheme, netloc)
+        if new and key in connections:
+            connections.pop(key).close()
+        if key not in connections:
+            if scheme == "https":
+                connections[key] = http.client.HTTPSConnection(netloc, timeout=self.timeout)
+            else:
+                connections[key] = http.client.HTTPConnection(netloc, timeout=self.timeout)
+        return connections[key]
+
+    def open(self, url):
+        """
+        Request a URL, following redirects. The response has to be read
+        to the end before the next request of the thread.
+
+        Raises
+        ------
+        IOError if the request fails or the status is not 200
+        """
+        for _ in range(MAX_REDIRECTS + 1):
+            parts = urllib.parse.urlsplit(url)
+            path = parts.path or "/"
+            if parts.query:
+                path += "?" + parts.query
+
+            for attempt in range(RETRIES + 1):
+                # a connection that was kept open may have been closed by the server
+                connection = self.connection(parts.scheme, parts.netloc, new=attempt > 0)
+                try:
+                    connection.request("GET", path)
+                    response = connection.getresponse()
+                    break
+                except (http.client.HTTPException, OSError) as ex:
+                    connection.close()
+                    if attempt == RETRIES:
+                        raise IOError("{}: {}".format(url, ex))
+
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urllib.parse.urljoin(url, response.getheader("Location"))
+                continue
+            if response.status != 200:
+                response.read()
+                raise IOError("{}: HTTP {} {}".format(url, response.status, response.reason))
+            return response
+
+        raise IOError("{}: too many redirects".format(url))
+
+    def get(self, url):
+        """
+        The body of a URL.
+        """
+        return self.open(url).read()
+
+    def get_json(self, url):
+        """
+        The body of a URL, parsed as JSON.
+        """
+        return json.loads(self.get(url).decode())
+
+    def download(self, url, path):
+        """
+        Write the body of a URL to a file and return its size.
+        """
+        response = self.open(url)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(response, f, READ_SIZE)
+            return f.tell()
+
+
+class DownloadCache:
+    """
+    Downloaded files in a directory, named after their URL and limited by
+    their total size. The least recently used files are removed once the
+    cache is larger than max_bytes, except for the pinned files, e.g. the
+    input files of the running conversion, which can take more than
+    max_bytes on their own.
+
+    Parameters
+    ----------
+    directory: str (default DEFAULT_CACHE_DIR)
+    max_bytes: int (default DEFAULT_CACHE_BYTES)
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.pinned = set()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, url):
+        """
+        The path of the cached file of a URL.
+        """
+        name = hashlib.sha1(url.encode()).hexdigest()
+        extension = op.splitext(urllib.parse.urlsplit(url).path)[1]
+        return op.join(self.directory, name + (extension if len(extension) <= 8 else ""))
+
+    def get(self, url, session):
+        """
+        The path of the cached file of a URL, which is downloaded first
+        if it isn't in the cache. The file is pinned.
+        """
+        path = self.path(url)
+        with self.lock:
+            self.pinned.add(path)
+
+        if op.exists(path):
+            # the access time orders the files for eviction, the
+            # modification time is kept for the header index
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+            return path
+
+        temp_path = "{}.{}.{}.part".format(path, os.getpid(), threading.get_ident())
+        try:
+            with instrument.stage("download") as counters:
+                counters["bytes"] += session.download(url, temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if op.exists(temp_path):
+                os.remove(temp_path)
+
+        self.evict()
+        return path
+
+    def pinned_bytes(self):
+        """
+        The total size of the pinned files.
+        """
+        with self.lock:
+            return sum(op.getsize(path) for path in self.pinned if op.exists(path))
+
+    def evict(self):
+        """
+        Remove the least recently used files that aren't pinned until the
+        cache fits into max_bytes.
+        """
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and not entry.name.endswith(".part"):
+                    stat = entry.stat()
+                    files += [(stat.st_atime, stat.st_size, entry.path)]
+
+            total = sum(size for (_, size, _) in files)
+            for (_, size, path) in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                if path in self.pinned:
+                    continue
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+class Fetcher:
+    """
+    Download the remote input files of a conversion into a download
+    cache in a thread pool, in the order of the input files.
+
+    Parameters
+    ----------
+    directory: str (default DEFAULT_CACHE_DIR)
+        The directory of the download cache
+    max_bytes: int (default DEFAULT_CACHE_BYTES)
+        The size of the download cache
+    threads: int (default DEFAULT_THREADS)
+        The number of files that are downloaded at once
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_BYTES,
+                 threads=DEFAULT_THREADS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.cache = None
+        self.session = Session()
+        self.pool = ThreadPoolExecutor(threads)
+
+    def fetch(self, input_files):
+        """
+        Start downloading the URLs of the input files.
+
+        Returns
+        -------
+        A future of the local path of every input file, local files are
+        passed through as they are.
+        """
+        futures = []
+        for in_file in input_files:
+            if is_url(in_file):
+                if self.cache is None:
+                    self.cache = DownloadCache(self.directory, self.max_bytes)
+                futures += [self.pool.submit(self.cache.get, in_file, self.session)]
+            else:
+                futures += [Future()]
+                futures[-1].set_result(in_file)
+        return futures
+
+    def paths(self, input_files):
+        """
+        The local path of every input file, as soon as it is available.
+
+        Raises
+        ------
+        IOError if a file can't be downloaded
+        """
+        for future in self.fetch(input_files):
+            yield future.result()
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
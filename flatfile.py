@@ -0,0 +1,567 @@
+"""
+A flat output format for multivec files, from which a tile server can
+read tiles with as little work as possible.
+
+Every resolution is a single binary file with the rows of all of the
+chromosomes, one after another, each one at the bin that its genome
+position falls into, the way they are laid out in the tiles (see
+reader.MultivecReader). The file is made of blocks of tile_size rows,
+so that tile x of a resolution is block x. Uncompressed, a tile is a
+slice of a memory map of the file, read without copying. Compressed,
+each block is compressed with zlib on its own, so a tile is read with
+a single decompression, and empty blocks are not stored.
+
+A flat multivec is a directory:
+
+    index.json        the layout, see FlatOutput.finish
+    <res>.bin         the blocks of every resolution
+    <res>.blocks      the offsets of the compressed blocks in <res>.bin,
+                      as little-endian uint64 (compressed files only)
+"""
+
+import json
+import math
+import os
+import os.path as op
+import shutil
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import h5py
+import numpy as np
+
+import chrom_sizes
+import instrument
+import rowstats
+
+FORMAT = "multivec-flat"
+VERSION = 1
+INDEX_NAME = "index.json"
+
+# The compression of the blocks: None or 'zlib'.
+COMPRESSIONS = (None, "zlib")
+
+# The zlib level of compressed blocks, like the default of gzip in HDF5.
+DEFAULT_COMPRESSION_LEVEL = 4
+
+
+def is_flat(path):
+    """
+    Whether a path is a flat multivec directory.
+    """
+    return op.isfile(op.join(path, INDEX_NAME))
+
+
+def read_index(path):
+    with open(op.join(path, INDEX_NAME)) as f:
+        index = json.load(f)
+    if index.get("format") != FORMAT:
+        raise ValueError("{} is not a flat multivec".format(path))
+    if index.get("version", 0) > VERSION:
+        raise ValueError("{} has a newer version of the flat format".format(path))
+    return index
+
+
+def json_values(array):
+    """
+    A list of the values of an array that JSON can store, with None for NaN.
+    """
+    return [None if np.isnan(value) else value for value in np.asarray(array, dtype=float).tolist()]
+
+
+def array_values(values):
+    """
+    The array of a list written by json_values.
+    """
+    return np.array([np.nan if value is None else value for value in values], dtype=float)
+
+
+class FlatLevel:
+    """
+    Write the blocks of the file of one resolution, one after another.
+
+    The rows are written at their index in the file, in increasing order,
+    except that a row of the block that is being filled can be written
+    again, e.g. the first row of a chromosome that shares its bin with
+    the last row of the previous one. Rows that are never written are
+    empty (NaN).
+
+    Parameters
+    ----------
+    path: str
+        The path of the file of the resolution
+    num_blocks: int
+    block_rows: int
+    num_cols: int
+    dtype: str
+    compression: None or 'zlib'
+    compression_opts: int
+        The zlib level
+    pool: concurrent.futures.ThreadPoolExecutor
+        The threads that compress the blocks
+    max_pending: int
+        The number of blocks that can be compressed at once
+    """
+
+    def __init__(self, path, num_blocks, block_rows, num_cols, dtype, compression=None,
+                 compression_opts=None, pool=None, max_pending=16):
+        self.path = path
+        self.num_blocks = num_blocks
+        self.block_rows = block_rows
+        self.num_cols = num_cols
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.level = DEFAULT_COMPRESSION_LEVEL if compression_opts is None else compression_opts
+        self.pool = pool
+        self.max_pending = max_pending
+
+        self.file = open(path, "wb")
+        self.offsets = [0]
+        self.pending = []
+        self.empty_block = np.full((block_rows, num_cols), np.nan, dtype=self.dtype)
+        self.block = 0
+        self.buffer = self.empty_block.copy()
+
+    def write(self, row, data, col_offset=0):
+        """
+        Write rows starting at a row of the file, to the columns from col_offset.
+        """
+        while len(data) > 0:
+            block = row // self.block_rows
+            if block < self.block:
+                raise ValueError(
+                    "Can not write row {} after the rows of block {}".format(row, self.block)
+                )
+            if block >= self.num_blocks:
+                raise ValueError("Row {} is beyond the end of {}".format(row, self.path))
+            if block > self.block:
+                self.flush(block)
+
+            start = row - block * self.block_rows
+            num_rows = min(self.block_rows - start, len(data))
+            self.buffer[start : start + num_rows, col_offset : col_offset + data.shape[1]] = \
+                data[:num_rows]
+            row += num_rows
+            data = data[num_rows:]
+
+    def flush(self, block):
+        """
+        Store the blocks before a block, and continue with that block.
+        """
+        self.submit(self.buffer)
+        for _ in range(self.block + 1, block):
+            self.submit(self.empty_block)
+        self.block = block
+        self.buffer = self.empty_block.copy()
+
+    def submit(self, data):
+        if self.compression is None:
+            with instrument.stage("write-chunks") as counters:
+                self.file.write(data.tobytes())
+                counters["bytes_written"] += data.nbytes
+            return
+
+        if np.isnan(data).all():
+            self.pending += [None]
+        else:
+            self.pending += [self.pool.submit(self.compress, data)]
+        self.commit(len(self.pending) > self.max_pending)
+
+    def compress(self, data):
+        with instrument.stage("compress") as counters:
+            compressed = zlib.compress(data, self.level)
+            counters["bytes_in"] += data.nbytes
+            counters["bytes_out"] += len(compressed)
+        return compressed
+
+    def commit(self, wait=False):
+        # the blocks are written in order
+        while self.pending and (wait or self.pending[0] is None or self.pending[0].done()):
+            future = self.pending.pop(0)
+            if future is not None:
+                data = future.result()
+                with instrument.stage("write-chunks") as counters:
+                    self.file.write(data)
+                    counters["bytes_written"] += len(data)
+                self.offsets += [self.offsets[-1] + len(data)]
+            else:
+                self.offsets += [self.offsets[-1]]
+            wait = wait and len(self.pending) > self.max_pending
+
+    def close(self):
+        if self.num_blocks > 0:
+            self.flush(self.num_blocks)
+        while self.pending:
+            self.commit(True)
+        self.file.close()
+
+        if self.compression is not None:
+            np.array(self.offsets, dtype="<u8").tofile(blocks_path(self.path))
+
+
+def blocks_path(path):
+    return op.splitext(path)[0] + ".blocks"
+
+
+class FlatValues:
+    """
+    The rows of a chromosome in the file of a resolution.
+    """
+
+    def __init__(self, level, start_row, shape):
+        self.level = level
+        self.start_row = start_row
+        self.shape = shape
+
+    def __len__(self):
+        return self.shape[0]
+
+
+class FlatWriter:
+    """
+    Append rows to the rows of a chromosome in a flat file, with the
+    interface of multivec.ChunkWriter.
+    """
+
+    def __init__(self, values, col_offset=0, num_cols=None, stats=None):
+        self.values = values
+        self.col_offset = col_offset
+        self.stats = stats
+        self.position = 0
+
+    def seek(self, row):
+        if row < self.position:
+            raise ValueError("Can not write row {} after row {}".format(row, self.position))
+        self.position = row
+
+    def append(self, data):
+        data = np.asarray(data, dtype=self.values.level.dtype)
+        if self.stats is not None:
+            with instrument.stage("row-stats"):
+                self.stats.add(data, self.col_offset)
+        self.values.level.write(self.values.start_row + self.position, data, self.col_offset)
+        self.position += len(data)
+
+    def close(self):
+        pass
+
+
+class FlatOutput:
+    """
+    The flat output backend of multivec.create_multivec_multires, see
+    multivec.HDF5Output for the interface.
+
+    The chromosomes have to be written in the order of chromsizes, and
+    the rows of a resolution in increasing order, so the output can not
+    be built from batches of columns, resumed or updated.
+
+    Parameters
+    ----------
+    path: str
+        The output directory. An existing flat multivec is replaced.
+    chromsizes: [('chrom_key', size),...]
+    starting_resolution: int
+    resolutions: [int, ...]
+    tile_size: int
+        The number of rows of a block
+    row_infos: [str, ...]
+    aggregations: [str, ...]
+    dtype: str (default 'f4')
+    compression: None or 'zlib'
+    compression_opts: int
+        The zlib level (default DEFAULT_COMPRESSION_LEVEL)
+    pool: concurrent.futures.ThreadPoolExecutor
+        The threads that compress the blocks
+    contigs: [('contig', 'chrom_key', start, size), ...]
+        The contigs that are laid out in the chromosomes, see
+        chrom_sizes.write_contigs
+    """
+
+    def __init__(self, path, chromsizes, starting_resolution, resolutions, tile_size,
+                 row_infos=None, aggregations=None, dtype="f4", compression=None,
+                 compression_opts=None, pool=None, contigs=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(
+                "The flat backend compresses with {}, not {}".format(
+                    " or ".join(str(c) for c in COMPRESSIONS), compression
+                )
+            )
+
+        if op.exists(path):
+            if not is_flat(path) and (op.isdir(path) and os.listdir(path)):
+                raise ValueError("{} exists and is not a flat multivec".format(path))
+            if op.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        os.makedirs(path)
+
+        self.path = path
+        self.chromsizes = list(chromsizes)
+        self.starting_resolution = starting_resolution
+        self.resolutions = list(resolutions)
+        self.tile_size = tile_size
+        self.row_infos = row_infos
+        self.aggregations = aggregations
+        self.dtype = np.dtype(dtype)
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.pool = pool
+        self.contigs = list(contigs or [])
+
+        self.levels = {}
+        self.sources = {}
+        self.num_bins = {resolution: 0 for resolution in self.resolutions}
+        self.num_cols = None
+
+        # the first row of every chromosome, and the number of rows of the
+        # file of every resolution, in whole blocks
+        self.chrom_offsets = {}
+        self.num_blocks = {}
+        chroms = [chrom for (chrom, _) in self.chromsizes]
+        lengths = np.array([length for (_, length) in self.chromsizes], dtype=np.int64)
+        positions = np.cumsum(lengths) - lengths
+        for resolution in self.resolutions:
+            offsets = positions // resolution
+            ends = offsets + chrom_rows(lengths, starting_resolution, resolution)
+            self.chrom_offsets[resolution] = dict(zip(chroms, offsets.tolist()))
+            self.num_blocks[resolution] = math.ceil(int(ends.max(initial=0)) / tile_size)
+
+    def values(self, resolution, chrom, shape, **layout):
+        """
+        The rows of a chromosome at a resolution, the storage layout
+        of multivec.HDF5Output.values is ignored except for the type.
+        """
+        if self.num_cols is None:
+            self.num_cols = shape[1]
+        elif shape[1] != self.num_cols:
+            raise ValueError(
+                "Chromosome {} has {} columns, the other chromosomes have {}".format(
+                    chrom, shape[1], self.num_cols
+                )
+            )
+
+        if resolution not in self.levels:
+            self.levels[resolution] = FlatLevel(
+                op.join(self.path, "{}.bin".format(resolution)),
+                self.num_blocks[resolution],
+                self.tile_size,
+                self.num_cols,
+                self.dtype,
+                self.compression,
+                self.compression_opts,
+                self.pool,
+            )
+        self.num_bins[resolution] += shape[0]
+
+        # like the tiles of the datasets of a multires file, the first row
+        # of a chromosome replaces the last row of the previous one if they
+        # are in the same bin, even if it is empty
+        start_row = self.chrom_offsets[resolution][chrom]
+        if shape[0] > 0:
+            self.levels[resolution].write(
+                start_row, np.full((1, self.num_cols), np.nan, dtype=self.dtype)
+            )
+        return FlatValues(self.levels[resolution], start_row, shape)
+
+    def writer(self, values, pool=None, col_offset=0, num_cols=None, stats=None):
+        return FlatWriter(values, col_offset, num_cols, stats)
+
+    def mark_zoom_data(self, resolution):
+        self.sources[resolution] = "zoom-data"
+
+    def finish(self, stats=None, built=()):
+        """
+        Write the last blocks and the index:
+
+            {'format': FORMAT, 'version': VERSION, 'tile_size': int,
+             'dtype': str, 'num_cols': int, 'compression': None or 'zlib',
+             'chroms': [[name, length], ...],
+             'row_infos': [str, ...], 'aggregations': [str, ...],
+             'contigs': [[contig, chrom, start, size], ...] (optional),
+             'resolutions': {'<res>': {'file': str, 'blocks': str or None,
+                                       'num_rows': int,
+                                       'chrom_offsets': {chrom: row, },
+                                       'source': 'zoom-data' (optional),
+                                       'row_stats': {...} (optional)}, }}
+
+        The rows of a resolution (num_rows) are whole blocks, and the
+        first row of every chromosome is in chrom_offsets. row_stats has
+        the statistics of rowstats.RowStats.summary, with None for NaN.
+
+        Parameters
+        ----------
+        stats: {resolution: rowstats.RowStats, }
+            The statistics of every resolution
+        built: the chromosomes of stats, they are all written here
+
+        Returns
+        -------
+        The output, which the caller closes
+        """
+        if self.num_cols is None:
+            self.num_cols = 0
+        for resolution in self.resolutions:
+            if resolution not in self.levels and self.num_cols > 0:
+                # a resolution without any data is empty
+                self.levels[resolution] = FlatLevel(
+                    op.join(self.path, "{}.bin".format(resolution)),
+                    self.num_blocks[resolution],
+                    self.tile_size,
+                    self.num_cols,
+                    self.dtype,
+                    self.compression,
+                    self.compression_opts,
+                    self.pool,
+                )
+        for level in self.levels.values():
+            level.close()
+
+        index = {
+            "format": FORMAT,
+            "version": VERSION,
+            "tile_size": self.tile_size,
+            "dtype": self.dtype.str,
+            "num_cols": self.num_cols,
+            "compression": self.compression,
+            "chroms": [[chrom, int(length)] for (chrom, length) in self.chromsizes],
+            "resolutions": {},
+        }
+        if self.row_infos is not None:
+            index["row_infos"] = [
+                r.decode() if isinstance(r, bytes) else str(r) for r in self.row_infos
+            ]
+        if self.aggregations is not None:
+            index["aggregations"] = list(self.aggregations)
+        if self.contigs:
+            index["contigs"] = [
+                [contig, chrom, int(start), int(size)] for (contig, chrom, start, size) in self.contigs
+            ]
+
+        for resolution in self.resolutions:
+            entry = {
+                "file": "{}.bin".format(resolution) if resolution in self.levels else None,
+                "blocks": None,
+                "num_rows": self.num_blocks[resolution] * self.tile_size,
+                "chrom_offsets": self.chrom_offsets[resolution],
+            }
+            if self.compression is not None and resolution in self.levels:
+                entry["blocks"] = "{}.blocks".format(resolution)
+            if resolution in self.sources:
+                entry["source"] = self.sources[resolution]
+            if stats and resolution in stats:
+                summary = stats[resolution].summary(self.num_bins[resolution])
+                entry["row_stats"] = {
+                    "count": summary.pop("count").tolist(),
+                    "quantile_levels": list(summary.pop("quantile_levels")),
+                    "relative_accuracy": summary.pop("relative_accuracy"),
+                    "range": json_values(summary.pop("range")),
+                    "quantiles": [json_values(q) for q in summary.pop("quantiles")],
+                }
+                entry["row_stats"].update(
+                    {name: json_values(values) for (name, values) in summary.items()}
+                )
+            index["resolutions"][str(resolution)] = entry
+
+        # the index is written last, so an incomplete output has none
+        temp_path = op.join(self.path, INDEX_NAME + ".tmp")
+        with open(temp_path, "w") as f:
+            json.dump(index, f)
+        os.replace(temp_path, op.join(self.path, INDEX_NAME))
+        return self
+
+    def close(self):
+        pass
+
+
+def chrom_rows(lengths, starting_resolution, resolution):
+    """
+    The number of rows of chromosomes at a resolution, halving the
+    rows of the starting resolution like the zoom levels.
+
+    Parameters
+    ----------
+    lengths: np.array of int64
+    starting_resolution: int
+    resolution: int
+    """
+    num_rows = -(-lengths // starting_resolution)
+    while starting_resolution < resolution:
+        num_rows = -(-num_rows // 2)
+        starting_resolution *= 2
+    return num_rows
+
+
+def convert_multires(input_file, output_path, compression=None, compression_opts=None,
+                     compression_threads=None):
+    """
+    Convert a multires file created by multivec.create_multivec_multires
+    to a flat multivec, with the same values at every resolution.
+
+    Parameters
+    ----------
+    input_file: str
+        The multires file
+    output_path: str
+        The directory of the flat multivec
+    compression: None or 'zlib'
+    compression_opts: int
+        The zlib level
+    compression_threads: int (default: the number of CPUs)
+    """
+    pool = ThreadPoolExecutor(compression_threads or os.cpu_count())
+
+    with h5py.File(input_file, "r") as f:
+        resolutions = sorted(int(r) for r in f["resolutions"])
+        chromsizes = list(
+            zip([c.decode() for c in f["chroms"]["name"][:]], f["chroms"]["length"][:].tolist())
+        )
+        first = f["resolutions"][str(resolutions[0])]
+        datasets = [first["values"][chrom] for chrom in first["values"]]
+        aggregations = [
+            name.decode() if isinstance(name, bytes) else str(name)
+            for name in f["info"].attrs["aggregations"]
+        ] if "aggregations" in f["info"].attrs else None
+
+        output = FlatOutput(
+            output_path,
+            chromsizes,
+            resolutions[0],
+            resolutions,
+            int(f["info"].attrs["tile-size"]),
+            row_infos=first.attrs["row_infos"] if "row_infos" in first.attrs else None,
+            aggregations=aggregations,
+            dtype=datasets[0].dtype if datasets else "f4",
+            compression=compression,
+            compression_opts=compression_opts,
+            pool=pool,
+            contigs=chrom_sizes.read_contigs(f),
+        )
+
+        stats = {}
+        for resolution in resolutions:
+            group = f["resolutions"][str(resolution)]
+            if group.attrs.get("source") == "zoom-data":
+                output.mark_zoom_data(resolution)
+
+            for (chrom, _) in chromsizes:
+                if chrom not in group["values"]:
+                    continue
+                dataset = group["values"][chrom]
+                if "row_stats" in group and resolution not in stats:
+                    stats[resolution] = rowstats.RowStats(dataset.shape[1])
+
+                writer = output.writer(
+                    output.values(resolution, chrom, dataset.shape), stats=stats.get(resolution)
+                )
+                chunk_rows = dataset.chunks[0] if dataset.chunks is not None else len(dataset)
+                for start in range(0, len(dataset), max(chunk_rows, 1)):
+                    with instrument.stage("read-chunks"):
+                        rows = dataset[start : start + chunk_rows]
+                    writer.append(rows)
+                writer.close()
+
+        output.finish(stats)
+
+    pool.shutdown()
+    return output
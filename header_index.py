@@ -0,0 +1,147 @@
+"""
+A persistent index of the headers of bigwig files, so that repeated
+conversions don't have to open every input file to validate it, merge
+the chromosome sizes or plan the work.
+"""
+
+import json
+import os
+import os.path as op
+
+import pyBigWig
+
+import utils
+
+# The default location of the index, shared by all conversions.
+DEFAULT_INDEX_PATH = op.join(
+    os.environ.get("XDG_CACHE_HOME", op.join(op.expanduser("~"), ".cache")),
+    "bigwigs-to-multivec",
+    "header-index.json",
+)
+
+# The version of the stored entries. Entries of other versions are rebuilt.
+INDEX_VERSION = 2
+
+
+def file_key(path):
+    """
+    The key of a local file in the index and the size and modification
+    time it is valid for, or None if the file can not be indexed (e.g.
+    it is a URL).
+    """
+    if "://" in path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (op.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def read_header(path):
+    """
+    Read the header of a bigwig file into an index entry.
+
+    Returns
+    -------
+    {'is_bigwig': bool, 'chroms': [[chrom, size], ...], 'zoom_levels': [int, ...],
+     'min': float, 'max': float}
+    The value range of the whole file is read from the summary in its
+    header, so the data and the zoom levels aren't read. It is None if
+    the file has no values.
+    """
+    bw = pyBigWig.open(path)
+    try:
+        if not bw.isBigWig():
+            return {"is_bigwig": False}
+
+        summary = utils.read_bigwig_summary(path) or {"min": None, "max": None}
+        return {
+            "is_bigwig": True,
+            "chroms": [[chrom, size] for (chrom, size) in bw.chroms().items()],
+            "zoom_levels": utils.read_bigwig_zoom_levels(path) or [],
+            "min": summary["min"],
+            "max": summary["max"],
+        }
+    finally:
+        bw.close()
+
+
+class HeaderIndex:
+    """
+    The headers of bigwig files, stored in a JSON file and keyed by the
+    path, size and modification time of each file. An entry is read from
+    the file the first time it is needed and whenever the file changed.
+
+    Files that can not be indexed (e.g. URLs) are read once per index
+    object and not stored.
+
+    Parameters
+    ----------
+    path: str (default DEFAULT_INDEX_PATH)
+        The path of the index file, or None to keep the index in memory
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = path
+        self.entries = {}
+        self.unstored = {}
+        self.changed = False
+
+        if path is None or not op.exists(path):
+            return
+
+        try:
+            with open(path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            print("Ignoring unreadable header index:", path)
+            return
+
+        if index.get("version") == INDEX_VERSION:
+            self.entries = index.get("files", {})
+
+    def get(self, path):
+        """
+        The index entry of a bigwig file, see read_header.
+
+        Parameters
+        ----------
+        path: bigwig file path
+        """
+        key = file_key(path)
+        if key is not None:
+            entry = self.entries.get(key[0])
+            if entry is not None and [entry["size"], entry["mtime"]] != list(key[1:]):
+                entry = None
+        else:
+            entry = self.unstored.get(path)
+
+        if entry is None:
+            entry = read_header(path)
+            if key is not None:
+                entry.update(size=key[1], mtime=key[2])
+                self.entries[key[0]] = entry
+                self.changed = True
+            else:
+                self.unstored[path] = entry
+
+        return entry
+
+    def save(self):
+        """
+        Write the index file if any entries were added.
+        """
+        if self.path is None or not self.changed:
+            return
+
+        temp_path = "{}.{}.tmp".format(self.path, os.getpid())
+        try:
+            os.makedirs(op.dirname(op.abspath(self.path)), exist_ok=True)
+            with open(temp_path, "w") as f:
+                json.dump({"version": INDEX_VERSION, "files": self.entries}, f)
+            os.replace(temp_path, self.path)
+        except (IOError, OSError) as ex:
+            print("Can not save the header index:", ex)
+            return
+        self.changed = False
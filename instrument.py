@@ -0,0 +1,201 @@
+"""
+Instrumentation of the stages of a conversion: wall and CPU time, bytes
+read and written, values decoded and the peak memory of the process so
+far at the end of each stage, written to a machine-readable JSON report.
+
+The stages are recorded in the report that was started with start(), if
+any. Without a report, stage() and add() do nothing, so that they can be
+left in the code paths of a conversion.
+"""
+
+import collections
+import contextlib
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+# The report that is being recorded.
+_report = None
+
+
+def peak_rss(who="self"):
+    """
+    The peak resident set size of this process (or of its finished child
+    processes with who='children') in bytes, or None if it is unknown.
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(
+        resource.RUSAGE_SELF if who == "self" else resource.RUSAGE_CHILDREN
+    )
+    # kilobytes on Linux, bytes on macOS
+    return usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+
+
+class Report:
+    """
+    The stages of a conversion and their counters.
+
+    Every stage accumulates the number of times it ran ('calls'), its wall
+    time and the CPU time of the thread that ran it, in seconds, and any
+    other counters that are added to it (e.g. 'bytes_read').
+
+    'max_rss_so_far' is the peak resident set size of the process when the
+    stage last ended. It is a high-water mark of the whole process, so it
+    includes the memory of the stages before and of the threads that ran
+    at the same time, and it only tells which stage raised the peak: the
+    first stage after which it grew.
+
+    Parameters
+    ----------
+    profile: str (default None)
+        Profile the conversion with cProfile and write the statistics to
+        this path (see pstats)
+    trace_memory: bool (default False)
+        Trace the memory allocations of Python with tracemalloc and add the
+        peak traced memory and the largest allocation sites to the report
+    """
+
+    def __init__(self, profile=None, trace_memory=False):
+        self.stages = collections.OrderedDict()
+        self.info = {}
+        self.lock = threading.Lock()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+
+        self.profile = profile
+        self.profiler = None
+        if profile is not None:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+        self.trace_memory = trace_memory
+        if trace_memory:
+            tracemalloc.start()
+
+    def add(self, name, **counters):
+        """
+        Add to the counters of a stage.
+        """
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            for (key, value) in counters.items():
+                stage[key] = stage.get(key, 0) + value
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Record the time of a block of code as a stage. The block is given
+        a dict of counters to add to the stage.
+        """
+        counters = collections.defaultdict(int)
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+        try:
+            yield counters
+        finally:
+            self.add(
+                name,
+                calls=1,
+                wall=time.perf_counter() - start_wall,
+                cpu=time.thread_time() - start_cpu,
+                **counters
+            )
+            rss = peak_rss()
+            if rss is not None:
+                with self.lock:
+                    stage = self.stages[name]
+                    stage["max_rss_so_far"] = max(stage.get("max_rss_so_far", 0), rss)
+
+    def stop(self):
+        """
+        Stop the profiler and the memory tracing, and return the report as a dict.
+        """
+        report = {
+            "wall": time.perf_counter() - self.start_wall,
+            "cpu": time.process_time() - self.start_cpu,
+            "peak_rss": peak_rss(),
+            "peak_rss_children": peak_rss("children"),
+            "info": self.info,
+            "stages": self.stages,
+        }
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            report["profile"] = self.profile
+            self.profiler = None
+
+        if self.trace_memory and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            report["tracemalloc"] = {
+                "peak": tracemalloc.get_traced_memory()[1],
+                "top": [
+                    {"site": str(stat.traceback), "size": stat.size, "count": stat.count}
+                    for stat in snapshot.statistics("lineno")[:20]
+                ],
+            }
+            tracemalloc.stop()
+
+        return report
+
+
+def start(profile=None, trace_memory=False):
+    """
+    Start recording a report, see Report.
+    """
+    global _report
+    _report = Report(profile, trace_memory)
+    return _report
+
+
+def finish(path=None):
+    """
+    Stop recording the current report and return it as a dict, after
+    writing it to a JSON file if a path is given.
+    """
+    global _report
+    if _report is None:
+        return None
+
+    report = _report.stop()
+    _report = None
+
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=1)
+        print("Performance report:", path)
+    return report
+
+
+def info(**values):
+    """
+    Add information about the conversion (e.g. its parameters) to the report.
+    """
+    if _report is not None:
+        _report.info.update(values)
+
+
+def add(name, **counters):
+    """
+    Add to the counters of a stage of the current report.
+    """
+    if _report is not None:
+        _report.add(name, **counters)
+
+
+def stage(name):
+    """
+    Record a block of code as a stage of the current report, see Report.stage.
+    """
+    if _report is not None:
+        return _report.stage(name)
+    return contextlib.nullcontext(collections.defaultdict(int))
@@ -5,17 +5,35 @@ This python file is brought from HiGlass/Clodius.
 
 from __future__ import print_function
 
+import collections
 import gzip
 import h5py
+import itertools
 import math
 import numpy as np
 import logging
 import os
 import os.path as op
 import sys
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import chrom_sizes
+import flatfile
+import instrument
+import rowstats
+from aggregation import Pyramid, SummaryPyramid
 
 logger = logging.getLogger(__name__)
 
+# the number of rows of the base resolution that are aggregated at once
+STANDARD_CHUNK_SIZE = 100000
+
+
+# the number of lines that are parsed at once by bedfile_to_multivec
+BEDFILE_LINES_BLOCK_SIZE = 65536
+
 
 def bedfile_to_multivec(
     input_filenames,
@@ -29,6 +47,11 @@ def bedfile_to_multivec(
 ):
     """
     Convert an epilogos bedfile to multivec format.
+
+    The lines are parsed in blocks, the bins of every interval are filled
+    with numpy and every chromosome segment of a block is written at once,
+    in pieces of at most chunk_size rows. The bins between intervals are
+    written as empty (NaN).
     """
 
     files = []
@@ -38,106 +61,318 @@ def bedfile_to_multivec(
         else:
             files += [open(input_filename, "r")]
 
-    FILL_VALUE = np.nan
-
-    # batch regions because h5py is really bad at writing
-    batch_length = chunk_size
-    batch = []
-
-    # the current index in the dataset
-    curr_index = 0
-    # the start of the batch in the dataset
-    batch_start_index = 0
-
     if has_header:
         files[0].readline()
 
+    # the chromosome that is being written and its next row
     prev_chrom = None
+    curr_index = 0
 
     print("base_resolution:", base_resolution)
-    for _, lines in enumerate(zip(*files)):
+    lines_iter = zip(*files)
+    while True:
+        block = list(itertools.islice(lines_iter, BEDFILE_LINES_BLOCK_SIZE))
+        if not block:
+            break
+
+        chroms = []
+        starts = []
+        ends = []
+        vectors = []
+        block_lines = []
+        for lines in block:
+            # Identifies bedfile headers and ignore them
+            if lines[0].startswith("browser") or lines[0].startswith("track"):
+                continue
 
-        # Identifies bedfile headers and ignore them
-        if lines[0].startswith("browser") or lines[0].startswith("track"):
+            chrom, start, end, vector = bedline_to_chrom_start_end_vector(lines, row_infos)
+            if len(vector) < len(lines) * num_rows:
+                logger.warn("Lines contain fewer columns than expected: %s", lines)
+                vector = list(vector) + [np.nan] * (len(lines) * num_rows - len(vector))
+
+            if start % base_resolution != 0:
+                logger.error(
+                    "The start coordinate is not a multiple of the resolution in line: %s",
+                    lines,
+                )
+                sys.exit(1)
+
+            chroms += [chrom]
+            starts += [start]
+            ends += [end]
+            vectors += [vector]
+            block_lines += [lines]
+
+        if not chroms:
             continue
 
-        chrom, start, end, vector = bedline_to_chrom_start_end_vector(lines, row_infos)
-        # if vector[0] > 0 or vector[1] > 0:
-        if len(vector) < len(lines) * num_rows:
-            logger.warn("Lines contain fewer columns than expected: %s", lines)
-            vector += [np.nan] * (len(lines) * num_rows - len(vector))
+        try:
+            vectors = np.array(vectors, dtype=np.float64)
+            if vectors.ndim != 2:
+                raise ValueError("The lines have different numbers of values")
+        except (TypeError, ValueError) as ex:
+            print("Error:", ex, file=sys.stderr)
+            print("Probably need to set the --num-rows parameter", file=sys.stderr)
+            return
+
+        start_bins = np.array(starts, dtype=np.int64) // base_resolution
+        end_bins = -(-np.array(ends, dtype=np.int64) // base_resolution)
+
+        # the consecutive lines of the same chromosome
+        segment_starts = [0] + [i for i in range(1, len(chroms)) if chroms[i] != chroms[i - 1]]
+        segment_ends = segment_starts[1:] + [len(chroms)]
+
+        for (first, last) in zip(segment_starts, segment_ends):
+            chrom = chroms[first]
+            if chrom != prev_chrom:
+                # we're starting a new chromosome so we start from the beginning
+                curr_index = 0
+            prev_chrom = chrom
+
+            overlap = first_overlap(curr_index, start_bins[first:last], end_bins[first:last])
+            if overlap is not None:
+                print(
+                    "Error: the interval overlaps the previous one or isn't sorted in line:",
+                    block_lines[first + overlap],
+                    file=sys.stderr,
+                )
+                return
 
-        if start % base_resolution != 0:
-            logger.error(
-                "The start coordinate is not a multiple of the resolution in line: %s",
-                lines,
-            )
-            sys.exit(1)
+            try:
+                curr_index = write_bins(
+                    f_out[chrom],
+                    curr_index,
+                    start_bins[first:last],
+                    end_bins[first:last],
+                    vectors[first:last],
+                    chunk_size,
+                )
+            except TypeError as ex:
+                print("Error:", ex, file=sys.stderr)
+                print("Probably need to set the --num-rows parameter", file=sys.stderr)
+                return
 
-        if prev_chrom is not None and chrom != prev_chrom:
-            # we've reached a new chromosome so we'll dump all
-            # the previous values
-            # print("len(batch:", len(batch),
-            #       "batch_start_index", batch_start_index)
-            f_out[prev_chrom][
-                batch_start_index : batch_start_index + len(batch)
-            ] = np.array(batch)
 
-            # we're starting a new chromosome so we start from the beginning
-            curr_index = 0
-            batch_start_index = 0
-            batch = []
+def first_overlap(curr_index, start_bins, end_bins):
+    """
+    The index of the first interval that starts before the end of the
+    previous one, or before curr_index for the first one, or None if the
+    intervals are sorted and don't overlap.
+    """
+    previous_ends = np.concatenate(([curr_index], end_bins[:-1]))
+    overlapping = np.flatnonzero(start_bins < previous_ends)
+    return int(overlapping[0]) if len(overlapping) else None
 
-        prev_chrom = chrom
 
-        # print('parts', parts)
-        # print('chrom:', chrom, start)
+def write_bins(dataset, curr_index, start_bins, end_bins, vectors, max_rows):
+    """
+    Write the vectors of consecutive intervals to the bins they cover,
+    starting at row curr_index and in pieces of at most max_rows rows.
+    The bins that no interval covers are NaN.
 
-        data_start_index = start // base_resolution
+    Returns
+    -------
+    The row after the last interval
 
-        # if the bedfile skips over a region, we have to add it as empty values
-        # to preserve our batch writing
-        while curr_index < data_start_index:
-            batch += [[FILL_VALUE] * len(vector)]
-            curr_index += 1
+    Raises
+    ------
+    ValueError if the intervals overlap or aren't sorted, see first_overlap
+    """
+    overlap = first_overlap(curr_index, start_bins, end_bins)
+    if overlap is not None:
+        raise ValueError(
+            "The intervals are overlapping or not sorted at bin {}".format(start_bins[overlap])
+        )
 
-        """
-        if curr_index != data_start_index:
-            print("curr_index:", curr_index, data_start_index)
-            print("line:", line)
-        """
+    end_index = int(end_bins[-1])
+    for window_start in range(curr_index, end_index, max_rows):
+        window_end = min(window_start + max_rows, end_index)
 
-        assert curr_index == data_start_index
-        # print('vector', vector)
+        # the intervals that overlap the window, clipped to it
+        first = int(np.searchsorted(end_bins, window_start, side="right"))
+        last = int(np.searchsorted(start_bins, window_end, side="left"))
+        starts = np.maximum(start_bins[first:last], window_start) - window_start
+        lengths = np.minimum(end_bins[first:last], window_end) - window_start - starts
 
-        # When the binsize is not equal to the base_resolution
-        # "break down" the binsize into bins of the rbase_esolution size
-        # and add the values to each bin.
-        # If there is a remainder, add an additional bin
-        data_end_index = math.ceil(end / base_resolution)
+        # the row of every covered bin in the window
+        offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        rows = np.arange(len(offsets)) + offsets
 
-        while curr_index < data_end_index:
-            batch += [vector]
-            curr_index += 1
+        batch = np.full((window_end - window_start, vectors.shape[1]), np.nan)
+        batch[rows] = np.repeat(vectors[first:last], lengths, axis=0)
+        dataset[window_start:window_end] = batch
+        print("dumping batch:", dataset.name.split("/")[-1], window_end)
 
-        # fill in empty
+    return end_index
 
-        if len(batch) >= batch_length:
-            # dump batch
-            try:
-                f_out[chrom][
-                    batch_start_index : batch_start_index + len(batch)
-                ] = np.array(batch)
-            except TypeError as ex:
-                print("Error:", ex, file=sys.stderr)
-                print("Probably need to set the --num-rows parameter", file=sys.stderr)
-                return
 
-            batch = []
-            batch_start_index = curr_index
-            print("dumping batch:", chrom, batch_start_index)
+def iter_chunks(source, chunk_size):
+    """
+    Iterate over consecutive chunks of rows of an array-like or an iterable.
+
+    Parameters
+    ----------
+    source: np.array, h5py.Dataset or an iterable of arrays
+        Arrays and datasets are sliced in chunks of chunk_size rows,
+        iterables are passed through as they are.
+    chunk_size: int
+        The number of rows in each chunk of an array-like source
+    """
+    if hasattr(source, "shape"):
+        for start in range(0, len(source), chunk_size):
+            yield source[start : start + chunk_size]
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def create_layout(f, chromsizes, resolutions, tile_size, row_infos=None, aggregations=None,
+                  contigs=None):
+    """
+    Create the groups and the metadata of an empty multires file.
+    """
+    # store some metadata
+    f.create_group("info")
+    f["info"].attrs["tile-size"] = tile_size
+    if aggregations is not None:
+        f["info"].attrs["aggregations"] = [name.encode() for name in aggregations]
+
+    f.create_group("resolutions")
+    f.create_group("chroms")
+
+    for curr_resolution in resolutions:
+        f["resolutions"].create_group(str(curr_resolution))
+
+        # add information about each of the rows
+        if row_infos is not None:
+            f["resolutions"][str(curr_resolution)].attrs.create("row_infos", row_infos)
+
+        f["resolutions"][str(curr_resolution)].create_group("chroms")
+        f["resolutions"][str(curr_resolution)].create_group("values")
+
+    write_chroms(f, chromsizes, resolutions)
+    if contigs:
+        chrom_sizes.write_contigs(f, contigs)
+
+
+def check_progress(f, progress, chromsizes, starting_resolution, resolutions):
+    """
+    Make the partial output of an interrupted conversion consistent with its
+    progress manifest: chromosomes whose zoom levels are not all complete are
+    removed from both, so that they are written again. The zoom levels of
+    chromosomes with finished batches of columns are kept.
+    """
+    if sorted(int(r) for r in f["resolutions"]) != sorted(resolutions):
+        raise ValueError("The resolutions of the output don't match the conversion")
+
+    for (chrom, length) in chromsizes:
+        unit = "chrom:" + chrom
+        num_rows = math.ceil(length / starting_resolution)
+
+        complete = True
+        for curr_resolution in resolutions:
+            values = f["resolutions"][str(curr_resolution)]["values"]
+            if chrom not in values or values[chrom].shape[0] != num_rows:
+                complete = False
+            num_rows = math.ceil(num_rows / 2)
+
+        batch_units = [u for u in progress.units if u.startswith(unit + ":batch:")]
+        if complete and (progress.is_done(unit) or batch_units):
+            continue
+
+        for batch_unit in batch_units:
+            progress.discard(batch_unit)
+
+        if progress.is_done(unit):
+            print("Chromosome {} is incomplete, converting it again".format(chrom))
+            progress.discard(unit)
 
-    f_out[chrom][batch_start_index : batch_start_index + len(batch)] = np.array(batch)
+        for curr_resolution in resolutions:
+            values = f["resolutions"][str(curr_resolution)]["values"]
+            if chrom in values:
+                del values[chrom]
+
+    progress.save()
+
+
+def prepare_update(f, chromsizes, starting_resolution):
+    """
+    Remove the datasets of the chromosomes that are rewritten by an
+    update of a multires file, at every resolution.
+
+    Returns
+    -------
+    {'dtype', 'compression', 'compression_opts', 'shuffle', 'chunk_rows',
+     'num_cols'}: the storage layout of the values datasets of the file,
+    for the new datasets
+
+    Raises
+    ------
+    ValueError if the starting resolution or a chromosome length doesn't
+    match the file
+    """
+    resolutions = sorted(int(r) for r in f["resolutions"])
+    if resolutions[0] != starting_resolution:
+        raise ValueError(
+            "The starting resolution of the file is {}, not {}".format(
+                resolutions[0], starting_resolution
+            )
+        )
+
+    file_chroms = dict(
+        zip([name.decode() for name in f["chroms"]["name"][:]], f["chroms"]["length"][:])
+    )
+    for (chrom, length) in chromsizes:
+        if file_chroms.get(chrom) != length:
+            raise ValueError("Chromosome {} of length {} is not in the file".format(chrom, length))
+
+    values = f["resolutions"][str(resolutions[0])]["values"]
+    sizes = dict(chromsizes)
+    datasets = [values[chrom] for chrom in values if chrom not in sizes]
+    datasets = datasets or [values[chrom] for chrom in values]
+    if not datasets:
+        raise ValueError("The file has no values to update")
+    template = max(datasets, key=lambda dataset: dataset.chunks[0])
+    layout = {
+        "dtype": template.dtype,
+        "compression": template.compression,
+        "compression_opts": template.compression_opts,
+        "shuffle": template.shuffle,
+        "chunk_rows": template.chunks[0],
+        "num_cols": template.shape[1],
+    }
+
+    for curr_resolution in resolutions:
+        values = f["resolutions"][str(curr_resolution)]["values"]
+        for (chrom, length) in chromsizes:
+            if chrom in values:
+                del values[chrom]
+    return layout
+
+
+def get_resolutions(chromsizes, starting_resolution=1, tile_size=1024):
+    """
+    The resolutions of the zoom levels of a multires file,
+    from the starting resolution to the coarsest one.
+
+    Parameters
+    ----------
+    chromsizes: [('chrom_key', size),...]
+    starting_resolution: int (default 1)
+    tile_size: int (default 1024)
+    """
+    # the maximum zoom level corresponds to the number of aggregations
+    # that need to be performed so that the entire extent of
+    # the dataset fits into one tile
+    total_length = sum(length for (chrom, length) in chromsizes)
+    # print("total_length:", total_length, "tile_size:", tile_size, "starting_resolution:", starting_resolution)
+    max_zoom = math.ceil(
+        math.log(total_length / (tile_size * starting_resolution)) / math.log(2)
+    )
+
+    # start with a resolution of 1 element per pixel and
+    # halve the number of elements at every zoom level
+    return [starting_resolution * 2 ** i for i in range(max(max_zoom, 0) + 1)]
 
 
 def create_multivec_multires(
@@ -148,6 +383,21 @@ def create_multivec_multires(
     tile_size=1024,
     output_file="/tmp/my_file.multires",
     row_infos=None,
+    compression_threads=None,
+    dtype="f4",
+    compression="gzip",
+    compression_opts=None,
+    shuffle=False,
+    chunk_rows=None,
+    zoom_data=None,
+    progress=None,
+    column_batches=None,
+    chrom_workers=None,
+    row_offsets=False,
+    update=False,
+    row_stats=False,
+    backend="hdf5",
+    contigs=None,
 ):
     """
     Create a multires file containing the array data
@@ -155,196 +405,1380 @@ def create_multivec_multires(
 
     Parameters
     ----------
-    array_data: {'chrom_key': np.array, }
-        The array data to aggregate organized by chromosome
+    array_data: {'chrom_key': np.array, } or h5py.File
+        The array data to aggregate organized by chromosome. Instead
+        of an array, each chromosome can also be given as an iterable
+        that yields consecutive chunks of rows, such as a generator
+        reading the data from its source.
     chromsizes: [('chrom_key', size),...]
-    agg: lambda
-        The function that will aggregate the data. Should
-        take an array as input and create another array of
-        roughly half the length
+    agg: str, [str, ...] or lambda
+        The aggregation of adjacent bins: the name of a built-in
+        aggregation ('sum', 'mean', 'max', 'min' or 'count'), a list
+        of names to store several statistics side by side, or a
+        function that takes an array as input and creates another
+        array of half the length
     starting_resolution: int (default 1)
         The starting resolution of the input data
     tile_size: int
         The tile size that we want higlass to use. This should
         depend on the size of the data but when in doubt, just use
         256.
+    compression_threads: int (default: the number of CPUs)
+        The number of threads that compress the chunks of the
+        values datasets while the next chunks are being read.
+    dtype: str (default 'f4')
+        The type of the stored values ('f2', 'f4' or 'f8'). The
+        aggregation is done with at least single precision.
+    compression: str (default 'gzip')
+        The codec of the values datasets: 'gzip', 'lzf' or None
+    compression_opts: int
+        The gzip compression level (default 4)
+    shuffle: bool (default False)
+        Whether to apply the HDF5 byte shuffle filter before compression
+    chunk_rows: int
+        The number of rows in a chunk of the values datasets. A chunk
+        always spans all of the columns. By default, a multiple of
+        tile_size that makes chunks of about CHUNK_BYTES.
+    zoom_data: {resolution: {'chrom_key': np.array, }, }
+        The values of a single zoom level, e.g. read from the summaries
+        of the input files, organized like array_data, with the columns
+        of every statistic of agg side by side. The zoom level is written
+        as it is, the coarser ones are aggregated from it (see
+        aggregation.SummaryPyramid) and only the finer ones from
+        array_data. Chromosomes that are only in zoom_data get empty
+        finer zoom levels.
+    progress: progress.Progress
+        The progress manifest of the conversion. Every chromosome is
+        recorded once all of its zoom levels are written, and the
+        chromosomes recorded by an interrupted conversion are skipped.
+    column_batches: [int, ...]
+        Build the multivec from consecutive batches of columns with this
+        many columns each, one batch after another, so that only the
+        columns of a single batch are held in memory. array_data[chrom]
+        is then a list with the source of every batch. The chunks of the
+        values datasets span as many columns as the largest batch, so
+        that each batch writes whole chunks.
+    chrom_workers: int (default None)
+        Build the zoom levels of this many chromosomes at once, each in
+        its own process and scratch file next to the output file. The
+        chunks of the scratch files are copied to the output without
+        being decoded again, so the output is the same as when the
+        chromosomes are built one after another. The chromosomes of
+        array_data are passed to the processes, so they have to be arrays
+        or functions without arguments that return the source of a
+        chromosome (or lists of them, with column_batches), and agg has
+        to be the name of an aggregation.
+    row_offsets: bool (default False)
+        The chromosomes of array_data are iterables of (start_row, rows)
+        pairs in increasing order instead of consecutive chunks of rows,
+        e.g. the windows of a few regions. Only the bins that cover the
+        given rows are aggregated and written, the others are empty.
+    update: bool (default False)
+        Rewrite the chromosomes of chromsizes in the existing output
+        file at every resolution, and keep its other chromosomes. The
+        chromosomes have to be in the file with the same lengths, and
+        the new datasets keep the storage layout of the file.
+    row_stats: bool (default False)
+        Store statistics of the columns of every resolution, see
+        write_row_stats. They are computed from the rows as they are
+        written, and the chromosomes that are not written here (the
+        other chromosomes of an update, or the ones of an interrupted
+        conversion) are read back once at the end. An update of a file
+        with statistics always updates them.
+    backend: str (default 'hdf5')
+        The output format: 'hdf5' for a multires HDF5 file (HDF5Output),
+        or 'flat' for a directory with a flat binary file of every
+        resolution that tiles can be memory-mapped from
+        (flatfile.FlatOutput). The flat output is compressed with zlib
+        unless compression is None, and it can't be built from
+        column_batches, resumed, updated or built with chrom_workers.
+    contigs: [('contig', 'chrom_key', start, size), ...]
+        The contigs that are laid out one after another in a chromosome
+        of chromsizes, e.g. the small contigs of an assembly that are
+        bucketed by chrom_sizes.filter_contigs. They are stored with the
+        chromosomes, see chrom_sizes.write_contigs.
+
+    Returns
+    -------
+    The open output: an h5py.File, or a flatfile.FlatOutput
     """
     filename = output_file
 
-    # this is just so we can run this code
-    # multiple times without h5py complaining
-    if op.exists(filename):
-        os.remove(filename)
+    # row_infos = None
+    if "row_infos" in getattr(array_data, "attrs", {}):
+        row_infos = array_data.attrs["row_infos"]
 
-    # this will be the file that contains our multires data
-    f = h5py.File(filename, "w")
+    pyramid = Pyramid(agg)
 
-    # store some metadata
-    f.create_group("info")
-    f["info"].attrs["tile-size"] = tile_size
+    # the rows are repeated for every statistic
+    if pyramid.names is not None and row_infos is not None:
+        row_infos = np.concatenate([row_infos] * len(pyramid.names))
 
-    f.create_group("resolutions")
-    f.create_group("chroms")
+    chroms, lengths = zip(*chromsizes)
+    resolutions = get_resolutions(chromsizes, starting_resolution, tile_size)
+
+    if update and progress is not None:
+        raise ValueError("An update of a file can not be resumed")
+    if backend not in ("hdf5", "flat"):
+        raise ValueError("Unknown output backend {}".format(backend))
+    if backend == "flat" and (
+        progress is not None or update or column_batches is not None
+        or (chrom_workers is not None and chrom_workers > 1)
+    ):
+        raise ValueError(
+            "The flat backend is written in one pass, without batches of columns, "
+            "chromosome workers, resuming or updates"
+        )
 
-    # start with a resolution of 1 element per pixel
-    curr_resolution = starting_resolution
+    # continue an interrupted conversion
+    f = progress.open_output() if progress is not None else None
+    if update:
+        f = h5py.File(filename, "r+")
+        resolutions = sorted(int(r) for r in f["resolutions"])
+        tile_size = int(f["info"].attrs["tile-size"])
+        layout = prepare_update(f, chromsizes, starting_resolution)
+        (dtype, compression, compression_opts, shuffle, chunk_rows) = (
+            layout["dtype"],
+            layout["compression"],
+            layout["compression_opts"],
+            layout["shuffle"],
+            layout["chunk_rows"],
+        )
+        row_stats = row_stats or "row_stats" in f["resolutions"][str(resolutions[0])]
+    elif f is not None:
+        check_progress(f, progress, chromsizes, starting_resolution, resolutions)
+    elif backend == "hdf5":
+        if progress is not None:
+            progress.reset()
+
+        # this is just so we can run this code
+        # multiple times without h5py complaining
+        if op.exists(filename):
+            os.remove(filename)
+
+        # this will be the file that contains our multires data
+        f = h5py.File(filename, "w")
+        create_layout(f, chromsizes, resolutions, tile_size, row_infos, pyramid.names, contigs)
+
+    # chunks are compressed in these threads while the next ones are read
+    pool = ThreadPoolExecutor(compression_threads or os.cpu_count())
+
+    if backend == "flat":
+        output = flatfile.FlatOutput(
+            filename,
+            chromsizes,
+            starting_resolution,
+            resolutions,
+            tile_size,
+            row_infos,
+            pyramid.names,
+            dtype,
+            None if compression is None else "zlib",
+            compression_opts,
+            pool,
+            contigs,
+        )
+    else:
+        output = HDF5Output(f)
+
+    # the zoom levels that are read from elsewhere instead of
+    # being aggregated from the data
+    zoom_data = zoom_data or {}
+    if len(zoom_data) > 1:
+        raise ValueError("The zoom data has more than one resolution")
+    zoom_resolution = min(zoom_data, default=None)
+    if zoom_resolution is not None and zoom_resolution not in resolutions:
+        raise ValueError("Missing zoom data for resolution {}".format(zoom_resolution))
+    num_pyramid_levels = len([r for r in resolutions if r < (zoom_resolution or math.inf)])
+    for curr_resolution in resolutions[num_pyramid_levels:]:
+        output.mark_zoom_data(curr_resolution)
+
+    # the statistics of the columns of every resolution, and the
+    # chromosomes that were added to them
+    stats = {}
+    built = set()
+
+    def resolution_stats(num_cols):
+        for curr_resolution in resolutions:
+            if curr_resolution not in stats:
+                stats[curr_resolution] = rowstats.RowStats(num_cols)
+            elif stats[curr_resolution].num_cols != num_cols:
+                raise ValueError(
+                    "Chromosome {} has {} columns, the other chromosomes have {}".format(
+                        chrom, num_cols, stats[curr_resolution].num_cols
+                    )
+                )
+        return [stats[curr_resolution] for curr_resolution in resolutions]
+
+    # the zoom levels of the chromosomes that are built in other processes
+    pyramid_jobs = {}
+    if chrom_workers is not None and chrom_workers > 1:
+        scratch = tempfile.TemporaryDirectory(
+            prefix=op.basename(filename) + ".",
+            suffix=".scratch",
+            dir=op.dirname(op.abspath(filename)),
+        )
+        chrom_pool = ProcessPoolExecutor(chrom_workers)
+        for (index, (chrom, length)) in enumerate(chromsizes):
+            if chrom not in array_data:
+                continue
+            if progress is not None and progress.is_done("chrom:" + chrom):
+                continue
+            pyramid_jobs[chrom] = chrom_pool.submit(
+                build_scratch_pyramid,
+                op.join(scratch.name, "{}.h5".format(index)),
+                array_data[chrom],
+                math.ceil(length / starting_resolution),
+                num_pyramid_levels,
+                agg,
+                dtype,
+                compression,
+                compression_opts,
+                shuffle,
+                tile_size,
+                chunk_rows,
+                column_batches,
+                max(1, (compression_threads or os.cpu_count()) // chrom_workers),
+                row_offsets,
+                row_stats,
+            )
 
-    # this will be our sample highest-resolution array
-    # and it will be stored under the resolutions['1']
-    # dataset
-    f["resolutions"].create_group(str(curr_resolution))
+    # add the data
+    for chrom, length in zip(chroms, lengths):
+        unit = "chrom:" + chrom
+        if progress is not None and progress.is_done(unit):
+            continue
 
-    chroms, lengths = zip(*chromsizes)
-    chrom_array = np.array(chroms, dtype="S")
+        zoom_source = zoom_data[zoom_resolution].get(chrom) if zoom_data else None
+        if chrom not in array_data and zoom_source is None:
+            print("Missing chrom {} in input file".format(chrom), file=sys.stderr)
+            continue
 
-    # row_infos = None
-    if "row_infos" in array_data.attrs:
-        row_infos = array_data.attrs["row_infos"]
+        num_bins = math.ceil(length / starting_resolution)
 
-    # add the chromosome information
-    if row_infos is not None:
-        f["resolutions"][str(curr_resolution)].attrs.create("row_infos", row_infos)
-
-    f["resolutions"][str(curr_resolution)].create_group("chroms")
-    f["resolutions"][str(curr_resolution)].create_group("values")
-    f["resolutions"][str(curr_resolution)]["chroms"].create_dataset(
-        "name",
-        shape=(len(chroms),),
-        dtype=chrom_array.dtype,
-        data=chrom_array,
-        compression="gzip",
-    )
-    f["resolutions"][str(curr_resolution)]["chroms"].create_dataset(
-        "length", shape=(len(chroms),), data=lengths, compression="gzip"
-    )
+        first_zoom_chunk = None
+        scratch_file = None
+        if chrom in pyramid_jobs:
+            with instrument.stage("pyramid-wait"):
+                job_result = pyramid_jobs.pop(chrom).result()
+            if job_result is None:
+                print("Empty chrom {} in input file".format(chrom), file=sys.stderr)
+                continue
+            (scratch_file, scratch_stats) = job_result
+            with h5py.File(scratch_file, "r") as f_scratch:
+                shape = f_scratch["0"].shape
+        elif column_batches is not None:
+            # the batches are only read once the datasets exist
+            shape = (num_bins, pyramid.num_columns(sum(column_batches)))
+        elif chrom in array_data:
+            chunks = iter_chunks(array_data[chrom], STANDARD_CHUNK_SIZE)
+
+            # the number of columns is only known once we have some data
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                print("Empty chrom {} in input file".format(chrom), file=sys.stderr)
+                continue
 
-    f["chroms"].create_dataset(
-        "name",
-        shape=(len(chroms),),
-        dtype=chrom_array.dtype,
-        data=chrom_array,
-        compression="gzip",
-    )
-    f["chroms"].create_dataset(
-        "length", shape=(len(chroms),), data=lengths, compression="gzip"
-    )
+            if hasattr(array_data[chrom], "shape"):
+                shape = array_data[chrom].shape
+            elif row_offsets:
+                shape = (num_bins,) + first_chunk[1].shape[1:]
+            else:
+                shape = (num_bins,) + first_chunk.shape[1:]
+            shape = (shape[0], pyramid.num_columns(shape[1]))
+        else:
+            # only the zoom data is available, the other
+            # zoom levels are left empty
+            first_zoom_chunks = iter_chunks(zoom_source, STANDARD_CHUNK_SIZE)
+            first_zoom_chunk = next(first_zoom_chunks)
+            shape = (num_bins,) + first_zoom_chunk.shape[1:]
+
+        if update and shape[1] != layout["num_cols"]:
+            raise ValueError(
+                "Chromosome {} has {} columns, the file has {}".format(
+                    chrom, shape[1], layout["num_cols"]
+                )
+            )
 
-    # add the data
-    for chrom, length in zip(chroms, lengths):
-        if chrom not in array_data:
-            print("Missing chrom {} in input file".format(chrom), file=sys.stderr)
+        # each subsequent zoom level will have half as much data
+        # as the previous
+        datasets = []
+        for curr_resolution in resolutions:
+            datasets += [output.values(
+                curr_resolution,
+                chrom,
+                shape,
+                dtype=dtype,
+                tile_size=tile_size,
+                chunk_rows=chunk_rows,
+                chunk_cols=max(column_batches) if column_batches is not None else None,
+                compression=compression,
+                compression_opts=compression_opts,
+                shuffle=shuffle,
+                # the zoom levels that were built elsewhere are copied as a whole
+                replace=scratch_file is not None,
+            )]
+            shape = (math.ceil(shape[0] / 2),) + shape[1:]
+
+        # the batches of columns that were written before
+        skip = [
+            batch for batch in range(len(column_batches or []))
+            if progress is not None and progress.is_done("{}:batch:{}".format(unit, batch))
+        ]
+
+        # the statistics of every zoom level, unless some of the rows were
+        # written before, then they are read back at the end
+        chrom_stats = [None] * len(resolutions)
+        if row_stats and (not skip or scratch_file is not None):
+            chrom_stats = resolution_stats(datasets[0].shape[1])
+            built.add(chrom)
+
+        if scratch_file is not None:
+            with h5py.File(scratch_file, "r") as f_scratch, \
+                    instrument.stage("merge") as counters:
+                for level in range(num_pyramid_levels):
+                    counters["bytes_copied"] += copy_chunks(f_scratch[str(level)], datasets[level])
+                    if row_stats:
+                        chrom_stats[level].merge(scratch_stats[level])
+            os.remove(scratch_file)
+
+        elif column_batches is not None and chrom in array_data:
+            def batch_done(batch):
+                if progress is not None:
+                    f.flush()
+                    progress.mark_done("{}:batch:{}".format(unit, batch))
+
+            write_column_batches(
+                datasets[:num_pyramid_levels],
+                array_data[chrom],
+                column_batches,
+                pyramid,
+                dtype,
+                pool,
+                skip=skip,
+                on_done=batch_done,
+                row_offsets=row_offsets,
+                stats=None if skip else chrom_stats,
+            )
+
+        # read every chunk of the base resolution only once and
+        # compute all of the other zoom levels from it in memory
+        elif chrom in array_data:
+            write_pyramid(
+                [
+                    output.writer(dataset, pool, stats=chrom_stats[level])
+                    for (level, dataset) in enumerate(datasets[:num_pyramid_levels])
+                ],
+                itertools.chain([first_chunk], chunks),
+                pyramid,
+                dtype,
+                row_offsets,
+            )
+
+        # the zoom data and the zoom levels above it
+        if zoom_source is not None:
+            if first_zoom_chunk is not None:
+                zoom_chunks = itertools.chain([first_zoom_chunk], first_zoom_chunks)
+            else:
+                zoom_chunks = iter_chunks(zoom_source, STANDARD_CHUNK_SIZE)
+            write_pyramid(
+                [
+                    output.writer(dataset, pool, stats=chrom_stats[level])
+                    for (level, dataset) in enumerate(datasets)
+                    if level >= num_pyramid_levels
+                ],
+                zoom_chunks,
+                SummaryPyramid(agg),
+                dtype,
+            )
+
+        if progress is not None:
+            f.flush()
+            for batch in range(len(column_batches or [])):
+                progress.discard("{}:batch:{}".format(unit, batch))
+            progress.mark_done(unit, datasets[0].shape[1])
+
+    f = output.finish(stats if row_stats else None, built)
+
+    pool.shutdown()
+    if chrom_workers is not None and chrom_workers > 1:
+        chrom_pool.shutdown()
+        scratch.cleanup()
+    return f
+
+
+class HDF5Output:
+    """
+    The values of a multires HDF5 file, in the datasets
+    resolutions/<res>/values/<chrom>: the default output backend of
+    create_multivec_multires.
+
+    An output backend stores the zoom levels of the chromosomes:
+
+    - values(resolution, chrom, shape, **layout) returns the storage of
+      the rows of a chromosome at a resolution, an object with a shape
+    - writer(values, pool, col_offset=0, num_cols=None, stats=None)
+      returns a writer that appends rows to it, see ChunkWriter
+    - mark_zoom_data(resolution) records that the rows of a resolution
+      were given instead of aggregated
+    - finish(stats, built) stores the statistics of the resolutions,
+      see write_row_stats, and returns the open output
+
+    flatfile.FlatOutput is the other backend.
+
+    Parameters
+    ----------
+    f: h5py.File
+        A multires file with the layout of create_layout
+    """
+
+    def __init__(self, f):
+        self.f = f
+        # the values group of every resolution
+        self.groups = {}
+
+    def values(self, resolution, chrom, shape, dtype="f4", tile_size=1024, chunk_rows=None,
+               chunk_cols=None, compression="gzip", compression_opts=None, shuffle=False,
+               replace=False):
+        """
+        The values dataset of a chromosome at a resolution, which is
+        created unless it exists, e.g. the datasets of a partly converted
+        chromosome are kept. With replace, an existing dataset is removed
+        first. See create_values_dataset for the layout.
+        """
+        if resolution not in self.groups:
+            self.groups[resolution] = self.f["resolutions"][str(resolution)]["values"]
+        values = self.groups[resolution]
+        if replace and chrom in values:
+            del values[chrom]
+        if chrom in values:
+            return values[chrom]
+        return create_values_dataset(
+            values,
+            str(chrom),
+            shape,
+            dtype,
+            tile_size,
+            chunk_rows,
+            chunk_cols,
+            compression,
+            compression_opts,
+            shuffle,
+        )
+
+    def writer(self, values, pool, col_offset=0, num_cols=None, stats=None):
+        return ChunkWriter(values, pool, col_offset=col_offset, num_cols=num_cols, stats=stats)
+
+    def mark_zoom_data(self, resolution):
+        self.f["resolutions"][str(resolution)].attrs["source"] = "zoom-data"
+
+    def finish(self, stats=None, built=()):
+        if stats is not None:
+            write_row_stats(self.f, stats, built)
+        return self.f
+
+
+def write_row_stats(f, stats=None, built=()):
+    """
+    Store the statistics of the columns of every resolution of a
+    multires file in the group resolutions/<res>/row_stats: the datasets
+    'count', 'sum', 'min', 'max', 'mean' and 'nan_fraction' with a value
+    for every column and 'quantiles' with the estimated
+    rowstats.QUANTILES of every column.
+    The attributes 'min' and 'max' of the group are the range of all of
+    the columns.
+
+    Parameters
+    ----------
+    f: h5py.File
+        A multires file opened for writing
+    stats: {resolution: rowstats.RowStats, }
+        The statistics of the chromosomes of built, e.g. computed while
+        they were written
+    built: [str, ...]
+        The chromosomes that are in stats. The values of the other
+        chromosomes are read from the file.
+    """
+    stats = stats or {}
+
+    for curr_resolution in sorted(int(r) for r in f["resolutions"]):
+        group = f["resolutions"][str(curr_resolution)]
+        values = group["values"]
+        datasets = [values[chrom] for chrom in values]
+        if not datasets:
             continue
 
-        # print("creating new dataset")
-        f["resolutions"][str(curr_resolution)]["values"].create_dataset(
-            str(chrom), array_data[chrom].shape, compression="gzip"
+        with instrument.stage("row-stats") as counters:
+            resolution_stats = stats.get(curr_resolution)
+            if resolution_stats is None:
+                resolution_stats = rowstats.RowStats(datasets[0].shape[1])
+            for chrom in values:
+                if chrom not in built:
+                    resolution_stats.merge(rowstats.scan(values[chrom]))
+                    counters["rows_read"] += len(values[chrom])
+
+            resolution_stats.write(group, sum(len(dataset) for dataset in datasets))
+
+
+def create_values_dataset(
+    group,
+    name,
+    shape,
+    dtype,
+    tile_size,
+    chunk_rows=None,
+    chunk_cols=None,
+    compression="gzip",
+    compression_opts=None,
+    shuffle=False,
+):
+    """
+    Create an empty (NaN) values dataset of a zoom level,
+    see create_multivec_multires for the parameters.
+    """
+    return group.create_dataset(
+        name,
+        shape,
+        dtype=dtype,
+        chunks=chunk_shape(shape, tile_size, np.dtype(dtype).itemsize, chunk_rows, chunk_cols),
+        maxshape=(None, None),
+        fillvalue=np.nan,
+        compression=compression,
+        compression_opts=compression_opts,
+        shuffle=shuffle,
+    )
+
+
+def write_column_batches(
+    datasets, sources, column_batches, pyramid, dtype, pool, skip=(), on_done=None,
+    row_offsets=False, stats=None
+):
+    """
+    Write the zoom levels of the batches of columns of a chromosome, one
+    batch after another. The columns of each statistic of a batch are
+    written to the same columns of the datasets.
+
+    Parameters
+    ----------
+    datasets: [h5py.Dataset, ...]
+        The datasets of the aggregated zoom levels, starting with the
+        base resolution
+    sources: [np.array or iterable of arrays, ...]
+        The base resolution of every batch
+    column_batches, pyramid, dtype, pool, row_offsets: see create_multivec_multires
+    skip: [int, ...]
+        The batches that were already written
+    on_done: function
+        Called with the index of every batch once it is written
+    stats: [rowstats.RowStats, ...]
+        The statistics of each dataset that the written rows are added to
+    """
+    num_cols = sum(column_batches)
+    num_stats = pyramid.num_columns(1)
+    col_offset = 0
+
+    for (batch, batch_cols) in enumerate(column_batches):
+        if batch not in skip:
+            writers = [
+                SplitWriter([
+                    ChunkWriter(
+                        dataset,
+                        pool,
+                        col_offset=stat * num_cols + col_offset,
+                        num_cols=batch_cols,
+                        stats=stats[level] if stats is not None else None,
+                    )
+                    for stat in range(num_stats)
+                ])
+                for (level, dataset) in enumerate(datasets)
+            ]
+            write_pyramid(
+                writers,
+                iter_chunks(sources[batch], STANDARD_CHUNK_SIZE),
+                pyramid,
+                dtype,
+                row_offsets,
+            )
+
+            if on_done is not None:
+                on_done(batch)
+        col_offset += batch_cols
+
+
+def build_scratch_pyramid(
+    scratch_file,
+    source,
+    num_bins,
+    num_levels,
+    agg,
+    dtype,
+    compression,
+    compression_opts,
+    shuffle,
+    tile_size,
+    chunk_rows,
+    column_batches,
+    compression_threads,
+    row_offsets=False,
+    row_stats=False,
+):
+    """
+    Build the aggregated zoom levels of one chromosome in a scratch file,
+    in the datasets '0' (the base resolution), '1', ... with the layout of
+    the values datasets of create_multivec_multires.
+
+    Parameters
+    ----------
+    scratch_file: str
+    source: the chromosome of array_data, see create_multivec_multires
+    num_bins: int
+        The number of rows of the base resolution
+    num_levels: int
+        The number of zoom levels that are aggregated
+    the others: see create_multivec_multires
+
+    Returns
+    -------
+    The path of the scratch file and the statistics of every zoom level
+    (None without row_stats), or None if the chromosome has no data
+    """
+    def resolve(source):
+        return source() if callable(source) else source
+
+    pyramid = Pyramid(agg)
+    pool = ThreadPoolExecutor(compression_threads)
+
+    if column_batches is not None:
+        sources = [resolve(batch) for batch in source]
+        shape = (num_bins, pyramid.num_columns(sum(column_batches)))
+    else:
+        source = resolve(source)
+        chunks = iter_chunks(source, STANDARD_CHUNK_SIZE)
+        first_chunk = next(chunks, None)
+        if first_chunk is None:
+            return None
+        if hasattr(source, "shape"):
+            shape = source.shape
+        else:
+            shape = (num_bins,) + (first_chunk[1] if row_offsets else first_chunk).shape[1:]
+        shape = (shape[0], pyramid.num_columns(shape[1]))
+
+    with h5py.File(scratch_file, "w") as f:
+        datasets = []
+        for level in range(num_levels):
+            datasets += [create_values_dataset(
+                f,
+                str(level),
+                shape,
+                dtype,
+                tile_size,
+                chunk_rows,
+                max(column_batches) if column_batches is not None else None,
+                compression,
+                compression_opts,
+                shuffle,
+            )]
+            shape = (math.ceil(shape[0] / 2),) + shape[1:]
+
+        stats = [rowstats.RowStats(shape[1]) for _ in datasets] if row_stats else None
+        if column_batches is not None:
+            write_column_batches(
+                datasets,
+                sources,
+                column_batches,
+                pyramid,
+                dtype,
+                pool,
+                row_offsets=row_offsets,
+                stats=stats,
+            )
+        else:
+            write_pyramid(
+                [
+                    ChunkWriter(dataset, pool, stats=stats[level] if row_stats else None)
+                    for (level, dataset) in enumerate(datasets)
+                ],
+                itertools.chain([first_chunk], chunks),
+                pyramid,
+                dtype,
+                row_offsets,
+            )
+
+    pool.shutdown()
+    return (scratch_file, stats)
+
+
+def copy_chunks(source, dataset):
+    """
+    Copy the stored chunks of a dataset to a dataset with the same shape,
+    chunks and filters as they are, without decoding them. Chunks that
+    were never written are left out.
+
+    Returns
+    -------
+    The number of bytes copied
+    """
+    offsets = []
+    try:
+        source.id.chunk_iter(lambda info: offsets.append(info.chunk_offset))
+    except (AttributeError, NotImplementedError):
+        # HDF5 before 1.12.3
+        offsets = [
+            source.id.get_chunk_info(index).chunk_offset
+            for index in range(source.id.get_num_chunks())
+        ]
+
+    num_bytes = 0
+    for offset in offsets:
+        (filter_mask, data) = source.id.read_direct_chunk(offset)
+        dataset.id.write_direct_chunk(offset, data, filter_mask)
+        num_bytes += len(data)
+    return num_bytes
+
+
+# the approximate size of an uncompressed chunk of a values dataset
+CHUNK_BYTES = 1 << 20
+
+
+def chunk_shape(shape, tile_size=256, itemsize=4, chunk_rows=None, chunk_cols=None):
+    """
+    The chunk shape of a values dataset: blocks of whole rows, or of
+    chunk_cols columns, aligned to tiles, of about CHUNK_BYTES each
+    unless chunk_rows is given.
+    """
+    num_cols = shape[1] if chunk_cols is None else min(chunk_cols, shape[1])
+
+    if chunk_rows is None:
+        row_bytes = itemsize * num_cols
+        num_tiles = max(1, CHUNK_BYTES // (row_bytes * tile_size))
+        chunk_rows = num_tiles * tile_size
+
+    return (min(chunk_rows, shape[0]), num_cols)
+
+
+class ChunkWriter:
+    """
+    Append rows to a chunked, gzip-compressed dataset.
+
+    Every complete chunk is compressed in a thread pool and committed
+    in order with write_direct_chunk, so that HDF5 does not compress
+    the chunks one after another while we wait.
+
+    The rows can also be written to a range of columns of the dataset,
+    e.g. the columns of a batch of input files. If the range is aligned
+    with the chunks, the chunks of the range are written as a whole.
+    Otherwise, the rows are written through h5py, which has to read and
+    rewrite the chunks that are only partly covered.
+
+    Chunks that only contain the fill value of the dataset are not
+    written at all, so HDF5 doesn't allocate them and returns the
+    fill value when they are read.
+
+    Only gzip, the shuffle filter and uncompressed datasets can be
+    encoded here. Chunks of datasets with other filters (e.g. lzf)
+    are written through h5py.
+
+    Parameters
+    ----------
+    dataset: h5py.Dataset
+    pool: concurrent.futures.ThreadPoolExecutor
+    max_pending: int
+        The number of chunks that can be compressed at once
+    col_offset: int (default 0)
+        The first column that is written
+    num_cols: int (default: the columns after col_offset)
+        The number of columns of the appended rows
+    stats: rowstats.RowStats
+        Statistics of the columns of the dataset that the appended
+        rows are added to, as they are stored
+    """
+
+    def __init__(self, dataset, pool, max_pending=16, col_offset=0, num_cols=None, stats=None):
+        if num_cols is None:
+            num_cols = dataset.shape[1] - col_offset
+
+        self.dataset = dataset
+        self.pool = pool
+        self.max_pending = max_pending
+        self.col_offset = col_offset
+        self.num_cols = num_cols
+        self.stats = stats
+        self.chunk_rows, self.chunk_cols = dataset.chunks
+        self.fillvalue = dataset.fillvalue
+
+        self.aligned = col_offset % self.chunk_cols == 0 and (
+            num_cols % self.chunk_cols == 0 or col_offset + num_cols == dataset.shape[1]
         )
-        standard_chunk_size = 1e5
-        start = 0
-        chrom_data = f["resolutions"][str(curr_resolution)]["values"][chrom]
+        self.encode = chunk_encoder(dataset) if self.aligned else None
+
+        self.buffer = np.empty((self.chunk_rows, num_cols), dtype=dataset.dtype)
+        self.buffered = 0
+        self.position = 0
+        self.pending = collections.deque()
+
+    def seek(self, row):
+        """
+        Continue appending at a row after the appended ones. The rows in
+        between keep their stored values.
+        """
+        if row == self.position + self.buffered:
+            return
+        if row < self.position + self.buffered:
+            raise ValueError(
+                "Can not write row {} after row {}".format(row, self.position + self.buffered)
+            )
+
+        if row >= self.position + self.chunk_rows:
+            if self.buffered > 0:
+                self.read_rows(self.buffered, self.chunk_rows)
+                self.submit()
+            self.position = row - row % self.chunk_rows
 
-        chunk_size = int(min(standard_chunk_size, len(chrom_data)))
-        # print("array_data.shape", array_data[chrom].shape)
+        self.read_rows(self.buffered, row - self.position)
+        self.buffered = row - self.position
 
-        while start < len(chrom_data):
-            # see above section
-            chrom_data[start : start + chunk_size] = array_data[chrom][
-                start : start + chunk_size
+    def read_rows(self, start, end):
+        """
+        Fill the rows [start, end) of the buffer with the stored rows
+        of the dataset, or the fill value beyond its end.
+        """
+        num_stored = max(0, min(end, len(self.dataset) - self.position) - start)
+        if num_stored > 0:
+            self.buffer[start : start + num_stored] = self.dataset[
+                self.position + start : self.position + start + num_stored,
+                self.col_offset : self.col_offset + self.num_cols,
             ]
-            start += int(min(standard_chunk_size, len(array_data[chrom]) - start))
+        self.buffer[start + num_stored : end] = self.fillvalue
+
+    def append(self, data):
+        while len(data) > 0:
+            num_rows = min(self.chunk_rows - self.buffered, len(data))
+            self.buffer[self.buffered : self.buffered + num_rows] = data[:num_rows]
+            if self.stats is not None:
+                with instrument.stage("row-stats"):
+                    self.stats.add(
+                        self.buffer[self.buffered : self.buffered + num_rows], self.col_offset
+                    )
+            self.buffered += num_rows
+            data = data[num_rows:]
+
+            if self.buffered == self.chunk_rows:
+                self.submit()
+
+    def submit(self):
+        end = min(self.position + self.chunk_rows, len(self.dataset))
+        step = self.chunk_cols if self.aligned else self.num_cols
+
+        for start_col in range(0, self.num_cols, step):
+            chunk = self.buffer[:, start_col : start_col + step]
+            col = self.col_offset + start_col
+            if is_fill(chunk, self.fillvalue):
+                instrument.add("write-chunks", chunks_skipped=1)
+                continue
 
-    # the maximum zoom level corresponds to the number of aggregations
-    # that need to be performed so that the entire extent of
-    # the dataset fits into one tile
-    total_length = sum(lengths)
-    # print("total_length:", total_length, "tile_size:", tile_size, "starting_resolution:", starting_resolution)
-    max_zoom = math.ceil(
-        math.log(total_length / (tile_size * starting_resolution)) / math.log(2)
-    )
+            if self.encode is None:
+                with instrument.stage("write-chunks") as counters:
+                    self.dataset[self.position : end, col : col + chunk.shape[1]] = \
+                        chunk[: end - self.position]
+                    counters["bytes_in"] += chunk.nbytes
+                continue
 
-    # we're going to go through and create the data for the different
-    # zoom levels by summing adjacent data points
-    prev_resolution = curr_resolution
+            if chunk.shape[1] < self.chunk_cols:
+                # the edge chunk of the columns
+                padding = np.full(
+                    (self.chunk_rows, self.chunk_cols - chunk.shape[1]),
+                    self.fillvalue,
+                    dtype=chunk.dtype,
+                )
+                chunk = np.concatenate((chunk, padding), axis=1)
+            self.pending.append(
+                ((self.position, col), self.pool.submit(self.compress, np.ascontiguousarray(chunk)))
+            )
+        self.position += self.chunk_rows
+
+        self.buffer = np.empty((self.chunk_rows, self.num_cols), dtype=self.dataset.dtype)
+        self.buffered = 0
+        self.commit(len(self.pending) > self.max_pending)
+
+    def compress(self, chunk):
+        with instrument.stage("compress") as counters:
+            data = self.encode(chunk)
+            counters["bytes_in"] += chunk.nbytes
+            counters["bytes_out"] += len(data)
+        return data
+
+    def commit(self, wait=False):
+        # the chunks are written in the order they were submitted
+        while self.pending and (wait or self.pending[0][1].done()):
+            (offsets, future) = self.pending.popleft()
+            data = future.result()
+            with instrument.stage("write-chunks") as counters:
+                self.dataset.id.write_direct_chunk(offsets, data)
+                counters["bytes_written"] += len(data)
+            wait = wait and len(self.pending) > self.max_pending
+
+    def close(self):
+        if self.buffered > 0:
+            # the edge chunk is stored in full, the rows
+            # beyond the end of the dataset are ignored
+            self.read_rows(self.buffered, self.chunk_rows)
+            self.submit()
+
+        while self.pending:
+            self.commit(True)
+
+
+class SplitWriter:
+    """
+    Split appended rows into equal groups of columns, e.g. the columns of
+    each statistic, and append each group with its own writer.
+    """
 
-    for i in range(max_zoom):
-        # each subsequent zoom level will have half as much data
-        # as the previous
-        curr_resolution = prev_resolution * 2
-        f["resolutions"].create_group(str(curr_resolution))
+    def __init__(self, writers):
+        self.writers = writers
 
-        # add information about each of the rows
-        if row_infos is not None:
-            f["resolutions"][str(curr_resolution)].attrs.create("row_infos", row_infos)
+    def append(self, data):
+        num_cols = data.shape[1] // len(self.writers)
+        for (index, writer) in enumerate(self.writers):
+            writer.append(data[:, index * num_cols : (index + 1) * num_cols])
 
-        f["resolutions"][str(curr_resolution)].create_group("chroms")
-        f["resolutions"][str(curr_resolution)].create_group("values")
-        f["resolutions"][str(curr_resolution)]["chroms"].create_dataset(
-            "name",
-            shape=(len(chroms),),
-            dtype=chrom_array.dtype,
-            data=chrom_array,
-            compression="gzip",
+    def seek(self, row):
+        for writer in self.writers:
+            writer.seek(row)
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+
+
+def is_fill(data, fillvalue):
+    """
+    Whether all of the values of an array are the fill value.
+    """
+    if np.isnan(fillvalue):
+        return bool(np.isnan(data).all())
+    return bool((data == fillvalue).all())
+
+
+def chunk_encoder(dataset):
+    """
+    A function that encodes an array the way the filter pipeline
+    of the dataset would, or None if we can't do that ourselves.
+    """
+    if dataset.compression not in ("gzip", None):
+        return None
+    if dataset.scaleoffset is not None or dataset.fletcher32:
+        return None
+
+    itemsize = dataset.dtype.itemsize
+    level = dataset.compression_opts
+
+    def encode(chunk):
+        if dataset.shuffle:
+            # all of the first bytes of the elements, then all of the second ...
+            chunk = chunk.reshape(-1).view(np.uint8).reshape(-1, itemsize).T.copy()
+        if dataset.compression == "gzip":
+            return zlib.compress(chunk, level)
+        return chunk.tobytes()
+
+    return encode
+
+
+def write_pyramid(writers, chunks, pyramid, dtype="f4", row_offsets=False):
+    """
+    Write the base resolution and all of the zoom levels of
+    one chromosome in a single pass over its data.
+
+    Parameters
+    ----------
+    writers: [ChunkWriter, ...]
+        The writers of each zoom level, starting with the base
+        resolution. Each one takes half as many rows as the previous.
+    chunks: iterable of arrays
+        Consecutive chunks of rows of the base resolution, or
+        (start_row, rows) pairs in increasing order with row_offsets
+    pyramid: aggregation.Pyramid
+        The aggregation of pairs of adjacent rows
+    dtype: str (default 'f4')
+        The type the values are stored as
+    row_offsets: bool (default False)
+        Whether every chunk is given with the index of its first row.
+        The rows between the chunks are empty and are skipped, so only
+        the bins that cover the given rows are aggregated and written.
+    """
+    # a row that could not be paired with the next one yet and
+    # its index, for every level
+    carries = [None] * len(writers)
+    # the state of an empty row
+    empty = []
+
+    def flush(level):
+        # the carried row is paired with an empty row
+        (row, state) = carries[level]
+        carries[level] = None
+        push(level + 1, row // 2, pyramid.reduce_last(state))
+
+    def push(level, start, state):
+        with instrument.stage("aggregate/level-{}".format(level)):
+            values = pyramid.finalize(state)
+        with instrument.stage("write/level-{}".format(level)) as counters:
+            if row_offsets:
+                writers[level].seek(start)
+            writers[level].append(values)
+            counters["rows"] += len(values)
+
+        if level + 1 == len(writers):
+            return
+
+        if carries[level] is not None:
+            if carries[level][0] + 1 == start:
+                state = np.concatenate((carries[level][1], state))
+                start -= 1
+                carries[level] = None
+            else:
+                flush(level)
+
+        if start % 2 != 0:
+            # the first row is paired with the empty row before it
+            state = np.concatenate((empty[0], state))
+            start -= 1
+
+        if len(state) % 2 != 0:
+            carries[level] = (start + len(state) - 1, state[-1:].copy())
+            state = state[:-1]
+
+        if len(state) > 0:
+            with instrument.stage("aggregate/level-{}".format(level + 1)):
+                state = pyramid.reduce(state)
+            push(level + 1, start // 2, state)
+
+    start = 0
+    for chunk in chunks:
+        if row_offsets:
+            (start, chunk) = chunk
+
+        # aggregate the values as they are stored
+        with instrument.stage("aggregate/level-0"):
+            chunk = np.array(chunk, dtype=dtype)
+            state = pyramid.init(chunk.astype(np.float64))
+            if not empty:
+                empty.append(pyramid.init(np.full((1,) + chunk.shape[1:], np.nan)))
+        push(0, start, state)
+        start += len(chunk)
+
+    # the odd rows at the end of each level
+    for level in range(len(writers) - 1):
+        if carries[level] is not None:
+            flush(level)
+
+    with instrument.stage("write/close"):
+        for writer in writers:
+            writer.close()
+
+
+class ColumnAppender:
+    """
+    Append rows of new columns to a values dataset of a multires file.
+
+    If the dataset can be resized and holds a single statistic, the new
+    columns are added in place. Otherwise the dataset is rewritten with
+    the columns of each statistic side by side: the existing columns are
+    copied as they are and the new ones are added after them. Missing
+    rows and columns are empty: NaN, or the fill value of their statistic.
+
+    Parameters
+    ----------
+    group: h5py.Group
+        The values group of a resolution
+    chrom: str
+    num_rows: int
+        The number of rows after appending
+    num_old: int
+        The number of existing columns of each statistic
+    num_new: int
+        The number of new columns of each statistic
+    num_stats: int
+        The number of statistics stored side by side
+    template: h5py.Dataset
+        A values dataset with the storage layout of the new datasets
+    pool: concurrent.futures.ThreadPoolExecutor
+    fill_values: [float, ...] (default: NaN for every statistic)
+        The value of the missing rows and columns of each statistic, e.g.
+        0 for a count
+    """
+
+    def __init__(
+        self, group, chrom, num_rows, num_old, num_new, num_stats, template, pool,
+        fill_values=None
+    ):
+        self.group = group
+        self.chrom = chrom
+        self.num_rows = num_rows
+        self.num_old = num_old
+        self.num_new = num_new
+        self.num_stats = num_stats
+        self.position = 0
+
+        fill_values = np.full(num_stats, np.nan) if fill_values is None else fill_values
+        self.fill_row = np.repeat(np.asarray(fill_values, dtype=template.dtype), num_old + num_new)
+
+        # rows are buffered so that the existing chunks
+        # are read and written as a whole
+        self.buffer_rows = template.chunks[0]
+        self.buffer = []
+        self.buffered = 0
+
+        self.old = group[chrom] if chrom in group else None
+        # resizing fills the new rows and columns with NaN
+        self.in_place = (
+            self.old is not None
+            and num_stats == 1
+            and self.old.maxshape == (None, None)
+            and np.isnan(self.fill_row).all()
         )
-        f["resolutions"][str(curr_resolution)]["chroms"].create_dataset(
-            "length", shape=(len(chroms),), data=lengths, compression="gzip"
+
+        if self.in_place:
+            self.old.resize((max(num_rows, len(self.old)), num_old + num_new))
+            return
+
+        shape = (num_rows, num_stats * (num_old + num_new))
+        self.dataset = group.create_dataset(
+            chrom + ".append",
+            shape,
+            dtype=template.dtype,
+            chunks=chunk_shape(
+                shape,
+                chunk_rows=template.chunks[0],
+                chunk_cols=template.chunks[1] if template.chunks[1] < template.shape[1] else None,
+            ),
+            maxshape=(None, None),
+            fillvalue=np.nan,
+            compression=template.compression,
+            compression_opts=template.compression_opts,
+            shuffle=template.shuffle,
         )
+        self.writer = ChunkWriter(self.dataset, pool)
 
-        for chrom, length in zip(chroms, lengths):
-            if chrom not in f["resolutions"][str(prev_resolution)]["values"]:
-                continue
+    def append(self, data):
+        self.buffer += [data]
+        self.buffered += len(data)
 
-            # next_level_length = math.ceil(
-            #     len(f['resolutions'][str(prev_resolution)]['values'][chrom]) / 2)
+        if self.buffered >= self.buffer_rows:
+            self.flush()
 
-            start = 0
+    def flush(self):
+        if self.buffered == 0:
+            return
 
-            chrom_data = f["resolutions"][str(prev_resolution)]["values"][chrom]
+        data = self.buffer[0] if len(self.buffer) == 1 else np.concatenate(self.buffer)
+        self.buffer = []
+        self.buffered = 0
 
-            standard_chunk_size = 1e5
-            chunk_size = int(min(standard_chunk_size, len(chrom_data)))
+        start = self.position
+        self.position += len(data)
 
-            new_shape = list(chrom_data.shape)
-            new_shape[0] = math.ceil(new_shape[0] / 2)
-            new_shape = tuple(new_shape)
+        if self.in_place:
+            self.old[start : self.position, self.num_old :] = data
+            return
+
+        num_cols = self.num_old + self.num_new
+        merged = np.tile(self.fill_row, (len(data), 1))
+
+        if self.old is not None and start < len(self.old):
+            old_data = self.old[start : self.position]
+            for stat in range(self.num_stats):
+                merged[: len(old_data), stat * num_cols : stat * num_cols + self.num_old] = \
+                    old_data[:, stat * self.num_old : (stat + 1) * self.num_old]
+
+        if data.shape[1] > 0:
+            for stat in range(self.num_stats):
+                merged[:, stat * num_cols + self.num_old : (stat + 1) * num_cols] = \
+                    data[:, stat * self.num_new : (stat + 1) * self.num_new]
+
+        self.writer.append(merged)
+
+    def close(self):
+        self.flush()
+        if self.in_place:
+            return
+
+        # the rows without new data
+        while self.position < self.num_rows:
+            num_rows = min(self.buffer_rows, self.num_rows - self.position)
+            self.append(np.empty((num_rows, 0)))
+            self.flush()
+        self.writer.close()
+
+        if self.old is not None:
+            del self.group[self.chrom]
+        self.group.move(self.chrom + ".append", self.chrom)
 
-            f["resolutions"][str(curr_resolution)]["values"].create_dataset(
-                chrom, new_shape, compression="gzip"
-            )
 
-            while start < len(chrom_data):
-                old_data = f["resolutions"][str(prev_resolution)]["values"][chrom][
-                    start : start + chunk_size
+def append_multivec_columns(
+    f,
+    array_data,
+    chromsizes,
+    row_infos=None,
+    compression_threads=None,
+    sort_key=None,
+):
+    """
+    Add columns to every zoom level of a multires file created by
+    create_multivec_multires, aggregating only the new columns.
+
+    Chromosomes that are not in the file are added, with empty existing
+    columns, and the length of a chromosome is the larger of its lengths
+    in the file and in chromsizes. The zoom levels of the file are kept.
+
+    Parameters
+    ----------
+    f: h5py.File
+        A multires file opened for writing
+    array_data: {'chrom_key': np.array, }
+        The new columns at the starting resolution of the file,
+        organized like the array_data of create_multivec_multires
+    chromsizes: [('chrom_key', size),...]
+        The chromosome sizes of the new columns
+    row_infos: [str, ...]
+        The information about each of the new columns
+    compression_threads: int (default: the number of CPUs)
+    sort_key: function
+        The sort key of the merged ('chrom_key', size) tuples. By default,
+        or if the chromosomes of the file are in another order (e.g. the
+        order of an assembly), new chromosomes are added after the ones
+        of the file.
+
+    The statistics of the columns of the file, if it has them, are
+    computed again from all of the values, see write_row_stats.
+    """
+    resolutions = sorted(int(r) for r in f["resolutions"])
+    starting_resolution = resolutions[0]
+    tile_size = int(f["info"].attrs["tile-size"])
+
+    # files without the attribute were aggregated with a sum
+    names = [
+        name.decode() if isinstance(name, bytes) else str(name)
+        for name in f["info"].attrs.get("aggregations", [b"sum"])
+    ]
+    pyramid = Pyramid(names)
+
+    # merge the chromosome sizes the same way the inputs are merged
+    old_chromsizes = list(
+        zip([c.decode() for c in f["chroms"]["name"][:]], f["chroms"]["length"][:].tolist())
+    )
+    merged = collections.OrderedDict(old_chromsizes)
+    for (chrom, length) in chromsizes:
+        merged[chrom] = max(merged.get(chrom, 0), length)
+    if sort_key is not None and old_chromsizes == sorted(old_chromsizes, key=sort_key):
+        merged = collections.OrderedDict(sorted(merged.items(), key=sort_key))
+
+    if list(merged.items()) != old_chromsizes:
+        write_chroms(f, list(merged.items()), resolutions)
+
+    if len(get_resolutions(list(merged.items()), starting_resolution, tile_size)) > len(resolutions):
+        logger.warning(
+            "The chromosomes are longer than the zoom levels of the file cover, "
+            "the zoom levels are kept as they are"
+        )
+
+    template = None
+    for chrom in f["resolutions"][str(starting_resolution)]["values"]:
+        template = f["resolutions"][str(starting_resolution)]["values"][chrom]
+        break
+    if template is None:
+        raise ValueError("The file has no values to append to")
+    num_old = template.shape[1] // len(names)
+    # an empty bin has no values to count
+    fill_values = [0 if name == "count" else np.nan for name in names]
+
+    # the number of new columns is only known once we have some data
+    chunks = {}
+    num_new = None
+    for chrom in merged:
+        if chrom in array_data:
+            chunks[chrom] = iter_chunks(array_data[chrom], 100000)
+            first_chunk = next(chunks[chrom], None)
+            if first_chunk is not None:
+                chunks[chrom] = itertools.chain([first_chunk], chunks[chrom])
+                num_new = num_new or first_chunk.shape[1]
+    if num_new is None:
+        print("No new columns to append", file=sys.stderr)
+        return
+
+    pool = ThreadPoolExecutor(compression_threads or os.cpu_count())
+
+    for (chrom, length) in merged.items():
+        num_rows = math.ceil(length / starting_resolution)
+
+        writers = []
+        for curr_resolution in resolutions:
+            writers += [
+                ColumnAppender(
+                    f["resolutions"][str(curr_resolution)]["values"],
+                    chrom,
+                    num_rows,
+                    num_old,
+                    num_new,
+                    len(names),
+                    template,
+                    pool,
+                    fill_values,
+                )
+            ]
+            num_rows = math.ceil(num_rows / 2)
+
+        if chrom in chunks:
+            write_pyramid(writers, chunks[chrom], pyramid, template.dtype)
+        else:
+            for writer in writers:
+                writer.close()
+
+    pool.shutdown()
+
+    if "row_stats" in f["resolutions"][str(starting_resolution)]:
+        write_row_stats(f)
+
+    # the rows are repeated for every statistic
+    if row_infos is not None:
+        for curr_resolution in resolutions:
+            attrs = f["resolutions"][str(curr_resolution)].attrs
+            if "row_infos" in attrs:
+                old_row_infos = [
+                    r if isinstance(r, bytes) else str(r).encode() for r in attrs["row_infos"]
                 ]
-                # print("prev_resolution:", prev_resolution)
-                # print("old_data.shape", old_data.shape)
-
-                # this is a sort of roundabout way of calculating the
-                # shape of the aggregated array, but all its doing is
-                # just halving the first dimension of the previous shape
-                # without taking into account the other dimensions
-                # print("11 old_data.shape", old_data.shape)
-                if len(old_data) % 2 != 0:
-                    # we need our array to have an even number of elements
-                    # so we just add the last element again
-                    old_data = np.concatenate((old_data, [old_data[-1]]))
-                    chunk_size += 1
-                # print("22 old_data.shape", old_data.shape)
-
-                # print('old_data:', old_data)
-                # print("shape:", old_data.shape)
-                # actually sum the adjacent elements
-                # print("old_data.shape", old_data.shape)
-                new_data = agg(old_data)
-
-                """
-                print("zoom_level:", max_zoom - 1 - i,
-                      "resolution:", curr_resolution,
-                      "new_data length", len(new_data))
-                """
-                f["resolutions"][str(curr_resolution)]["values"][chrom][
-                    int(start / 2) : int(start / 2 + chunk_size / 2)
-                ] = new_data
-                start += int(min(standard_chunk_size, len(chrom_data) - start))
-
-        prev_resolution = curr_resolution
-    return f
+            else:
+                old_row_infos = [b""] * (num_old * len(names))
+
+            new_row_infos = []
+            for stat in range(len(names)):
+                new_row_infos += old_row_infos[stat * num_old : (stat + 1) * num_old]
+                new_row_infos += [
+                    r if isinstance(r, bytes) else str(r).encode() for r in row_infos
+                ]
+            attrs["row_infos"] = np.array(new_row_infos, dtype="S")
+
+
+def write_chroms(f, chromsizes, resolutions):
+    """
+    (Re)write the names and lengths of the chromosomes of a
+    multires file, at the top level and at every resolution.
+    """
+    chroms, lengths = zip(*chromsizes)
+    chrom_array = np.array(chroms, dtype="S")
+
+    groups = [f["chroms"]] + [f["resolutions"][str(r)]["chroms"] for r in resolutions]
+    for group in groups:
+        for name in ("name", "length"):
+            if name in group:
+                del group[name]
+
+        group.create_dataset(
+            "name",
+            shape=(len(chroms),),
+            dtype=chrom_array.dtype,
+            data=chrom_array,
+            compression="gzip",
+        )
+        group.create_dataset(
+            "length", shape=(len(chroms),), data=lengths, compression="gzip"
+        )
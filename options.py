@@ -0,0 +1,231 @@
+"""
+The options of a conversion of BigWig files to a multivec file (see
+convert.bigwigs_to_multivec), and the combinations of them that can't be
+converted, which are rejected in one place when the options are created.
+"""
+
+import fetch
+from header_index import DEFAULT_INDEX_PATH
+
+# The number of bins that are read from the input files and kept in memory at once.
+DEFAULT_WINDOW_SIZE = 1000000
+
+# The options of a conversion and their defaults.
+DEFAULTS = {
+    "starting_resolution": 1,
+    "window_size": DEFAULT_WINDOW_SIZE,
+    "workers": 1,
+    "compression_threads": None,
+    "dtype": "f4",
+    "compression": "gzip",
+    "compression_opts": None,
+    "shuffle": False,
+    "chunk_rows": None,
+    "aggregation": "sum",
+    "zoom_summaries": None,
+    "preview": False,
+    "resume": False,
+    "batch_size": None,
+    "header_index": DEFAULT_INDEX_PATH,
+    "max_memory": None,
+    "dry_run": False,
+    "chrom_workers": 1,
+    "download_dir": fetch.DEFAULT_CACHE_DIR,
+    "download_cache_size": fetch.DEFAULT_CACHE_BYTES,
+    "download_threads": fetch.DEFAULT_THREADS,
+    "chroms": None,
+    "regions": None,
+    "update": False,
+    "row_stats": False,
+    "backend": "hdf5",
+    "assembly": None,
+    "min_contig_size": None,
+    "bucket_contigs": None,
+}
+
+
+class ConversionOptions:
+    """
+    The options of a conversion, with the defaults in DEFAULTS for the
+    ones that aren't given. They are checked when they are created, see
+    check, so a ConversionOptions is always a valid combination.
+
+    Parameters
+    ----------
+    starting_resolution: int (default 1)
+        The starting resolution of the input data
+    window_size: int (default 1000000)
+        The number of bins of a chromosome that are read from all input
+        files and written to the output at once. The peak memory usage
+        scales with window_size * len(input_files), or with
+        window_size * batch_size when the files are read in batches.
+    workers: int (default 1)
+        The number of processes that decode the input files. With more
+        than one worker, the windows of each input file are read in a
+        process pool and passed back through memory-mapped buffers.
+    compression_threads: int (default: the number of CPUs)
+        The number of threads that compress the output chunks.
+    dtype, compression, compression_opts, shuffle, chunk_rows:
+        The storage layout of the output values, see
+        multivec.create_multivec_multires
+    aggregation: str or [str, ...] (default 'sum')
+        The aggregation of adjacent bins at each zoom level: 'sum', 'mean',
+        'max', 'min' or 'count'. With a list of names, the statistics are
+        computed in the same pass and stored side by side.
+    zoom_summaries: int (default None)
+        Fill the zoom levels with a resolution of at least this many base
+        pairs from the zoom-level summaries of the input files, wherever
+        every input file has a zoom level of at most half the resolution
+        (see convert.get_zoom_summary_resolutions). The finest of them is
+        read from the summaries and the coarser ones are aggregated from
+        it, only the finer zoom levels are aggregated from the base data.
+        The values of every aggregation are approximate, see
+        convert.read_zoom_window.
+    preview: bool (default False)
+        Only fill the zoom levels from the zoom-level summaries, with
+        approximate values, and leave the finer ones empty (NaN). Nothing
+        is written if the input files have no summaries for any zoom
+        level. Rerun without preview to fill them.
+    resume: bool (default False)
+        Record the finished chromosomes in a progress file next to the
+        output file (output_file + '.progress.json') and, if a conversion
+        with the same parameters was interrupted, continue where it stopped.
+    batch_size: int (default None)
+        Convert the input files in batches of this many files, one batch
+        after another, and write the rows of each batch to its own block
+        of chunks in the output. Only the files of the current batch are
+        open and held in memory, which keeps the memory usage flat for
+        thousands of tracks.
+    header_index: str (default header_index.DEFAULT_INDEX_PATH)
+        The path of the index of the headers of the input files, so that
+        they are only opened to validate them and merge their chromosomes
+        when they changed. None keeps the index in memory.
+    max_memory: int (default None)
+        The memory budget of the conversion in bytes. The window size is
+        reduced, the batch size and chunk rows are chosen (unless they are
+        given) and the number of workers or chrom_workers is reduced so
+        that the estimated peak memory of the buffers and the processes
+        fits, see planner.plan_conversion.
+    dry_run: bool (default False)
+        Only print the estimated peak memory, temporary disk space, output
+        size and number of resolution levels of the conversion.
+    chrom_workers: int (default 1)
+        The number of chromosomes that are converted at once, each in its
+        own process that reads the input files and builds all of the zoom
+        levels of the chromosome in a scratch file next to the output file.
+        The scratch files are merged into the output as they finish. With
+        more than one, the files are read in these processes and workers
+        is ignored.
+    download_dir: str (default fetch.DEFAULT_CACHE_DIR)
+        The cache of the input files that are given as URLs. They are
+        downloaded in the order of the input files, and each file is
+        validated while the next ones are downloading.
+    download_cache_size: int (default fetch.DEFAULT_CACHE_BYTES)
+        The size of the download cache in bytes. Files of earlier
+        conversions are removed when it is exceeded. The input files of
+        the conversion are all kept until it ends, even if they take more.
+    download_threads: int (default fetch.DEFAULT_THREADS)
+        The number of input files that are downloaded at once.
+    chroms: [str, ...] (default None)
+        Only convert these chromosomes.
+    regions: [(chrom, start, end), ...] (default None)
+        Only convert these regions, in base pairs (see parse_regions). The
+        output has the chromosomes of the regions with their full lengths,
+        and only the bins and zoom levels that cover the regions are
+        computed and stored. The other bins are empty.
+    update: bool (default False)
+        Rewrite the chromosomes (all of them, or the ones in chroms) in
+        the existing output file at every resolution, with the storage
+        layout of the file, instead of creating a new file. The other
+        chromosomes of the file are kept.
+    row_stats: bool (default False)
+        Store the minimum, maximum, mean, fraction of empty bins and
+        approximate quantiles of every row at every resolution, see
+        multivec.write_row_stats. They are always updated in a file that
+        has them.
+    backend: str (default 'hdf5')
+        'hdf5' for a multires HDF5 file, or 'flat' for a directory with a
+        flat binary file of every resolution (see flatfile), compressed
+        with zlib unless compression is None. A flat output can't be
+        resumed, updated, or converted in batches or with chrom_workers.
+    assembly: str (default None)
+        The chromosomes of the output, instead of the ones of the input
+        files: the path or URL of a chromosome sizes file, in its order,
+        or the name of a UCSC assembly (e.g. hg38), in natural order, see
+        chrom_sizes.load_chromsizes. The chromosomes of the input files
+        that are not in it are skipped, and its chromosomes that are not
+        in any input file are empty.
+    min_contig_size: int (default None)
+        Drop the chromosomes smaller than this many base pairs, or put
+        them in a bucket.
+    bucket_contigs: str (default None)
+        The name of a pseudo-chromosome that the chromosomes smaller than
+        min_contig_size are laid out in, one after another, instead of
+        dropping them, see chrom_sizes.filter_contigs. The bucket has a
+        single dataset at every resolution instead of one for every
+        contig, and its contigs are stored in the output.
+
+    Raises
+    ------
+    TypeError for an unknown option
+    ValueError for options that can't be combined
+    """
+
+    def __init__(self, **options):
+        unknown = sorted(set(options) - set(DEFAULTS))
+        if unknown:
+            raise TypeError("Unknown conversion options: {}".format(", ".join(unknown)))
+        for (name, default) in DEFAULTS.items():
+            setattr(self, name, options.get(name, default))
+        self.check()
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in DEFAULTS}
+
+    def replace(self, **changes):
+        """
+        A copy of the options with some of them changed, which is checked
+        again, e.g. with the window and batch sizes of a memory budget.
+        """
+        return ConversionOptions(**dict(self.as_dict(), **changes))
+
+    def check(self):
+        """
+        Reject the options that can't be converted together.
+
+        Raises
+        ------
+        ValueError with the reason of the first conflict
+        """
+        for name in ("starting_resolution", "window_size", "workers", "chrom_workers"):
+            if getattr(self, name) < 1:
+                raise ValueError("The {} must be at least 1".format(name.replace("_", " ")))
+        if self.batch_size is not None and self.batch_size < 1:
+            raise ValueError("The batch size must be at least 1")
+        if self.backend not in ("hdf5", "flat"):
+            raise ValueError("Unknown output backend {}".format(self.backend))
+
+        if self.regions is not None and (
+            self.update or self.zoom_summaries is not None or self.preview
+        ):
+            raise ValueError(
+                "Regions can not be converted with an update, zoom summaries or a preview."
+            )
+        if self.update and self.resume:
+            raise ValueError("An update can not be resumed.")
+        if self.bucket_contigs is not None and (
+            self.min_contig_size is None or self.regions is not None or self.update
+            or self.zoom_summaries is not None or self.preview
+        ):
+            raise ValueError(
+                "Contigs are bucketed below a minimum contig size, "
+                "without regions, an update, zoom summaries or a preview."
+            )
+        if self.backend == "flat" and (
+            self.resume or self.update or self.batch_size is not None or self.chrom_workers > 1
+            or self.compression not in (None, "gzip") or self.shuffle
+        ):
+            raise ValueError(
+                "A flat output is written in one pass and compressed with zlib or not at all: "
+                "it can't be resumed, updated, converted in batches or with chromosome workers."
+            )
@@ -0,0 +1,321 @@
+"""
+Estimate the resources of a conversion before running it, and choose
+the window size, the file batch size and the chunk size of a conversion
+so that it fits into a memory budget.
+
+The estimates follow the buffers that a conversion allocates: the window
+of the base resolution that is read from the input files, the aggregation
+state of the zoom levels that is computed from it, and the chunks of every
+zoom level that are waiting to be compressed. They don't account for the
+caches of HDF5 and the operating system.
+"""
+
+import math
+import os
+
+import numpy as np
+
+import instrument
+import multivec as cmv
+import rowstats
+from aggregation import AGGREGATIONS
+
+# The smallest window size the planner chooses before reading the
+# input files in batches.
+MIN_WINDOW_SIZE = 65536
+
+# The number of chunks of a zoom level that can wait to be compressed
+# (see multivec.ChunkWriter), plus the one that is being filled.
+PENDING_CHUNKS = 18
+
+# The buckets of the histogram of a column of the row statistics, which
+# spans the buckets of the values that were seen (see rowstats.RowStats):
+# the positive values of 32 powers of two and zero.
+SKETCH_BUCKETS = 32 * 2 ** rowstats.SUBBUCKET_BITS + 1
+
+
+def parse_size(size):
+    """
+    Parse a number of bytes with an optional K, M, G or T suffix (e.g. '8G').
+    """
+    units = {"K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+    size = str(size).strip().upper().rstrip("B")
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def format_size(num_bytes):
+    """
+    A number of bytes in a human readable form, e.g. '1.5 GB'.
+    """
+    for unit in ("B", "KB", "MB", "GB", "TB"):
+        if num_bytes < 1024 or unit == "TB":
+            return "{:.1f} {}".format(num_bytes, unit) if unit != "B" else "{} B".format(num_bytes)
+        num_bytes /= 1024
+
+
+def current_rss():
+    """
+    The resident set size of this process in bytes, i.e. the memory of
+    the interpreter and the modules before a conversion allocates its
+    buffers. The peak resident set size is used where it is unknown, 0
+    where both are.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return instrument.peak_rss() or 0
+
+
+def estimate_conversion(
+    chromsizes,
+    num_files,
+    starting_resolution=1,
+    window_size=1000000,
+    batch_size=None,
+    chunk_rows=None,
+    dtype="f4",
+    aggregation="sum",
+    workers=1,
+    tile_size=256,
+    values_block_size=4194304,
+    chrom_workers=1,
+    row_stats=False,
+    base_memory=0,
+):
+    """
+    Estimate the resources of a conversion.
+
+    Parameters
+    ----------
+    chromsizes: [('chrom_key', size),...]
+    num_files: int
+        The number of input files
+    starting_resolution, window_size, batch_size, chunk_rows, dtype,
+    aggregation, workers, chrom_workers, row_stats: see options.ConversionOptions
+    tile_size: int
+        The tile size of the output
+    values_block_size: int
+        The number of bases that are decoded from an input file at once
+    base_memory: int (default 0)
+        The memory of a process before it allocates any buffers, e.g.
+        current_rss(). Every worker process is counted with as much.
+
+    Returns
+    -------
+    {'peak_memory': bytes, 'buffer_memory': bytes, 'base_memory': bytes,
+     'temp_disk': bytes, 'output_size': bytes, 'num_levels': int,
+     'window_size': int, 'batch_size': int, 'chunk_rows': int,
+     'workers': int, 'chrom_workers': int}
+    The peak memory is the memory of the buffers, which the window size,
+    batch size and chunk rows control, plus the base memory of this
+    process and its workers. The output size is the size of the
+    uncompressed values, the stored size is smaller with compression and
+    without empty chunks.
+    """
+    itemsize = np.dtype(dtype).itemsize
+    names = [aggregation] if isinstance(aggregation, str) else aggregation
+    if callable(aggregation):
+        (num_stats, state_width) = (1, 1)
+    else:
+        (num_stats, state_width) = (len(names), sum(AGGREGATIONS[name].width for name in names))
+
+    resolutions = cmv.get_resolutions(chromsizes, starting_resolution, tile_size)
+    # the number of bins of every chromosome
+    sizes = np.array([size for (_, size) in chromsizes], dtype=np.int64)
+    chrom_bins = -(-sizes // starting_resolution)
+    max_bins = int(chrom_bins.max())
+    num_cols = batch_size if batch_size is not None and batch_size < num_files else num_files
+    window_rows = min(window_size, max_bins)
+
+    # the float32 window and its copy in the storage type
+    window_bytes = window_rows * num_cols * 4
+    memory = window_bytes + window_rows * num_cols * itemsize
+
+    # the float64 aggregation state of the window and its finalized values,
+    # at most as much again for all of the coarser zoom levels together
+    memory += 2 * window_rows * num_cols * 8 * (state_width + num_stats)
+
+    # the chunks of every zoom level that are waiting to be written,
+    # batches write the chunks of each statistic separately
+    stored_cols = num_cols * num_stats
+    if num_cols < num_files:
+        (chunk_cols, num_writers) = (num_cols, num_stats)
+    else:
+        (chunk_cols, num_writers) = (stored_cols, 1)
+    if chunk_rows is None:
+        chunk_rows = cmv.chunk_shape(
+            (max_bins, stored_cols), tile_size, itemsize, chunk_cols=chunk_cols
+        )[0]
+    for level in range(len(resolutions)):
+        level_rows = min(chunk_rows, math.ceil(max_bins / 2 ** level))
+        memory += num_writers * PENDING_CHUNKS * level_rows * chunk_cols * itemsize
+
+    # the histograms of the values of every resolution, which span all of
+    # the columns because the quantiles need every chromosome, and the
+    # buckets of the window (or batch) that are counted into them
+    stats_bytes = 0
+    if row_stats:
+        stats_bytes = len(resolutions) * num_files * num_stats * SKETCH_BUCKETS * 8
+        memory += 3 * window_rows * stored_cols * 8
+
+    # decoding the input files
+    read_bytes = min(values_block_size, window_rows * starting_resolution) * 4 * 4
+    temp_disk = 0
+    num_processes = 1
+    if chrom_workers > 1:
+        # every process converts a chromosome with its own buffers
+        memory = chrom_workers * (memory + read_bytes + stats_bytes)
+        num_processes += chrom_workers
+    elif workers > 1:
+        # the second window is read while the first one is aggregated
+        memory += window_bytes
+        memory += workers * read_bytes
+        num_processes += workers
+        temp_disk = 2 * window_bytes
+    else:
+        memory += read_bytes
+    memory += stats_bytes
+
+    chrom_sizes = np.zeros(len(chrom_bins), dtype=np.int64)
+    num_rows = chrom_bins
+    for resolution in resolutions:
+        chrom_sizes += num_rows * num_files * num_stats * itemsize
+        num_rows = -(-num_rows // 2)
+    output_size = int(chrom_sizes.sum())
+
+    if chrom_workers > 1:
+        # the scratch files of the chromosomes that are being converted
+        temp_disk += int(np.sort(chrom_sizes)[-chrom_workers:].sum())
+
+    return {
+        "peak_memory": num_processes * base_memory + memory,
+        "buffer_memory": memory,
+        "base_memory": num_processes * base_memory,
+        "temp_disk": temp_disk,
+        "output_size": output_size,
+        "num_levels": len(resolutions),
+        "window_size": window_size,
+        "batch_size": batch_size,
+        "chunk_rows": chunk_rows,
+        "workers": workers,
+        "chrom_workers": chrom_workers,
+    }
+
+
+def plan_conversion(chromsizes, num_files, max_memory, window_size=1000000, batch_size=None,
+                    chunk_rows=None, tile_size=256, workers=1, chrom_workers=1,
+                    base_memory=0, **kwargs):
+    """
+    Choose the window size, the file batch size, the chunk rows and the
+    number of worker processes of a conversion so that its estimated peak
+    memory, the buffers and the base memory of every process, fits into
+    max_memory.
+
+    The window is made smaller first, down to MIN_WINDOW_SIZE bins, then
+    the input files are read in batches, then the chunks are made smaller
+    down to a single tile. If that isn't enough, the number of worker
+    processes (chrom_workers, or else workers) is halved and the buffers
+    are chosen again, down to a serial conversion. Only then is the window
+    made smaller down to a single tile. A batch size or a number of chunk
+    rows that is given is kept as it is, the window size and the numbers
+    of workers are upper bounds.
+
+    Parameters
+    ----------
+    chromsizes, num_files, window_size, batch_size, chunk_rows, tile_size,
+    workers, chrom_workers, base_memory: see estimate_conversion
+    max_memory: int
+        The memory budget in bytes
+    kwargs: the other parameters of estimate_conversion
+
+    Returns
+    -------
+    The estimate of the chosen conversion, see estimate_conversion. The
+    chunk rows are None unless they were given or had to be reduced.
+
+    Raises
+    ------
+    ValueError if the base memory of this process alone doesn't fit, or
+    the conversion doesn't fit even serially with the smallest buffers
+    """
+    if base_memory > max_memory:
+        raise ValueError(
+            "This process already uses {} of memory before any buffers, "
+            "{} is not enough".format(format_size(base_memory), format_size(max_memory))
+        )
+
+    def estimate(plan):
+        return estimate_conversion(
+            chromsizes, num_files, tile_size=tile_size, base_memory=base_memory, **plan, **kwargs
+        )
+
+    def fits(plan):
+        return estimate(plan)["peak_memory"] <= max_memory
+
+    def reduce_buffers(plan, min_window_size):
+        plan = dict(plan)
+        while not fits(plan) and plan["window_size"] // 2 >= min_window_size:
+            plan["window_size"] //= 2
+
+        if not fits(plan) and batch_size is None:
+            plan["batch_size"] = num_files
+            while not fits(plan) and plan["batch_size"] > 1:
+                plan["batch_size"] = math.ceil(plan["batch_size"] / 2)
+
+        if not fits(plan) and chunk_rows is None:
+            plan["chunk_rows"] = estimate(plan)["chunk_rows"]
+            while not fits(plan) and plan["chunk_rows"] > tile_size:
+                plan["chunk_rows"] = max(tile_size, plan["chunk_rows"] // 2 // tile_size * tile_size)
+        return plan
+
+    # every worker process has the base memory, so fewer of them can make
+    # more room than smaller buffers
+    plan = {
+        "window_size": window_size, "batch_size": batch_size, "chunk_rows": chunk_rows,
+        "workers": workers, "chrom_workers": chrom_workers,
+    }
+    while True:
+        reduced = reduce_buffers(plan, MIN_WINDOW_SIZE)
+        if fits(reduced) or (plan["workers"] <= 1 and plan["chrom_workers"] <= 1):
+            break
+        if plan["chrom_workers"] > 1:
+            plan["chrom_workers"] //= 2
+        else:
+            plan["workers"] //= 2
+    plan = reduce_buffers(reduced, tile_size)
+
+    result = estimate(plan)
+    if result["peak_memory"] > max_memory:
+        raise ValueError(
+            "The conversion needs at least {} of memory ({} of buffers and {} of base memory) "
+            "even serially, {} is not enough".format(
+                format_size(result["peak_memory"]), format_size(result["buffer_memory"]),
+                format_size(result["base_memory"]), format_size(max_memory)
+            )
+        )
+    if result["batch_size"] is not None and result["batch_size"] >= num_files:
+        result["batch_size"] = None
+    if plan["chunk_rows"] is None:
+        # the chunks didn't have to be smaller, so the chunk shape of
+        # every dataset is still chosen when it is created
+        result["chunk_rows"] = None
+    return result
+
+
+def print_estimate(estimate):
+    print("Resolution levels:", estimate["num_levels"])
+    print("Window size:", estimate["window_size"], "bins")
+    print("Batch size:", estimate["batch_size"] or "all files")
+    print("Chunk rows:", estimate["chunk_rows"] or "chosen for every dataset")
+    if estimate["chrom_workers"] > 1:
+        print("Chromosome workers:", estimate["chrom_workers"])
+    else:
+        print("Workers:", estimate["workers"])
+    print("Peak memory:", format_size(estimate["peak_memory"]), "({} of buffers, {} base)".format(
+        format_size(estimate["buffer_memory"]), format_size(estimate["base_memory"])
+    ))
+    print("Temporary disk:", format_size(estimate["temp_disk"]))
+    print("Output size (uncompressed):", format_size(estimate["output_size"]))
@@ -0,0 +1,104 @@
+"""
+A durable record of the finished parts of a conversion, so that an
+interrupted conversion can be resumed where it stopped.
+"""
+
+import json
+import os
+import os.path as op
+
+import h5py
+
+
+class Progress:
+    """
+    The progress manifest of a conversion, stored next to its output file.
+
+    The manifest lists the finished units of work (e.g. a chromosome with
+    all of its zoom levels) together with the parameters of the conversion.
+    It is rewritten atomically every time a unit is finished, after the
+    output file has been flushed, so that a unit in the manifest is always
+    complete in the output file.
+
+    Parameters
+    ----------
+    output_file: the path of the output file
+    parameters: dict
+        The parameters of the conversion. A manifest written with other
+        parameters is ignored.
+    """
+
+    def __init__(self, output_file, parameters):
+        self.output_file = output_file
+        self.path = output_file + ".progress.json"
+        self.parameters = json.loads(json.dumps(parameters))
+        self.units = {}
+        self.resumed = False
+
+        if not op.exists(self.path) or not op.exists(output_file):
+            return
+
+        try:
+            with open(self.path) as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            print("Ignoring unreadable progress file:", self.path)
+            return
+
+        if manifest.get("parameters") != self.parameters:
+            print("Ignoring progress file of a conversion with other parameters:", self.path)
+            return
+
+        self.units = manifest.get("units", {})
+        self.resumed = True
+        print("Resuming from", self.path, "with", len(self.units), "finished units")
+
+    def is_done(self, unit):
+        return unit in self.units
+
+    def mark_done(self, unit, info=None):
+        """
+        Record a finished unit. The output file must have been flushed.
+        """
+        self.units[unit] = info if info is not None else True
+        self.save()
+
+    def discard(self, unit):
+        self.units.pop(unit, None)
+
+    def reset(self):
+        """
+        Forget all of the finished units, e.g. when the output is recreated.
+        """
+        self.units = {}
+        self.resumed = False
+        self.save()
+
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"parameters": self.parameters, "units": self.units}, f, indent=1)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def open_output(self):
+        """
+        Open the partial output file for writing, or return None if
+        there is nothing to resume or the file can't be opened.
+        """
+        if not self.resumed:
+            return None
+
+        try:
+            return h5py.File(self.output_file, "r+")
+        except (IOError, OSError) as ex:
+            print("Can not resume from a damaged output file:", ex)
+            return None
+
+    def finish(self):
+        """
+        Remove the manifest once the conversion is complete.
+        """
+        if op.exists(self.path):
+            os.remove(self.path)
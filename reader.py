@@ -0,0 +1,458 @@
+"""
+Read tiles from multires multivec files, e.g. to serve them to HiGlass.
+
+A reader keeps its file open, knows where every chromosome starts in the
+concatenated genome and caches the decompressed chunks of the values
+datasets, so that panning around a region doesn't decompress its chunks
+again. Flat multivec directories (see flatfile) are read by FlatReader,
+with the same interface.
+"""
+
+import collections
+import os
+import os.path as op
+import threading
+import zlib
+
+import h5py
+import numpy as np
+
+import chrom_sizes
+import flatfile
+import rowstats
+
+# The default size of the cache of decompressed chunks of a reader.
+DEFAULT_CACHE_BYTES = 256 * 2 ** 20
+
+
+class ChunkCache:
+    """
+    A least recently used cache of arrays, limited by their total size.
+
+    Parameters
+    ----------
+    max_bytes: int
+        The total size of the cached arrays. The least recently used
+        arrays are evicted once it is exceeded.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.arrays = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        """
+        The cached array of a key, or the array returned by load(), which is cached.
+        """
+        with self.lock:
+            if key in self.arrays:
+                self.arrays.move_to_end(key)
+                self.hits += 1
+                return self.arrays[key]
+            self.misses += 1
+
+        array = load()
+
+        with self.lock:
+            if key not in self.arrays:
+                self.arrays[key] = array
+                self.nbytes += array.nbytes
+            while self.nbytes > self.max_bytes and len(self.arrays) > 1:
+                (_, evicted) = self.arrays.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return array
+
+    def clear(self):
+        with self.lock:
+            self.arrays.clear()
+            self.nbytes = 0
+
+
+class MultivecReader:
+    """
+    Read tiles of a multires multivec file.
+
+    Zoom level 0 is the coarsest resolution, and tile x of a zoom level
+    covers the base pairs [x * tile_width, (x + 1) * tile_width) of the
+    chromosomes laid out one after another, where tile_width is the
+    resolution times the tile size.
+
+    Parameters
+    ----------
+    path: str
+        The path of the multires file
+    cache_bytes: int (default DEFAULT_CACHE_BYTES)
+        The size of the cache of decompressed chunks
+    """
+
+    def __init__(self, path, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.path = path
+        self.f = h5py.File(path, "r")
+        self.cache = ChunkCache(cache_bytes)
+
+        self.tile_size = int(self.f["info"].attrs["tile-size"])
+        self.resolutions = sorted(int(r) for r in self.f["resolutions"])
+        self.max_zoom = len(self.resolutions) - 1
+
+        self.chroms = [name.decode() for name in self.f["chroms"]["name"][:]]
+        self.lengths = np.array(self.f["chroms"]["length"][:], dtype=np.int64)
+        # the position of the start of every chromosome in the genome
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+
+        # the datasets of every resolution by chromosome index, opened
+        # when they are first read (None if missing), so that assemblies
+        # with many contigs are opened quickly
+        self.datasets = {resolution: {} for resolution in self.resolutions}
+
+        values = self.f["resolutions"][str(self.resolutions[0])]["values"]
+        dataset = next(iter(values.values()), None)
+        self.num_rows = dataset.shape[1] if dataset is not None else 0
+        self.dtype = np.result_type(
+            dataset.dtype if dataset is not None else np.float32, np.float32
+        )
+        self.stats = {}
+
+    def close(self):
+        _forget(self)
+        self.cache.clear()
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tileset_info(self):
+        """
+        The description of the tiles of the file.
+        """
+        resolution_group = self.f["resolutions"][str(self.resolutions[0])]
+        info = {
+            "resolutions": self.resolutions[::-1],
+            "min_pos": [0],
+            "max_pos": [int(self.offsets[-1])],
+            "tile_size": self.tile_size,
+            "max_zoom": self.max_zoom,
+            "shape": [self.tile_size, self.num_rows],
+        }
+        if "row_infos" in resolution_group.attrs:
+            info["row_infos"] = [
+                r.decode() if isinstance(r, bytes) else str(r)
+                for r in resolution_group.attrs["row_infos"]
+            ]
+        return info
+
+    def resolution(self, zoom):
+        """
+        The resolution of a zoom level.
+        """
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValueError("Zoom level {} is not between 0 and {}".format(zoom, self.max_zoom))
+        return self.resolutions[self.max_zoom - zoom]
+
+    def row_stats(self, zoom):
+        """
+        The statistics of the values of every row at a zoom level, e.g. to
+        set up the value range of a colorbar, or None if the file has none.
+        See rowstats.read.
+        """
+        resolution = self.resolution(zoom)
+        if resolution not in self.stats:
+            self.stats[resolution] = rowstats.read(self.f["resolutions"][str(resolution)])
+        return self.stats[resolution]
+
+    def contigs(self):
+        """
+        The contigs that are laid out in the chromosomes of the file, e.g.
+        the small contigs of an assembly in a bucket, see
+        chrom_sizes.filter_contigs.
+
+        Returns
+        -------
+        [('contig', 'chrom_key', start, size), ...], empty if there are none
+        """
+        return chrom_sizes.read_contigs(self.f)
+
+    def tile(self, zoom, x):
+        """
+        The values of a tile, an array of shape (rows, tile_size) where
+        bins without data are NaN.
+        """
+        resolution = self.resolution(zoom)
+        start = x * resolution * self.tile_size
+        end = start + resolution * self.tile_size
+
+        tile = np.full((self.tile_size, self.num_rows), np.nan, dtype=self.dtype)
+
+        # the chromosomes that overlap the tile
+        first = max(0, int(np.searchsorted(self.offsets, start, side="right")) - 1)
+        last = int(np.searchsorted(self.offsets, end, side="left"))
+        for chrom_index in range(first, min(last, len(self.chroms))):
+            dataset = self.dataset(resolution, chrom_index)
+            if dataset is None:
+                continue
+
+            # a bin is in the column of the genome position it starts at,
+            # so the bins of a chromosome are in consecutive columns
+            first_column = int(self.offsets[chrom_index]) // resolution - x * self.tile_size
+            start_bin = max(0, -first_column)
+            end_bin = min(len(dataset), self.tile_size - first_column)
+            if start_bin >= end_bin:
+                continue
+
+            tile[first_column + start_bin : first_column + end_bin] = self.read(
+                resolution, chrom_index, start_bin, end_bin
+            )
+
+        return tile.T
+
+    def tiles(self, tile_ids):
+        """
+        The values of several tiles, see tile.
+
+        Parameters
+        ----------
+        tile_ids: [(zoom, x), ...]
+
+        Returns
+        -------
+        A list with the values of every tile, in the order of tile_ids
+        """
+        # neighboring tiles share chunks, read them one after another
+        order = sorted(range(len(tile_ids)), key=lambda i: tuple(tile_ids[i]))
+        tiles = [None] * len(tile_ids)
+        for i in order:
+            tiles[i] = self.tile(*tile_ids[i])
+        return tiles
+
+    def dataset(self, resolution, chrom_index):
+        """
+        The values dataset of a chromosome at a resolution, or None if
+        the chromosome has no values.
+        """
+        datasets = self.datasets[resolution]
+        if chrom_index not in datasets:
+            values = self.f["resolutions"][str(resolution)]["values"]
+            chrom = self.chroms[chrom_index]
+            datasets[chrom_index] = values[chrom] if chrom in values else None
+        return datasets[chrom_index]
+
+    def read(self, resolution, chrom_index, start_bin, end_bin):
+        """
+        The rows [start_bin, end_bin) of the values of a chromosome,
+        read from the cached chunks of its dataset.
+        """
+        dataset = self.dataset(resolution, chrom_index)
+        chunk_rows = dataset.chunks[0] if dataset.chunks is not None else len(dataset)
+
+        parts = []
+        for chunk_index in range(start_bin // chunk_rows, (end_bin - 1) // chunk_rows + 1):
+            chunk_start = chunk_index * chunk_rows
+            chunk = self.cache.get(
+                (resolution, chrom_index, chunk_index),
+                lambda: dataset[chunk_start : chunk_start + chunk_rows],
+            )
+            parts += [chunk[max(start_bin - chunk_start, 0) : end_bin - chunk_start]]
+
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+
+class FlatReader:
+    """
+    Read tiles of a flat multivec directory, see flatfile.
+
+    Tile x of a resolution is block x of its file. The blocks of
+    uncompressed files are slices of a memory map of the file, so a tile
+    is a view of the file without any copy. Compressed blocks are read
+    and decompressed once, and cached like the chunks of MultivecReader.
+
+    Parameters
+    ----------
+    path: str
+        The directory of the flat multivec
+    cache_bytes: int (default DEFAULT_CACHE_BYTES)
+        The size of the cache of decompressed blocks
+    """
+
+    def __init__(self, path, cache_bytes=DEFAULT_CACHE_BYTES):
+        self.path = path
+        self.index = flatfile.read_index(path)
+        self.cache = ChunkCache(cache_bytes)
+
+        self.tile_size = self.index["tile_size"]
+        self.num_rows = self.index["num_cols"]
+        self.dtype = np.dtype(self.index["dtype"])
+        self.resolutions = sorted(int(r) for r in self.index["resolutions"])
+        self.max_zoom = len(self.resolutions) - 1
+        self.chroms = [chrom for (chrom, _) in self.index["chroms"]]
+        self.lengths = np.array([length for (_, length) in self.index["chroms"]], dtype=np.int64)
+
+        # the memory maps of uncompressed files, and the open compressed
+        # files with the offsets of their blocks
+        self.arrays = {}
+        self.files = {}
+        self.blocks = {}
+        for resolution in self.resolutions:
+            entry = self.index["resolutions"][str(resolution)]
+            if entry["file"] is None:
+                continue
+            file_path = op.join(path, entry["file"])
+            if entry["blocks"] is None:
+                if entry["num_rows"] * self.num_rows > 0:
+                    self.arrays[resolution] = np.memmap(
+                        file_path,
+                        dtype=self.dtype,
+                        mode="r",
+                        shape=(entry["num_rows"], self.num_rows),
+                    )
+            else:
+                self.files[resolution] = os.open(file_path, os.O_RDONLY)
+                self.blocks[resolution] = np.fromfile(op.join(path, entry["blocks"]), dtype="<u8")
+
+        self.stats = {}
+
+    def close(self):
+        _forget(self)
+        self.cache.clear()
+        self.arrays.clear()
+        for fd in self.files.values():
+            os.close(fd)
+        self.files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def tileset_info(self):
+        """
+        The description of the tiles, see MultivecReader.tileset_info.
+        """
+        info = {
+            "resolutions": self.resolutions[::-1],
+            "min_pos": [0],
+            "max_pos": [int(self.lengths.sum())],
+            "tile_size": self.tile_size,
+            "max_zoom": self.max_zoom,
+            "shape": [self.tile_size, self.num_rows],
+        }
+        if "row_infos" in self.index:
+            info["row_infos"] = self.index["row_infos"]
+        return info
+
+    def resolution(self, zoom):
+        """
+        The resolution of a zoom level.
+        """
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValueError("Zoom level {} is not between 0 and {}".format(zoom, self.max_zoom))
+        return self.resolutions[self.max_zoom - zoom]
+
+    def row_stats(self, zoom):
+        """
+        The statistics of the values of every row at a zoom level, like
+        MultivecReader.row_stats, or None if the index has none.
+        """
+        resolution = self.resolution(zoom)
+        if resolution not in self.stats:
+            entry = self.index["resolutions"][str(resolution)].get("row_stats")
+            if entry is None:
+                self.stats[resolution] = None
+            else:
+                result = {
+                    name: flatfile.array_values(entry[name])
+                    for name in ("sum", "min", "max", "mean", "nan_fraction")
+                }
+                result["count"] = np.array(entry["count"], dtype=np.int64)
+                quantiles = [flatfile.array_values(q) for q in entry["quantiles"]]
+                result["quantiles"] = {
+                    float(q): np.array([row[index] for row in quantiles])
+                    for (index, q) in enumerate(entry["quantile_levels"])
+                }
+                (low, high) = flatfile.array_values(entry["range"])
+                result["range"] = (float(low), float(high))
+                self.stats[resolution] = result
+        return self.stats[resolution]
+
+    def contigs(self):
+        """
+        The contigs that are laid out in the chromosomes, see
+        MultivecReader.contigs.
+        """
+        return [tuple(contig) for contig in self.index.get("contigs", [])]
+
+    def tile(self, zoom, x):
+        """
+        The values of a tile, an array of shape (rows, tile_size) where
+        bins without data are NaN. Tiles of uncompressed files are
+        read-only views of the file.
+        """
+        resolution = self.resolution(zoom)
+        num_blocks = self.index["resolutions"][str(resolution)]["num_rows"] // self.tile_size
+        if not 0 <= x < num_blocks or (
+            resolution not in self.arrays and resolution not in self.files
+        ):
+            return np.full((self.num_rows, self.tile_size), np.nan, dtype=self.dtype)
+
+        if resolution in self.arrays:
+            return self.arrays[resolution][x * self.tile_size : (x + 1) * self.tile_size].T
+
+        return self.cache.get((resolution, x), lambda: self.read_block(resolution, x)).T
+
+    def tiles(self, tile_ids):
+        """
+        The values of several tiles, see tile.
+        """
+        return [self.tile(*tile_id) for tile_id in tile_ids]
+
+    def read_block(self, resolution, block):
+        """
+        A decompressed block of a compressed file.
+        """
+        (start, end) = self.blocks[resolution][block : block + 2]
+        if start == end:
+            return np.full((self.tile_size, self.num_rows), np.nan, dtype=self.dtype)
+        data = zlib.decompress(os.pread(self.files[resolution], int(end - start), int(start)))
+        return np.frombuffer(data, dtype=self.dtype).reshape(self.tile_size, self.num_rows)
+
+
+# The open readers, by path. Closing a reader removes it.
+_readers = {}
+_readers_lock = threading.RLock()
+
+
+def get_reader(path, cache_bytes=DEFAULT_CACHE_BYTES):
+    """
+    A reader of a multires file or a flat multivec directory that stays
+    open for later calls. The file is opened again if it was modified since,
+    or if the reader was closed (e.g. at the end of a with block), which
+    closes it for every caller that holds it.
+    """
+    flat = flatfile.is_flat(path)
+    mtime = os.stat(op.join(path, flatfile.INDEX_NAME) if flat else path).st_mtime_ns
+    with _readers_lock:
+        if path in _readers:
+            (reader, reader_mtime) = _readers[path]
+            if reader_mtime == mtime:
+                return reader
+            reader.close()
+
+        reader = FlatReader(path, cache_bytes) if flat else MultivecReader(path, cache_bytes)
+        _readers[path] = (reader, mtime)
+        return reader
+
+
+def _forget(reader):
+    """
+    Remove a reader that is being closed from the open readers.
+    """
+    with _readers_lock:
+        entry = _readers.get(reader.path)
+        if entry is not None and entry[0] is reader:
+            del _readers[reader.path]
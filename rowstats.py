@@ -0,0 +1,249 @@
+"""
+Statistics of the columns of the zoom levels of a multires file, i.e. of
+the rows of a HiGlass horizontal-multivec track, so that value ranges
+and colorbars can be set up without reading any tiles.
+
+The statistics are accumulated while the zoom levels are written: the
+number of values, their sum, minimum and maximum, and a histogram of
+the values in logarithmic buckets, from which quantiles are estimated
+within a relative error of RELATIVE_ACCURACY. The bucket of a value is
+read from the bits of its single precision float: every power of two is
+split into 2 ** SUBBUCKET_BITS buckets. The histogram of a zoom level
+only spans the buckets from the smallest to the largest value that was
+added, e.g. a few hundred of them for non-negative values, and is not
+stored, only the quantiles that are estimated from it. All of the
+statistics can be merged, e.g. the statistics of chromosomes built
+elsewhere.
+"""
+
+import numpy as np
+
+# The quantiles that are stored for every column.
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# The number of bits of the mantissa that select the bucket of a value
+# within its power of two.
+SUBBUCKET_BITS = 3
+
+# The largest relative error of the value that represents a bucket.
+RELATIVE_ACCURACY = 1 / (2 ** (SUBBUCKET_BITS + 1) + 1)
+
+# Values closer to zero than this are counted as zero, and larger ones
+# as this value.
+MIN_VALUE = 1e-6
+MAX_VALUE = 1e12
+
+# The magnitude buckets are the bits of a float32 without its sign,
+# shifted so that only SUBBUCKET_BITS of the mantissa are left.
+BUCKET_SHIFT = 23 - SUBBUCKET_BITS
+MIN_KEY = int(np.float32(MIN_VALUE).view(np.uint32)) >> BUCKET_SHIFT
+MAX_KEY = int(np.float32(MAX_VALUE).view(np.uint32)) >> BUCKET_SHIFT
+
+# The buckets of a column: the negative values, from the largest
+# magnitude, then zero, then the positive values.
+NUM_SIDE_BUCKETS = MAX_KEY - MIN_KEY
+ZERO_BUCKET = NUM_SIDE_BUCKETS
+NUM_BUCKETS = 2 * NUM_SIDE_BUCKETS + 1
+
+
+def bucket_values():
+    """
+    The value that represents each bucket of a sketch, within
+    RELATIVE_ACCURACY of the values of the bucket.
+    """
+    keys = np.arange(MIN_KEY + 1, MAX_KEY + 1, dtype=np.uint32)
+    low = (keys << BUCKET_SHIFT).view(np.float32).astype(np.float64)
+    high = ((keys + 1) << BUCKET_SHIFT).view(np.float32).astype(np.float64)
+    magnitudes = 2 * low * high / (low + high)
+    return np.concatenate((-magnitudes[::-1], [0.0], magnitudes))
+
+
+class RowStats:
+    """
+    Statistics of the values of the columns of a zoom level.
+
+    Parameters
+    ----------
+    num_cols: int
+    """
+
+    def __init__(self, num_cols):
+        self.num_cols = num_cols
+        self.count = np.zeros(num_cols, dtype=np.int64)
+        self.sum = np.zeros(num_cols, dtype=np.float64)
+        self.min = np.full(num_cols, np.inf)
+        self.max = np.full(num_cols, -np.inf)
+        # the counts of the buckets [first_bucket, first_bucket + width)
+        self.first_bucket = ZERO_BUCKET
+        self.sketch = np.zeros((num_cols, 0), dtype=np.int64)
+
+    def _cover(self, first, last):
+        """
+        Widen the histogram to the buckets [first, last).
+        """
+        width = self.sketch.shape[1]
+        if width == 0:
+            self.first_bucket = first
+        first = min(first, self.first_bucket)
+        last = max(last, self.first_bucket + width)
+        before = self.first_bucket - first
+        after = last - first - width - before
+        if before or after:
+            self.sketch = np.pad(self.sketch, ((0, 0), (before, after)))
+            self.first_bucket = first
+
+    def add(self, values, col_offset=0):
+        """
+        Add rows of values to the statistics of the columns
+        [col_offset, col_offset + values.shape[1]). NaN values are empty.
+        """
+        if values.size == 0:
+            return
+        cols = slice(col_offset, col_offset + values.shape[1])
+
+        # one row for every column, so that the reductions are contiguous
+        values = np.ascontiguousarray(values.T)
+        valid = ~np.isnan(values)
+
+        self.count[cols] += np.count_nonzero(valid, axis=1)
+        self.sum[cols] += np.where(valid, values, 0).sum(axis=1, dtype=np.float64)
+        # fmin and fmax ignore NaN
+        self.min[cols] = np.fmin(self.min[cols], np.fmin.reduce(values, axis=1))
+        self.max[cols] = np.fmax(self.max[cols], np.fmax.reduce(values, axis=1))
+
+        bits = values.astype(np.float32, copy=False).view(np.uint32)
+        keys = (bits & 0x7FFFFFFF) >> BUCKET_SHIFT
+        # the magnitude buckets, 0 for the values that are counted as zero
+        buckets = np.clip(keys, MIN_KEY, MAX_KEY).astype(np.int32) - MIN_KEY
+        buckets *= 1 - 2 * (bits >> 31).astype(np.int32)
+        buckets += ZERO_BUCKET
+        if not valid.any():
+            return
+        self._cover(int(buckets[valid].min()), int(buckets[valid].max()) + 1)
+        width = self.sketch.shape[1]
+        # the empty values go to an extra bucket of every column
+        buckets = np.where(valid, buckets - self.first_bucket, width)
+
+        buckets += (np.arange(len(values), dtype=np.int32) * (width + 1))[:, None]
+        counts = np.bincount(buckets.ravel(), minlength=len(values) * (width + 1))
+        self.sketch[cols] += counts.reshape(len(values), width + 1)[:, :width]
+
+    def merge(self, other):
+        """
+        Add the statistics of the same columns of other values.
+        """
+        self.count += other.count
+        self.sum += other.sum
+        self.min = np.fmin(self.min, other.min)
+        self.max = np.fmax(self.max, other.max)
+        width = other.sketch.shape[1]
+        if width > 0:
+            self._cover(other.first_bucket, other.first_bucket + width)
+            start = other.first_bucket - self.first_bucket
+            self.sketch[:, start : start + width] += other.sketch
+
+    def quantiles(self, quantiles=QUANTILES):
+        """
+        The estimated quantiles of every column, an array of shape
+        (num_cols, len(quantiles)) that is NaN for empty columns.
+        """
+        width = self.sketch.shape[1]
+        representatives = bucket_values()[self.first_bucket : self.first_bucket + width]
+        cumulative = np.cumsum(self.sketch, axis=1)
+
+        result = np.full((self.num_cols, len(quantiles)), np.nan)
+        for col in np.flatnonzero(self.count):
+            ranks = np.asarray(quantiles) * (self.count[col] - 1)
+            buckets = np.searchsorted(cumulative[col], ranks, side="right")
+            result[col] = np.clip(representatives[buckets], self.min[col], self.max[col])
+        return result
+
+    def summary(self, num_bins):
+        """
+        The statistics of every column, as arrays: 'count', 'sum', 'min',
+        'max', 'mean' and 'nan_fraction' (NaN for empty columns), the
+        estimated 'quantiles' of shape (num_cols, len(QUANTILES)), the
+        'quantile_levels' and 'relative_accuracy' of the estimates, and
+        the 'range' (min, max) of all of the columns.
+
+        Parameters
+        ----------
+        num_bins: int
+            The number of bins of the resolution, empty or not
+        """
+        empty = self.count == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = self.sum / self.count
+        nan_fraction = 1 - self.count / num_bins if num_bins > 0 else np.ones(self.num_cols)
+
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": np.where(empty, np.nan, self.min),
+            "max": np.where(empty, np.nan, self.max),
+            "mean": np.where(empty, np.nan, mean),
+            "nan_fraction": nan_fraction,
+            "quantiles": self.quantiles(),
+            "quantile_levels": QUANTILES,
+            "relative_accuracy": RELATIVE_ACCURACY,
+            "range": (
+                np.nan if empty.all() else float(self.min.min()),
+                np.nan if empty.all() else float(self.max.max()),
+            ),
+        }
+
+    def write(self, group, num_bins):
+        """
+        Store the statistics in the 'row_stats' group of a resolution,
+        replacing the previous ones.
+
+        Parameters
+        ----------
+        group: h5py.Group
+            The group of a resolution
+        num_bins: int
+            The number of bins of the resolution, empty or not
+        """
+        if "row_stats" in group:
+            del group["row_stats"]
+        stats = group.create_group("row_stats")
+
+        summary = self.summary(num_bins)
+        for name in ("count", "sum", "min", "max", "mean", "nan_fraction", "quantiles"):
+            stats.create_dataset(name, data=summary[name])
+
+        stats.attrs["quantiles"] = summary["quantile_levels"]
+        stats.attrs["relative_accuracy"] = summary["relative_accuracy"]
+        # the range of all of the columns, e.g. for a shared colorbar
+        (stats.attrs["min"], stats.attrs["max"]) = summary["range"]
+
+
+def scan(dataset):
+    """
+    The statistics of the values of a stored dataset, read chunk by chunk.
+    """
+    stats = RowStats(dataset.shape[1])
+    chunk_rows = dataset.chunks[0] if dataset.chunks is not None else len(dataset)
+    for start in range(0, len(dataset), max(chunk_rows, 1)):
+        stats.add(dataset[start : start + chunk_rows])
+    return stats
+
+
+def read(group):
+    """
+    The stored statistics of a resolution as a dict of arrays, with the
+    estimated quantiles by quantile, or None if there are none.
+    """
+    if "row_stats" not in group:
+        return None
+    stats = group["row_stats"]
+    result = {
+        name: stats[name][:]
+        for name in ("count", "sum", "min", "max", "mean", "nan_fraction")
+    }
+    quantiles = stats["quantiles"][:]
+    result["quantiles"] = {
+        float(q): quantiles[:, index] for (index, q) in enumerate(stats.attrs["quantiles"])
+    }
+    result["range"] = (float(stats.attrs["min"]), float(stats.attrs["max"]))
+    return result
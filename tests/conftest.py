@@ -0,0 +1,28 @@
+import os.path as op
+import sys
+
+import numpy as np
+import pytest
+
+# the modules of the converter are at the top of the repository
+sys.path.insert(0, op.dirname(op.dirname(op.abspath(__file__))))
+
+from reference import CHROMSIZES, NUM_FILES, write_bigwig  # noqa: E402
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    """
+    The paths of the input files and the values of their bases by chromosome,
+    of shape (size, num_files).
+    """
+    rng = np.random.default_rng(0)
+    paths = []
+    bases = {chrom: np.full((size, NUM_FILES), np.nan) for (chrom, size) in CHROMSIZES}
+    for index in range(NUM_FILES):
+        path = str(tmp_path / "input{}.bw".format(index))
+        chromsizes = CHROMSIZES if index < NUM_FILES - 1 else CHROMSIZES[:2]
+        for (chrom, values) in write_bigwig(path, chromsizes, rng).items():
+            bases[chrom][:, index] = values
+        paths += [path]
+    return (paths, bases)
@@ -0,0 +1,118 @@
+"""
+Synthetic BigWig files, and the values of their zoom levels computed
+directly with numpy, that the outputs of the tests are compared with.
+"""
+
+import math
+import warnings
+
+import h5py
+import numpy as np
+import pyBigWig
+
+import convert
+
+# chr10 is only in the first files, so the last column is empty there
+CHROMSIZES = [("chr1", 5003), ("chr2", 2999), ("chr10", 1201)]
+NUM_FILES = 3
+
+# small windows, so that every chromosome is read in several of them
+WINDOW_SIZE = 1000
+
+
+def write_bigwig(path, chromsizes, rng):
+    """
+    Write runs of random values with gaps between them, and return the
+    value of every base, NaN where there is none.
+    """
+    bases = {}
+    bw = pyBigWig.open(path, "w")
+    bw.addHeader(chromsizes)
+    for (chrom, size) in chromsizes:
+        bases[chrom] = np.full(size, np.nan)
+        (starts, ends, values) = ([], [], [])
+        position = int(rng.integers(0, 20))
+        while position < size:
+            end = min(position + int(rng.integers(1, 40)), size)
+            value = float(np.float32(rng.uniform(0, 10)))
+            starts.append(position)
+            ends.append(end)
+            values.append(value)
+            bases[chrom][position:end] = value
+            position = end + int(rng.integers(0, 30))
+        bw.addEntries([chrom] * len(starts), starts, ends=ends, values=values)
+    bw.close()
+    return bases
+
+
+def bin_bases(values, resolution):
+    """
+    The mean of the covered bases of every bin, NaN for empty bins.
+    """
+    num_bins = math.ceil(len(values) / resolution)
+    padded = np.full((num_bins * resolution,) + values.shape[1:], np.nan)
+    padded[: len(values)] = values
+    padded = padded.reshape((num_bins, resolution) + values.shape[1:])
+    with warnings.catch_warnings():
+        # the mean and extremes of empty bins
+        warnings.simplefilter("ignore", RuntimeWarning)
+        return np.nanmean(padded, axis=1)
+
+
+def reference_level(base, level, aggregation):
+    """
+    The values of a zoom level, aggregated from all of the base bins that
+    every bin covers.
+    """
+    factor = 2 ** level
+    num_bins = math.ceil(len(base) / factor)
+    padded = np.full((num_bins * factor,) + base.shape[1:], np.nan)
+    padded[: len(base)] = base
+    padded = padded.reshape((num_bins, factor) + base.shape[1:])
+
+    count = (~np.isnan(padded)).sum(axis=1)
+    if aggregation == "count":
+        return count.astype(np.float64)
+    with warnings.catch_warnings():
+        # the mean and extremes of empty bins
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = {
+            "sum": np.nansum(padded, axis=1),
+            "mean": np.nanmean(padded, axis=1),
+            "max": np.nanmax(padded, axis=1),
+            "min": np.nanmin(padded, axis=1),
+        }[aggregation]
+    return np.where(count > 0, result, np.nan)
+
+
+def assert_levels(path, bases, starting_resolution=1, aggregation="sum", chroms=None):
+    """
+    Compare every resolution of a multires file with the reference of
+    the chromosomes of bases, and check that it has the chromosomes chroms
+    (default: the ones of bases).
+    """
+    names = [aggregation] if isinstance(aggregation, str) else aggregation
+    with h5py.File(path, "r") as f:
+        resolutions = sorted(int(r) for r in f["resolutions"])
+        assert resolutions[0] == starting_resolution
+        for resolution in resolutions:
+            values = f["resolutions"][str(resolution)]["values"]
+            assert sorted(values) == sorted(chroms or bases)
+            for chrom in bases:
+                base = bin_bases(bases[chrom], starting_resolution)
+                level = int(math.log2(resolution // starting_resolution))
+                expected = np.concatenate(
+                    [reference_level(base, level, name) for name in names], axis=1
+                )
+                np.testing.assert_allclose(
+                    values[chrom][:], expected, rtol=1e-5, atol=1e-5,
+                    err_msg="{} at {}".format(chrom, resolution),
+                )
+
+
+def run(inputs, output_file, **kwargs):
+    """
+    Convert the input files of the inputs fixture with small windows.
+    """
+    kwargs.setdefault("window_size", WINDOW_SIZE)
+    convert.bigwigs_to_multivec(inputs[0], str(output_file), header_index=None, **kwargs)
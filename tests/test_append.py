@@ -0,0 +1,45 @@
+"""
+Append input files to an existing multires file and compare the result
+with a conversion of all of the files at once.
+"""
+
+import h5py
+import numpy as np
+import pytest
+
+import convert
+from reference import WINDOW_SIZE, run
+
+
+@pytest.mark.parametrize("workers", [1, 2], ids=["serial", "workers"])
+@pytest.mark.parametrize("aggregation", ["sum", ["mean", "count"]], ids=["sum", "mean-count"])
+@pytest.mark.parametrize("first", [0, -1], ids=["same-chroms", "new-chrom"])
+def test_append_tracks(inputs, tmp_path, workers, aggregation, first):
+    (paths, bases) = inputs
+    # the last file has no chr10, so appending the others to it adds chr10
+    order = [paths[first]] + [path for path in paths if path != paths[first]]
+    run((order, bases), tmp_path / "full.mv5", aggregation=aggregation)
+    run((order[:1], bases), tmp_path / "appended.mv5", aggregation=aggregation)
+    convert.append_tracks(
+        str(tmp_path / "appended.mv5"), order[1:], window_size=WINDOW_SIZE, workers=workers,
+        header_index=None
+    )
+
+    with h5py.File(tmp_path / "full.mv5", "r") as full, \
+            h5py.File(tmp_path / "appended.mv5", "r") as appended:
+        for name in ("name", "length"):
+            np.testing.assert_array_equal(appended["chroms"][name][:], full["chroms"][name][:])
+        # the zoom levels of the first conversion are kept, which are
+        # fewer if a chromosome is added
+        resolutions = sorted(appended["resolutions"], key=int)
+        if first == 0:
+            assert resolutions == sorted(full["resolutions"], key=int)
+        for resolution in resolutions:
+            (expected, values) = (full["resolutions"][resolution], appended["resolutions"][resolution])
+            np.testing.assert_array_equal(values.attrs["row_infos"], expected.attrs["row_infos"])
+            assert sorted(values["values"]) == sorted(expected["values"])
+            for chrom in expected["values"]:
+                np.testing.assert_allclose(
+                    values["values"][chrom][:], expected["values"][chrom][:], rtol=1e-6,
+                    err_msg="{} at {}".format(chrom, resolution),
+                )
@@ -0,0 +1,88 @@
+"""
+Convert bedfiles with bedfile_to_multivec, and report intervals that
+overlap or aren't sorted.
+"""
+
+import h5py
+import numpy as np
+import pytest
+
+import multivec
+
+CHROMSIZES = {"chr1": 100, "chr2": 40}
+RESOLUTION = 10
+
+
+def parse_lines(lines, row_infos):
+    fields = [line.split() for line in lines]
+    vector = [float(value) for field in fields for value in field[3:]]
+    return (fields[0][0], int(fields[0][1]), int(fields[0][2]), vector)
+
+
+def convert(tmp_path, intervals, num_files=2):
+    """
+    Write every interval (chrom, start, end, value) to num_files bedfiles,
+    the values of file i multiplied by i + 1, and convert them.
+    """
+    paths = []
+    for index in range(num_files):
+        path = tmp_path / "input{}.bed".format(index)
+        path.write_text("track name=test\n" + "".join(
+            "{}\t{}\t{}\t{}\n".format(chrom, start, end, value * (index + 1))
+            for (chrom, start, end, value) in intervals
+        ))
+        paths += [str(path)]
+
+    f = h5py.File(tmp_path / "out.h5", "w")
+    for (chrom, size) in CHROMSIZES.items():
+        f.create_dataset(chrom, (size // RESOLUTION, num_files), dtype="f4", fillvalue=np.nan)
+    multivec.bedfile_to_multivec(paths, f, parse_lines, RESOLUTION, False, 3, 1)
+    return f
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # several blocks of lines per chromosome
+    monkeypatch.setattr(multivec, "BEDFILE_LINES_BLOCK_SIZE", 3)
+
+
+def test_bedfile(tmp_path):
+    intervals = [
+        ("chr1", 0, 10, 1.0), ("chr1", 20, 50, 2.0), ("chr1", 50, 60, 3.0),
+        ("chr1", 80, 100, 4.0), ("chr2", 10, 30, 5.0),
+    ]
+    with convert(tmp_path, intervals) as f:
+        expected = {chrom: np.full(size // RESOLUTION, np.nan) for (chrom, size) in CHROMSIZES.items()}
+        for (chrom, start, end, value) in intervals:
+            expected[chrom][start // RESOLUTION : end // RESOLUTION] = value
+        for chrom in CHROMSIZES:
+            np.testing.assert_array_equal(
+                f[chrom][:], np.stack([expected[chrom], 2 * expected[chrom]], axis=1)
+            )
+
+
+@pytest.mark.parametrize(
+    "intervals",
+    [
+        # within a block of lines
+        [("chr1", 0, 30, 1.0), ("chr1", 20, 40, 2.0)],
+        # across blocks of lines
+        [("chr1", 0, 10, 1.0), ("chr1", 10, 20, 1.0), ("chr1", 20, 40, 1.0), ("chr1", 30, 50, 2.0)],
+        # not sorted
+        [("chr1", 50, 60, 1.0), ("chr1", 0, 10, 2.0)],
+    ],
+    ids=["block", "across-blocks", "unsorted"],
+)
+def test_overlap(tmp_path, capsys, intervals):
+    convert(tmp_path, intervals).close()
+    err = capsys.readouterr().err
+    # the lines of the last interval are reported
+    assert "overlaps the previous one" in err
+    assert repr("chr1\t{}\t{}\t".format(*intervals[-1][1:3]))[:-1] in err
+
+
+def test_write_bins_overlap():
+    with pytest.raises(ValueError, match="overlapping or not sorted"):
+        multivec.write_bins(
+            np.zeros((10, 1)), 0, np.array([0, 2]), np.array([3, 5]), np.ones((2, 1)), 4
+        )
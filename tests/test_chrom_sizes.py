@@ -0,0 +1,139 @@
+"""
+Order the chromosomes naturally or like an assembly, and lay out the
+small contigs in a bucket.
+"""
+
+import math
+
+import h5py
+import numpy as np
+import pytest
+
+import chrom_sizes
+import convert
+import reader
+import utils
+from reference import assert_levels, run, write_bigwig
+
+# in the order of the headers of the input files, which isn't natural
+CONTIG_SIZES = [
+    ("chrUn_b", 170), ("chr2", 2999), ("chr3_random", 401), ("chr1", 5003), ("chrUn_a", 300)
+]
+BUCKET = chrom_sizes.DEFAULT_BUCKET_NAME
+
+
+@pytest.fixture
+def contig_inputs(tmp_path):
+    rng = np.random.default_rng(1)
+    paths = []
+    bases = {chrom: np.full((size, 2), np.nan) for (chrom, size) in CONTIG_SIZES}
+    for index in range(2):
+        path = str(tmp_path / "contigs{}.bw".format(index))
+        for (chrom, values) in write_bigwig(path, CONTIG_SIZES, rng).items():
+            bases[chrom][:, index] = values
+        paths += [path]
+    return (paths, bases)
+
+
+def test_natural_order():
+    chroms = ["chrUn_x", "chrM", "chr10", "chrY", "chr1_random", "chr2L", "chrX", "chr3", "chr1"]
+    assert sorted(chroms, key=utils.natural_key) == [
+        "chr1", "chr2L", "chr3", "chr10", "chrX", "chrY", "chrM", "chr1_random", "chrUn_x"
+    ]
+
+
+def test_merged_order(contig_inputs):
+    assert [chrom for (chrom, _) in convert.merge_chromsizes(contig_inputs[0])] == [
+        "chr1", "chr2", "chr3_random", "chrUn_a", "chrUn_b"
+    ]
+
+
+def test_assembly(contig_inputs, tmp_path):
+    assembly = tmp_path / "assembly.chrom.sizes"
+    # chr3_random and the chrUn contigs are skipped, chr4 is empty
+    assembly.write_text("# name size\nchr2\t2999\nchr4 100\n\nchr1\t5003\n")
+    assert chrom_sizes.load_chromsizes(str(assembly)) == [
+        ("chr2", 2999), ("chr4", 100), ("chr1", 5003)
+    ]
+
+    run(contig_inputs, tmp_path / "out.mv5", assembly=str(assembly))
+    with h5py.File(tmp_path / "out.mv5", "r") as f:
+        assert [name.decode() for name in f["chroms"]["name"][:]] == ["chr2", "chr4", "chr1"]
+    bases = {chrom: contig_inputs[1][chrom] for chrom in ("chr1", "chr2")}
+    assert_levels(tmp_path / "out.mv5", bases)
+
+    # chr4 has no values, its bins are empty
+    with reader.get_reader(str(tmp_path / "out.mv5")) as multivec:
+        tile = multivec.tile(multivec.max_zoom, 2999 // multivec.tile_size)
+        in_chr4 = np.arange(multivec.tile_size) + 2999 // multivec.tile_size * multivec.tile_size
+        chr4 = (in_chr4 >= 2999) & (in_chr4 < 3099)
+        assert np.isnan(tile[:, chr4]).all() and not np.isnan(tile[:, ~chr4]).all()
+
+
+@pytest.mark.parametrize("text", ["chr1\t-5\n", "chr1\t5\nchr1\t6\n", "chr1\n"])
+def test_invalid_chromsizes(tmp_path, text):
+    path = tmp_path / "invalid.chrom.sizes"
+    path.write_text(text)
+    with pytest.raises(ValueError):
+        chrom_sizes.read_chromsizes(str(path))
+
+
+def test_filter_contigs():
+    chromsizes = [("chr1", 5003), ("chrUn_a", 300), ("chrUn_b", 170)]
+    assert chrom_sizes.filter_contigs(chromsizes, 1000) == ([("chr1", 5003)], [])
+
+    # every contig starts at a bin of the starting resolution
+    (kept, contigs) = chrom_sizes.filter_contigs(chromsizes, 1000, BUCKET, 100)
+    assert contigs == [("chrUn_a", BUCKET, 0, 300), ("chrUn_b", BUCKET, 300, 170)]
+    assert kept == [("chr1", 5003), (BUCKET, 470)]
+
+    with pytest.raises(ValueError):
+        chrom_sizes.filter_contigs(chromsizes, 1000, "chr1")
+
+
+def tiles(path):
+    with reader.get_reader(str(path)) as multivec:
+        info = multivec.tileset_info()
+        result = []
+        for zoom in range(info["max_zoom"] + 1):
+            tile_width = info["resolutions"][zoom] * info["tile_size"]
+            for x in range(math.ceil(info["max_pos"][0] / tile_width)):
+                result += [multivec.tile(zoom, x)]
+        return (info, multivec.contigs(), result)
+
+
+def test_bucket_contigs(contig_inputs, tmp_path):
+    bases = contig_inputs[1]
+    options = dict(min_contig_size=1000, bucket_contigs=BUCKET)
+    run(contig_inputs, tmp_path / "serial.mv5", **options)
+    run(contig_inputs, tmp_path / "chrom_workers.mv5", chrom_workers=2, **options)
+    run(contig_inputs, tmp_path / "out.mvflat", backend="flat", **options)
+
+    # the contigs are laid out one after another in natural order
+    contigs = ["chr3_random", "chrUn_a", "chrUn_b"]
+    bucket = {
+        "chr1": bases["chr1"], "chr2": bases["chr2"],
+        BUCKET: np.concatenate([bases[contig] for contig in contigs]),
+    }
+    assert_levels(tmp_path / "serial.mv5", bucket)
+
+    (info, stored_contigs, serial) = tiles(tmp_path / "serial.mv5")
+    starts = np.cumsum([0] + [len(bases[contig]) for contig in contigs])[:-1].tolist()
+    assert stored_contigs == [
+        (contig, BUCKET, start, len(bases[contig])) for (contig, start) in zip(contigs, starts)
+    ]
+
+    # the output is identical with chromosome workers and in the flat backend
+    with h5py.File(tmp_path / "serial.mv5", "r") as f, \
+            h5py.File(tmp_path / "chrom_workers.mv5", "r") as g:
+        for resolution in f["resolutions"]:
+            for chrom in f["resolutions"][resolution]["values"]:
+                np.testing.assert_array_equal(
+                    g["resolutions"][resolution]["values"][chrom][:],
+                    f["resolutions"][resolution]["values"][chrom][:],
+                )
+    for path in (tmp_path / "chrom_workers.mv5", tmp_path / "out.mvflat"):
+        (other_info, other_contigs, other) = tiles(path)
+        assert (other_info, other_contigs) == (info, stored_contigs)
+        for (tile, expected) in zip(other, serial):
+            np.testing.assert_array_equal(tile, expected)
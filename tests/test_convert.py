@@ -0,0 +1,73 @@
+"""
+Convert small synthetic BigWig files and compare every zoom level of the
+output with the same aggregations computed directly with numpy.
+"""
+
+import h5py
+import numpy as np
+import pytest
+
+import convert
+from reference import NUM_FILES, assert_levels, run
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {},
+        {"workers": 2},
+        {"batch_size": 2},
+        {"chrom_workers": 2},
+        {"chrom_workers": 2, "batch_size": 2},
+    ],
+    ids=["serial", "workers", "batch_size", "chrom_workers", "chrom_workers-batch_size"],
+)
+def test_levels(inputs, tmp_path, kwargs):
+    run(inputs, tmp_path / "out.mv5", **kwargs)
+    assert_levels(tmp_path / "out.mv5", inputs[1])
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"batch_size": 2}], ids=["serial", "batch_size"])
+def test_starting_resolution_and_statistics(inputs, tmp_path, kwargs):
+    aggregation = ["sum", "mean", "max", "min", "count"]
+    run(inputs, tmp_path / "out.mv5", starting_resolution=10, aggregation=aggregation, **kwargs)
+    assert_levels(tmp_path / "out.mv5", inputs[1], 10, aggregation)
+
+
+def test_empty_bins(inputs, tmp_path):
+    run(inputs, tmp_path / "out.mv5")
+    with h5py.File(tmp_path / "out.mv5", "r") as f:
+        chr10 = f["resolutions"]["1"]["values"]["chr10"][:]
+    # the gaps between the intervals and the missing chromosome are NaN
+    assert np.isnan(chr10[:, NUM_FILES - 1]).all()
+    assert np.isnan(chr10[:, 0]).any() and not np.isnan(chr10[:, 0]).all()
+
+
+@pytest.mark.parametrize("kwargs", [{}, {"workers": 2}], ids=["serial", "workers"])
+def test_failed_conversion_releases_inputs(inputs, tmp_path, monkeypatch, kwargs):
+    (opened, pools) = ([], [])
+
+    def open_bigwigs(stack, paths):
+        opened.extend(open_bigwigs.original(stack, paths))
+        return opened
+
+    class Pool(convert.ProcessPoolExecutor):
+        def shutdown(self, *args, **kwargs):
+            pools.append(self)
+            super().shutdown(*args, **kwargs)
+
+    def failing(*args, **kwargs):
+        raise RuntimeError("the output can't be written")
+
+    open_bigwigs.original = convert.open_bigwigs
+    monkeypatch.setattr(convert, "open_bigwigs", open_bigwigs)
+    monkeypatch.setattr(convert, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(convert.cmv, "create_multivec_multires", failing)
+    with pytest.raises(RuntimeError):
+        run(inputs, tmp_path / "out.mv5", **kwargs)
+
+    assert len(pools) == (1 if kwargs else 0)
+    assert len(opened) == (0 if kwargs else len(inputs[0]))
+    for bw in opened:
+        with pytest.raises(RuntimeError):
+            bw.chroms()
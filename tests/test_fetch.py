@@ -0,0 +1,127 @@
+"""
+Download input files from a local HTTP server, keep them in the download
+cache and convert them from their URLs.
+"""
+
+import functools
+import http.server
+import os
+import os.path as op
+import threading
+
+import h5py
+import pytest
+
+import convert
+import fetch
+from reference import assert_levels, run
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    """
+    Serve the files of a directory, and redirect /redirect/<name> to them.
+    """
+
+    def do_GET(self):
+        if self.path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", self.path[len("/redirect"):])
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        super().do_GET()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(inputs):
+    directory = op.dirname(inputs[0][0])
+    httpd = http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), functools.partial(Handler, directory=directory)
+    )
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1])
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def urls(server, inputs):
+    # every other file through a redirect
+    return [
+        "{}/{}{}".format(server, "redirect/" if index % 2 else "", op.basename(path))
+        for (index, path) in enumerate(inputs[0])
+    ]
+
+
+def test_session(server, inputs):
+    session = fetch.Session()
+    with open(inputs[0][0], "rb") as f:
+        data = f.read()
+    assert session.get(server + "/" + op.basename(inputs[0][0])) == data
+    assert session.get(server + "/redirect/" + op.basename(inputs[0][0])) == data
+
+    with pytest.raises(IOError, match="404"):
+        session.get(server + "/missing.bw")
+    # the connection is still usable after an error
+    assert session.get(server + "/" + op.basename(inputs[0][0])) == data
+
+
+def test_cache_eviction(server, inputs, tmp_path):
+    (first, second) = urls(server, inputs)[:2]
+    size = op.getsize(inputs[0][0])
+    directory = str(tmp_path / "downloads")
+
+    # the pinned files of a conversion are kept even if they don't fit
+    cache = fetch.DownloadCache(directory, max_bytes=size)
+    paths = [cache.get(url, fetch.Session()) for url in (first, second)]
+    assert all(op.exists(path) for path in paths)
+    assert cache.pinned_bytes() > size
+
+    # a later conversion removes the least recently used files
+    os.utime(paths[0], ns=(0, os.stat(paths[0]).st_mtime_ns))
+    cache = fetch.DownloadCache(directory, max_bytes=size)
+    cache.get(second, fetch.Session())
+    cache.evict()
+    assert not op.exists(paths[0]) and op.exists(paths[1])
+
+
+def test_fetcher(server, inputs, tmp_path):
+    fetcher = fetch.Fetcher(str(tmp_path / "downloads"), threads=2)
+    try:
+        local = list(fetcher.paths(urls(server, inputs) + [inputs[0][0]]))
+        # local files are passed through as they are
+        assert local[-1] == inputs[0][0]
+        for (path, expected) in zip(local, inputs[0]):
+            with open(path, "rb") as f, open(expected, "rb") as g:
+                assert f.read() == g.read()
+
+        with pytest.raises(IOError, match="404"):
+            list(fetcher.paths([server + "/missing.bw"]))
+    finally:
+        fetcher.close()
+
+
+def test_convert_urls(server, inputs, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    input_urls = urls(server, inputs)
+    convert.bigwigs_to_multivec(
+        input_urls, header_index=None, download_dir=str(tmp_path / "downloads"),
+        window_size=1000
+    )
+
+    # the output is named after the file of the first URL
+    output_file = tmp_path / "input0.multires.mv5"
+    assert_levels(output_file, inputs[1])
+    with h5py.File(output_file, "r") as f:
+        row_infos = [r.decode() for r in f["resolutions"]["1"].attrs["row_infos"]]
+    assert row_infos == input_urls
+
+
+def test_missing_url(server, inputs, tmp_path, capsys):
+    input_urls = urls(server, inputs) + [server + "/missing.bw"]
+    run((input_urls, inputs[1]), tmp_path / "out.mv5", download_dir=str(tmp_path / "downloads"))
+    assert "Can not download an input file" in capsys.readouterr().out
+    assert not (tmp_path / "out.mv5").exists()
@@ -0,0 +1,41 @@
+"""
+Write flat multivec outputs, directly or from a multires file, and read
+the same tiles from them as from the multires file.
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import flatfile
+import reader
+from reference import run
+
+
+@pytest.mark.parametrize("compressed", [False, True], ids=["uncompressed", "zlib"])
+@pytest.mark.parametrize("converted", [False, True], ids=["backend", "convert_multires"])
+def test_flat(inputs, tmp_path, compressed, converted):
+    run(inputs, tmp_path / "out.mv5", row_stats=True)
+    if converted:
+        flatfile.convert_multires(
+            str(tmp_path / "out.mv5"), str(tmp_path / "out.mvflat"),
+            compression="zlib" if compressed else None
+        )
+    else:
+        run(inputs, tmp_path / "out.mvflat", backend="flat",
+            compression="gzip" if compressed else None, row_stats=True)
+
+    with reader.get_reader(str(tmp_path / "out.mv5")) as hdf5_reader, \
+            reader.get_reader(str(tmp_path / "out.mvflat")) as flat_reader:
+        info = hdf5_reader.tileset_info()
+        assert flat_reader.tileset_info() == info
+        # uncompressed files are memory-mapped, compressed ones read by block
+        assert bool(flat_reader.arrays) != compressed and bool(flat_reader.files) == compressed
+        for zoom in range(info["max_zoom"] + 1):
+            tile_width = info["resolutions"][zoom] * info["tile_size"]
+            for x in range(math.ceil(info["max_pos"][0] / tile_width)):
+                np.testing.assert_array_equal(flat_reader.tile(zoom, x), hdf5_reader.tile(zoom, x))
+            stats = (flat_reader.row_stats(zoom), hdf5_reader.row_stats(zoom))
+            for name in ("count", "min", "max", "mean"):
+                np.testing.assert_allclose(stats[0][name], stats[1][name], rtol=1e-6)
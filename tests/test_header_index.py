@@ -0,0 +1,72 @@
+"""
+Read the headers of the input files into the header index, and reuse the
+stored entries while the files don't change.
+"""
+
+import os
+
+import numpy as np
+import pyBigWig
+import pytest
+
+import header_index
+from header_index import HeaderIndex, read_header
+from reference import CHROMSIZES
+
+
+def test_read_header(inputs, tmp_path):
+    (paths, bases) = inputs
+    for (index, path) in enumerate(paths):
+        entry = read_header(path)
+        values = np.concatenate([bases[chrom][:, index] for (chrom, size) in CHROMSIZES])
+        assert entry["is_bigwig"]
+        assert [tuple(chrom) for chrom in entry["chroms"]] == [
+            chrom for chrom in CHROMSIZES if not np.isnan(bases[chrom[0]][:, index]).all()
+        ]
+        assert entry["zoom_levels"] == sorted(entry["zoom_levels"]) and entry["zoom_levels"]
+        # the exact range, not rounded like the one of pyBigWig's header()
+        assert entry["min"] == np.nanmin(values) and entry["max"] == np.nanmax(values)
+
+    path = str(tmp_path / "empty.bw")
+    bw = pyBigWig.open(path, "w")
+    bw.addHeader([("chr1", 1000)])
+    bw.close()
+    entry = read_header(path)
+    assert entry["chroms"] == [["chr1", 1000]]
+    assert entry["min"] is None and entry["max"] is None
+
+
+def test_header_index(inputs, tmp_path, monkeypatch):
+    path = inputs[0][0]
+    index_path = str(tmp_path / "index.json")
+    index = HeaderIndex(index_path)
+    entry = index.get(path)
+    index.save()
+
+    # the stored entry is used without opening the file
+    def failing(path):
+        raise AssertionError("read " + path)
+
+    monkeypatch.setattr(header_index, "read_header", failing)
+    assert {k: entry[k] for k in ("chroms", "min", "max")} == {
+        k: HeaderIndex(index_path).get(path)[k] for k in ("chroms", "min", "max")
+    }
+
+    # a modified file is read again
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with pytest.raises(AssertionError):
+        HeaderIndex(index_path).get(path)
+
+    monkeypatch.undo()
+    index = HeaderIndex(index_path)
+    assert index.get(path)["chroms"] == entry["chroms"]
+    assert index.changed
+
+
+def test_unstored_index(inputs, tmp_path):
+    # an index in memory reads every file once
+    index = HeaderIndex(None)
+    assert index.get(inputs[0][0]) is index.get(inputs[0][0])
+    index.save()
+    assert not list(tmp_path.glob("*.json"))
@@ -0,0 +1,79 @@
+"""
+Estimate the memory of conversions, fit them into memory budgets, and
+check the budgets and the dry run of bigwigs_to_multivec.
+"""
+
+import pytest
+
+import planner
+from reference import assert_levels, run
+
+CHROMSIZES = [("chr1", 50000000), ("chr2", 20000000)]
+MB = 2 ** 20
+
+
+def test_estimate():
+    serial = planner.estimate_conversion(CHROMSIZES, 100, base_memory=100 * MB)
+    assert serial["peak_memory"] == serial["buffer_memory"] + 100 * MB
+    assert serial["output_size"] > 4 * 100 * 70000000
+
+    # every worker process has the base memory and its own buffers
+    parallel = planner.estimate_conversion(CHROMSIZES, 100, chrom_workers=4, base_memory=100 * MB)
+    assert parallel["base_memory"] == 5 * 100 * MB
+    assert parallel["buffer_memory"] > 3 * serial["buffer_memory"]
+    assert parallel["temp_disk"] > 0
+
+    batched = planner.estimate_conversion(CHROMSIZES, 100, batch_size=10)
+    assert batched["buffer_memory"] < serial["buffer_memory"] / 5
+
+
+def test_plan_buffers():
+    unbounded = planner.estimate_conversion(CHROMSIZES, 100)
+    plan = planner.plan_conversion(CHROMSIZES, 100, unbounded["buffer_memory"] // 8)
+    assert plan["peak_memory"] <= unbounded["buffer_memory"] // 8
+    assert plan["window_size"] < 1000000 and plan["workers"] == 1
+
+    # a given batch size is kept
+    plan = planner.plan_conversion(CHROMSIZES, 100, 64 * MB, batch_size=50)
+    assert plan["batch_size"] == 50 and plan["peak_memory"] <= 64 * MB
+
+
+@pytest.mark.parametrize("name", ["workers", "chrom_workers"])
+def test_plan_workers(name):
+    # the base memory of the workers doesn't fit, smaller buffers don't help
+    plan = planner.plan_conversion(
+        CHROMSIZES, 10, 500 * MB, base_memory=100 * MB, **{name: 8}
+    )
+    assert 1 <= plan[name] < 8
+    assert plan["peak_memory"] <= 500 * MB
+    assert plan["base_memory"] == (1 + (plan[name] if plan[name] > 1 else 0)) * 100 * MB
+
+    # the workers are kept if they fit
+    plan = planner.plan_conversion(CHROMSIZES, 10, 64 * 1024 * MB, base_memory=MB, **{name: 8})
+    assert plan[name] == 8
+
+
+def test_plan_errors():
+    with pytest.raises(ValueError, match="before any buffers"):
+        planner.plan_conversion(CHROMSIZES, 10, 100 * MB, base_memory=200 * MB, workers=4)
+    with pytest.raises(ValueError, match="even serially"):
+        planner.plan_conversion(CHROMSIZES, 10000, 100 * MB, base_memory=100 * MB - 1000)
+
+
+def test_max_memory(inputs, tmp_path, capsys):
+    budget = planner.current_rss() + 64 * MB
+    run(inputs, tmp_path / "out.mv5", max_memory=budget, workers=64)
+    assert "Workers:" in capsys.readouterr().out
+    assert_levels(tmp_path / "out.mv5", inputs[1])
+
+    run(inputs, tmp_path / "small.mv5", max_memory=MB)
+    assert "before any buffers" in capsys.readouterr().out
+    assert not (tmp_path / "small.mv5").exists()
+
+
+def test_dry_run(inputs, tmp_path, capsys):
+    run(inputs, tmp_path / "out.mv5", dry_run=True)
+    out = capsys.readouterr().out
+    for line in ("Resolution levels:", "Peak memory:", "Temporary disk:", "Output size"):
+        assert line in out
+    assert not (tmp_path / "out.mv5").exists()
@@ -0,0 +1,77 @@
+"""
+Read tiles through the readers of get_reader, which stay open and cache
+the decompressed chunks between calls.
+"""
+
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+import reader
+from reference import run
+
+
+@pytest.fixture
+def output_file(inputs, tmp_path):
+    run(inputs, tmp_path / "out.mv5")
+    return str(tmp_path / "out.mv5")
+
+
+def test_tile(output_file):
+    multivec = reader.get_reader(output_file)
+    tile_size = multivec.tile_size
+    with h5py.File(output_file, "r") as f:
+        chr1 = f["resolutions"]["1"]["values"]["chr1"][:tile_size]
+    np.testing.assert_array_equal(multivec.tile(multivec.max_zoom, 0), chr1.T)
+
+
+def test_reuse(output_file):
+    first = reader.get_reader(output_file)
+    assert reader.get_reader(output_file) is first
+
+    # the chunks of a tile are decompressed once
+    tile = first.tile(first.max_zoom, 1)
+    misses = first.cache.misses
+    np.testing.assert_array_equal(first.tile(first.max_zoom, 1), tile)
+    assert first.cache.misses == misses and first.cache.hits > 0
+
+
+def test_closed_reader(output_file):
+    with reader.get_reader(output_file) as multivec:
+        tile = multivec.tile(multivec.max_zoom, 0)
+
+    # a closed reader isn't returned again
+    multivec = reader.get_reader(output_file)
+    np.testing.assert_array_equal(multivec.tile(multivec.max_zoom, 0), tile)
+    multivec.close()
+    multivec = reader.get_reader(output_file)
+    np.testing.assert_array_equal(multivec.tile(multivec.max_zoom, 0), tile)
+
+
+def test_modified_file(output_file):
+    first = reader.get_reader(output_file)
+    info = first.tileset_info()
+    stat = os.stat(output_file)
+    os.utime(output_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    # the reader of the old file is closed and replaced
+    second = reader.get_reader(output_file)
+    assert second is not first and not first.f
+    assert second.tileset_info() == info
+    assert reader.get_reader(output_file) is second
+
+
+def test_chunk_cache_eviction():
+    cache = reader.ChunkCache(max_bytes=3 * 80)
+    arrays = {key: np.full(10, key, dtype=np.float64) for key in range(4)}
+    for key in range(3):
+        cache.get(key, lambda: arrays[key])
+    # the least recently used array is evicted first
+    cache.get(0, lambda: arrays[0])
+    cache.get(3, lambda: arrays[3])
+    assert list(cache.arrays) == [2, 0, 3] and cache.nbytes == 3 * 80
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.clear()
+    assert cache.nbytes == 0 and not cache.arrays
@@ -0,0 +1,57 @@
+"""
+Rebuild only some regions or chromosomes of an output, and reject options
+that can't be combined.
+"""
+
+import h5py
+import numpy as np
+import pytest
+
+import convert
+from reference import assert_levels, run
+
+
+def test_regions(inputs, tmp_path):
+    run(inputs, tmp_path / "out.mv5", regions=[("chr1", 1003, 2500), ("chr2", 0, 2999)])
+    with h5py.File(tmp_path / "out.mv5", "r") as f:
+        chr1 = f["resolutions"]["1"]["values"]["chr1"][:]
+    inside = np.zeros(len(chr1), dtype=bool)
+    inside[1003:2500] = True
+    np.testing.assert_allclose(chr1[inside], inputs[1]["chr1"][inside], rtol=1e-6)
+    assert np.isnan(chr1[~inside]).all()
+    # a whole chromosome is converted at every resolution
+    assert_levels(tmp_path / "out.mv5", {"chr2": inputs[1]["chr2"]}, chroms=["chr1", "chr2"])
+
+
+def test_update(inputs, tmp_path):
+    output_file = tmp_path / "out.mv5"
+    run(inputs, output_file)
+    with h5py.File(output_file, "r+") as f:
+        for resolution in f["resolutions"]:
+            f["resolutions"][resolution]["values"]["chr2"][:] = 0
+
+    run(inputs, output_file, update=True, chroms=["chr2"])
+    assert_levels(output_file, inputs[1])
+
+
+def test_parse_regions(tmp_path):
+    assert convert.parse_regions("chr1:1000-2000, chr2") == [
+        ("chr1", 1000, 2000), ("chr2", 0, None)
+    ]
+    bed = tmp_path / "regions.bed"
+    bed.write_text("track name=regions\n# comment\nchr1\t10\t20\tname\n\nchr2\t0\t5\n")
+    assert convert.parse_regions(str(bed)) == [("chr1", 10, 20), ("chr2", 0, 5)]
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        {"update": True, "resume": True},
+        {"regions": [("chr1", 0, 100)], "preview": True},
+        {"backend": "flat", "batch_size": 2},
+        {"bucket_contigs": "chrUn"},
+    ],
+)
+def test_invalid_options(inputs, tmp_path, kwargs):
+    with pytest.raises(ValueError):
+        run(inputs, tmp_path / "out.mv5", **kwargs)
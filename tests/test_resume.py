@@ -0,0 +1,39 @@
+"""
+Interrupt a resumable conversion and resume it from its progress file.
+"""
+
+import os.path as op
+
+import pytest
+
+import convert
+from reference import assert_levels, run
+
+
+def test_resume(inputs, tmp_path, monkeypatch):
+    output_file = tmp_path / "out.mv5"
+    iter_chrom_windows = convert.iter_chrom_windows
+
+    # interrupt the conversion when it reads the second chromosome
+    def interrupted(bws, chrom, *args, **kwargs):
+        if chrom == "chr2":
+            raise KeyboardInterrupt
+        yield from iter_chrom_windows(bws, chrom, *args, **kwargs)
+
+    monkeypatch.setattr(convert, "iter_chrom_windows", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        run(inputs, output_file, resume=True)
+    assert op.exists(str(output_file) + ".progress.json")
+
+    # only the unfinished chromosomes are read again
+    converted = []
+
+    def recorded(bws, chrom, *args, **kwargs):
+        converted.append(chrom)
+        yield from iter_chrom_windows(bws, chrom, *args, **kwargs)
+
+    monkeypatch.setattr(convert, "iter_chrom_windows", recorded)
+    run(inputs, output_file, resume=True)
+    assert "chr1" not in converted and "chr2" in converted
+    assert not op.exists(str(output_file) + ".progress.json")
+    assert_levels(output_file, inputs[1])
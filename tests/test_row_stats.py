@@ -0,0 +1,34 @@
+"""
+Compare the row statistics of every resolution with the statistics of
+the stored values computed with numpy.
+"""
+
+import h5py
+import numpy as np
+import pytest
+
+from reference import run
+
+
+@pytest.mark.parametrize(
+    "kwargs", [{}, {"batch_size": 2}, {"chrom_workers": 2}],
+    ids=["serial", "batch_size", "chrom_workers"],
+)
+def test_row_stats(inputs, tmp_path, kwargs):
+    run(inputs, tmp_path / "out.mv5", row_stats=True, **kwargs)
+    with h5py.File(tmp_path / "out.mv5", "r") as f:
+        for resolution in f["resolutions"]:
+            group = f["resolutions"][resolution]
+            values = np.concatenate([group["values"][chrom][:] for chrom in group["values"]])
+            stats = group["row_stats"]
+            assert "sketch" not in stats
+            np.testing.assert_array_equal(stats["count"][:], (~np.isnan(values)).sum(axis=0))
+            np.testing.assert_allclose(stats["min"][:], np.nanmin(values, axis=0))
+            np.testing.assert_allclose(stats["max"][:], np.nanmax(values, axis=0))
+            np.testing.assert_allclose(stats["mean"][:], np.nanmean(values, axis=0), rtol=1e-5)
+
+            median = np.nanmedian(values, axis=0)
+            quantiles = stats["quantiles"][:, list(stats.attrs["quantiles"]).index(0.5)]
+            # the estimate is a bucket value within the relative accuracy,
+            # and the median of an even count may fall between two buckets
+            np.testing.assert_allclose(quantiles, median, rtol=0.15)
@@ -0,0 +1,114 @@
+"""
+Read the coarse zoom levels from the zoom-level summaries of the input
+files, which are approximate, and the finer ones from the base data.
+"""
+
+import h5py
+import numpy as np
+import pyBigWig
+import pytest
+
+import convert
+from header_index import read_header
+from reference import assert_levels, bin_bases, reference_level, run, write_bigwig
+
+# long enough for the input files to have zoom levels below the coarsest
+# resolutions of the output
+CHROMSIZES = [("chr1", 400000)]
+
+
+@pytest.fixture
+def long_inputs(tmp_path):
+    rng = np.random.default_rng(0)
+    paths = []
+    bases = {chrom: np.full((size, 2), np.nan) for (chrom, size) in CHROMSIZES}
+    for index in range(2):
+        path = str(tmp_path / "input{}.bw".format(index))
+        for (chrom, values) in write_bigwig(path, CHROMSIZES, rng).items():
+            bases[chrom][:, index] = values
+        paths += [path]
+    return (paths, bases)
+
+
+def zoom_resolutions(path):
+    with h5py.File(path, "r") as f:
+        return sorted(
+            int(r) for r in f["resolutions"]
+            if f["resolutions"][r].attrs.get("source") == "zoom-data"
+        )
+
+
+def test_zoom_summary_resolutions(long_inputs):
+    finest = max(read_header(path)["zoom_levels"][0] for path in long_inputs[0])
+    resolutions = [2 ** i for i in range(12)]
+
+    # a bin has to hold the finest zoom level of every file at least twice
+    assert convert.get_zoom_summary_resolutions(long_inputs[0], resolutions) == [
+        r for r in resolutions if r >= 2 * finest
+    ]
+    assert convert.get_zoom_summary_resolutions(long_inputs[0], resolutions, 2048) == [2048]
+
+
+@pytest.mark.parametrize("aggregation", ["sum", "mean", "max", "min", "count"])
+def test_zoom_summaries(long_inputs, tmp_path, monkeypatch, aggregation):
+    read = []
+
+    def recorded(bw, chrom, start_bin, end_bin, resolution, *args):
+        read.append(resolution)
+        return read_zoom_window(bw, chrom, start_bin, end_bin, resolution, *args)
+
+    read_zoom_window = convert.read_zoom_window
+    monkeypatch.setattr(convert, "read_zoom_window", recorded)
+    output_file = tmp_path / "out.mv5"
+    run(long_inputs, output_file, aggregation=aggregation, zoom_summaries=0)
+
+    # only the finest zoom level from the summaries is read
+    summarized = zoom_resolutions(output_file)
+    assert summarized and set(read) == {summarized[0]}
+
+    with h5py.File(output_file, "r") as f:
+        base = bin_bases(long_inputs[1]["chr1"], 1)
+        for resolution in sorted(int(r) for r in f["resolutions"]):
+            values = f["resolutions"][str(resolution)]["values"]["chr1"][:]
+            expected = reference_level(base, resolution.bit_length() - 1, aggregation)
+            if resolution not in summarized:
+                # the finer zoom levels are exact
+                np.testing.assert_allclose(values, expected, rtol=1e-5, atol=1e-5)
+                continue
+            # the summaries are approximate, but close for most bins
+            assert (np.isnan(values) == np.isnan(expected)).all()
+            error = np.abs(values - expected) / np.maximum(np.abs(expected), 1e-6)
+            assert np.nanmedian(error) < 0.1, resolution
+
+
+def test_preview(long_inputs, tmp_path):
+    run(long_inputs, tmp_path / "out.mv5", zoom_summaries=0)
+    run(long_inputs, tmp_path / "preview.mv5", preview=True)
+
+    summarized = zoom_resolutions(tmp_path / "preview.mv5")
+    assert summarized == zoom_resolutions(tmp_path / "out.mv5")
+    with h5py.File(tmp_path / "out.mv5", "r") as f, \
+            h5py.File(tmp_path / "preview.mv5", "r") as preview:
+        for resolution in preview["resolutions"]:
+            values = preview["resolutions"][resolution]["values"]["chr1"][:]
+            if int(resolution) in summarized:
+                expected = f["resolutions"][resolution]["values"]["chr1"][:]
+                np.testing.assert_array_equal(values, expected)
+            else:
+                assert np.isnan(values).all()
+
+
+def test_preview_without_summaries(long_inputs, tmp_path):
+    path = str(tmp_path / "no_zooms.bw")
+    bw = pyBigWig.open(path, "w")
+    bw.addHeader(CHROMSIZES, maxZooms=0)
+    bw.addEntries(["chr1"], [0], ends=[100], values=[1.0])
+    bw.close()
+
+    run(([path], None), tmp_path / "out.mv5", preview=True)
+    assert not (tmp_path / "out.mv5").exists()
+
+    # without summaries every zoom level is read from the base data
+    run(long_inputs, tmp_path / "out.mv5", zoom_summaries=10 ** 9)
+    assert zoom_resolutions(tmp_path / "out.mv5") == []
+    assert_levels(tmp_path / "out.mv5", long_inputs[1])
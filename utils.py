@@ -1,26 +1,141 @@
+import functools
+import re
+import struct
 import time
 
-CHROMOSOME_ORDER = [
-    "chr1", "chr2", "chr3", "chr4", "chr5",
-    "chr6", "chr7", "chr8", "chr9", "chr10",
-    "chr11", "chr12", "chr13", "chr14", "chr15",
-    "chr16", "chr17", "chr18", "chr19", "chr20",
-    "chr21", "chr22", "chrX", "chrY"
-]
+# The names of the sex and mitochondrial chromosomes (without 'chr'), in
+# the order they come after the numbered chromosomes. Other names come
+# between the sex and the mitochondrial chromosomes.
+NAMED_CHROMOSOME_ORDER = {"X": 0, "Y": 1, "Z": 2, "W": 3, "M": 5, "MT": 5}
+
+# The numbers in a chromosome name.
+NUMBERS = re.compile(r"(\d+)")
+
+@functools.lru_cache(maxsize=None)
+def natural_key(chrom):
+    """
+    The sort key of a chromosome in natural order: the numbered
+    chromosomes by their numbers (chr2 before chr10, chr2L before chr3),
+    then the named ones (chrX, chrY, ..., chrM), then the scaffolds and
+    alternative contigs, i.e. names with an underscore, sorted by their
+    text and numbers. The 'chr' prefix is ignored. The keys are cached,
+    so that they are computed once per name.
+
+    Parameters
+    ----------
+    chrom: str
+    """
+    name = (chrom[3:] if chrom[:3].lower() == "chr" else chrom).upper()
+    # the text and the numbers of the name, which alternate
+    parts = NUMBERS.split(name)
+    parts[1::2] = [int(number) for number in parts[1::2]]
+
+    if "_" in name:
+        group = (2, 0)
+    elif name[:1].isdigit():
+        group = (0, 0)
+    else:
+        group = (1, NAMED_CHROMOSOME_ORDER.get(name, 4))
+    # the name itself orders names that only differ in case or leading zeros
+    return group + (tuple(parts), chrom)
 
 def sort_by_chrom(x):
     """
-    Sort a list by the predefined chromosome order
+    Sort a list by the natural chromosome order, see natural_key
 
     Parameters
     ----------
     x: tuple (chromosome, size)
     """
-    return CHROMOSOME_ORDER.index(x[0]) if x[0] in CHROMOSOME_ORDER else 999
+    return natural_key(x[0])
+
+# The magic number at the start of a bigWig file.
+BIGWIG_MAGIC = 0x888FFC26
+
+def read_bigwig_zoom_levels(path):
+    """
+    Read the reduction levels (the number of bases summarized in each
+    record) of the zoom levels of a local bigwig file from its header.
+
+    Parameters
+    ----------
+    path: bigwig file path
+
+    Returns
+    -------
+    A sorted list of reduction levels, or None if the file can not be
+    read as a bigwig file (e.g. it is a URL).
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(64)
+            if len(header) < 64:
+                return None
+
+            byte_order = "<"
+            if struct.unpack("<I", header[:4])[0] != BIGWIG_MAGIC:
+                byte_order = ">"
+                if struct.unpack(">I", header[:4])[0] != BIGWIG_MAGIC:
+                    return None
+
+            num_zoom_levels = struct.unpack(byte_order + "H", header[6:8])[0]
+            zoom_headers = f.read(24 * num_zoom_levels)
+    except (IOError, OSError):
+        return None
+
+    return sorted(
+        struct.unpack(byte_order + "I", zoom_headers[i * 24 : i * 24 + 4])[0]
+        for i in range(num_zoom_levels)
+    )
+
+def read_bigwig_summary(path):
+    """
+    Read the summary of all of the values of a local bigwig file from
+    its header, without reading any data or zoom level.
+
+    Parameters
+    ----------
+    path: bigwig file path
+
+    Returns
+    -------
+    {'bases_covered': int, 'min': float, 'max': float, 'sum': float}, with
+    a min and max of None if the file has no values, or None if the file
+    can not be read as a bigwig file (e.g. it is a URL).
+    """
+    try:
+        with open(path, "rb") as f:
+            header = f.read(64)
+            if len(header) < 64:
+                return None
+
+            byte_order = "<"
+            if struct.unpack("<I", header[:4])[0] != BIGWIG_MAGIC:
+                byte_order = ">"
+                if struct.unpack(">I", header[:4])[0] != BIGWIG_MAGIC:
+                    return None
+
+            summary_offset = struct.unpack(byte_order + "Q", header[44:52])[0]
+            if summary_offset == 0:
+                return None
+            f.seek(summary_offset)
+            summary = f.read(40)
+    except (IOError, OSError):
+        return None
+    if len(summary) < 40:
+        return None
+
+    (bases_covered, min_value, max_value, sum_data) = struct.unpack(
+        byte_order + "Qddd", summary[:32]
+    )
+    if bases_covered == 0:
+        (min_value, max_value) = (None, None)
+    return {"bases_covered": bases_covered, "min": min_value, "max": max_value, "sum": sum_data}
 
-start_time = time.time()
+start_time = time.perf_counter()
 def set_time():
-    start_time = time.time()
+    global start_time
+    start_time = time.perf_counter()
 
 def get_time_duration():
-    return "(" + str(int(time.time() - start_time)) + " sec.)"
\ No newline at end of file
+    return "({:.2f} sec.)".format(time.perf_counter() - start_time)
\ No newline at end of file